@@ -1,8 +1,57 @@
 __author__ = 'Elahe'
 
 import numpy as np
+import multiprocessing
+import queue
+import os
+
+# Set in each pool worker
+_worker_evaluator = None
+
+
+def _init_worker(evaluator):
+    global _worker_evaluator
+    _worker_evaluator = evaluator
+
+
+def _evaluate(job):
+    return _evaluate_candidate(_worker_evaluator, *job)
+
+
+def _evaluate_candidate(evaluator, candidate, seed, refine):
+    """Score one candidate. Seeding per candidate makes the score independent of which
+    worker (or what order) it was evaluated in.
+    Returns the score, the refined individual (or None), and the candidate (the target may modify it).
+    """
+    state = np.random.get_state()
+    if seed is not None:
+        np.random.seed(seed)
+    try:
+        score = evaluator.target(candidate)
+        refined = evaluator.refined_individual() if refine else None
+    finally:
+        np.random.set_state(state)
+    return score, refined, candidate
+
 
 class DE_optimizer(object):
+    """Differential evolution optimizer
+
+    Parameters (beyond the DE ones)
+    ----------
+    n_workers : int (1)
+        Number of processes to score candidates with. 1 scores them in this process.
+    seed : int (None)
+        Seed for the population, trials and each candidate evaluation. With a seed, a run
+        (and a resumed run) is reproducible regardless of n_workers.
+    async_generations : bool (False)
+        If True (and n_workers > 1), each trial is selected as soon as its score comes back and a new
+        trial is started in its place, so a slow candidate does not hold up a generation. The
+        order trials finish in is not reproducible.
+    score_log : str (None)
+        File to append every candidate score to. Candidates already in the log are not scored again,
+        so an interrupted run picks up where it left off (with load_candidate_solution and a seed).
+    """
     def __init__(self,
                evaluator,
                population_size,
@@ -15,7 +64,11 @@ class DE_optimizer(object):
                show_progress = 1,
                monitor_cycle = np.inf,
                gray_training = False,
-               load_candidate_solution = False):
+               load_candidate_solution = False,
+               n_workers = 1,
+               seed = None,
+               async_generations = False,
+               score_log = None):
 
         self.show_progress = show_progress
         self.evaluator = evaluator
@@ -39,9 +92,43 @@ class DE_optimizer(object):
         self.gray_training = gray_training
         self.load_candidate_solution = load_candidate_solution
 
+        self.n_workers = n_workers
+        self.seed = seed
+        self.async_generations = async_generations
+        self.score_log = score_log
+        self.score_cache = {}
+        self.pool = None
+        self.load_score_log()
+
         self.optimize()
 
     def optimize(self):
+        self.start_pool()
+        try:
+            self._optimize()
+        finally:
+            self.close_pool()
+
+    def start_pool(self):
+        if self.n_workers > 1:
+            # Fork so the workers get the evaluator without pickling it
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            self.pool = context.Pool(self.n_workers, initializer=_init_worker, initargs=(self.evaluator,))
+        self.in_flight = {}
+        self.n_submitted = 0
+
+    def close_pool(self):
+        if self.pool is not None:
+            # Let any trials still running finish: Pool.terminate can deadlock if a worker
+            # is killed while the pool is handing it a task
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _optimize(self):
     # initialize optimization
         self.initialize_optimization()
     # initialize the population
@@ -57,7 +144,10 @@ class DE_optimizer(object):
 
     # iterations
         while not self.terminate():
-            self.evolve()
+            if self.async_generations and self.pool is not None:
+                self.evolve_async()
+            else:
+                self.evolve()
             self.update_progress()
             self.print_status()
             self.monitor()
@@ -72,6 +162,8 @@ class DE_optimizer(object):
         self.count  = 0
         self.nfeval = 0
         self.after_score_pop = np.zeros((self.population_size,self.D))
+        if self.seed is not None:
+            np.random.seed(self.seed)
 
     def make_random_population(self):
         for indiv in range(self.population_size):
@@ -83,12 +175,59 @@ class DE_optimizer(object):
             ind =  np.multiply(np.random.rand(1,self.D), delta) + offset
             return ind
 
+    def candidate_seed(self, indx, phase):
+        if self.seed is None:
+            return None
+        return [self.seed, self.count, phase, indx]
+
+    def score_candidates(self, candidates, refine, phase):
+        """Score a set of candidates, in parallel if there is a pool.
+
+        Parameters
+        ----------
+        candidates : np.array
+            (N, D) array of candidates. Rows are updated if the target modifies them.
+        refine : bool
+            Also get the refined individuals from the evaluator
+        phase : int
+            Distinguishes the seeds of the different kinds of scoring done in one generation
+
+        Returns
+        -------
+        scores : np.array
+        refined : list of np.array (or None)
+        """
+        scores = np.zeros(np.shape(candidates)[0])
+        refined = [None] * np.size(scores)
+        todo = []
+        for indx in range(np.size(scores)):
+            key = self.cache_key(candidates[indx, :])
+            if (not refine) and (key in self.score_cache):
+                scores[indx], candidates[indx, :] = self.score_cache[key]
+            else:
+                todo.append(indx)
+
+        unscored = [candidates[indx, :].copy() for indx in todo]
+        jobs = [(candidate.copy(), self.candidate_seed(indx, phase), refine) for indx, candidate in zip(todo, unscored)]
+        if self.pool is None:
+            results = [_evaluate_candidate(self.evaluator, *job) for job in jobs]
+        else:
+            results = self.pool.map(_evaluate, jobs)
+
+        for indx, unscored_candidate, (score, refined_ind, candidate) in zip(todo, unscored, results):
+            self.record_score(indx, unscored_candidate, score, candidate)
+            scores[indx] = score
+            refined[indx] = refined_ind
+            candidates[indx, :] = candidate
+            self.nfeval += 1
+        return scores, refined
+
     def score_population(self):
+        scores, refined = self.score_candidates(self.population, True, 1)
         for indiv in range(self.population_size):
-            self.scores[indiv] = self.evaluator.target(self.population[indiv, :])
-            self.nfeval += 1
+            self.scores[indiv] = scores[indiv]
             '''change individuals for the refined values by gray training '''
-            self.after_score_pop[indiv,:] = self.evaluator.refined_individual()
+            self.after_score_pop[indiv,:] = refined[indiv]
             self.print_ind(indiv, self.scores[indiv], self.population[indiv, :], self.after_score_pop[indiv,:])
 
 
@@ -115,12 +254,18 @@ class DE_optimizer(object):
         self.count += 1
 
     def evolve(self):
+        if self.seed is not None:
+            # Seed each generation, so a resumed run makes the same trials
+            np.random.seed([self.seed, self.count])
     #Candidate
         self.ui = self.cal_trials()
         self.after_score_ui = np.zeros(np.shape(self.ui))
+        trial_scores, refined = self.score_candidates(self.ui, self.gray_training, 0)
     #Selection
         for trial_indx in range(self.population_size):
-            trial_score = self.score_trial(trial_indx)
+            trial_score = trial_scores[trial_indx]
+            if self.gray_training:
+                self.after_score_ui[trial_indx, :] = refined[trial_indx]
 
             if (trial_score < self.scores[trial_indx]) :
                 self.population[trial_indx,:] = self.ui[trial_indx,:]
@@ -130,12 +275,83 @@ class DE_optimizer(object):
             self.print_ind(trial_indx,self.scores[trial_indx], self.population[trial_indx,:], self.after_score_pop[trial_indx,:])
         self.save_last_generation() # most recent generation
 
-    def score_trial(self, trial_indx):
-        tempval = self.evaluator.target(self.ui[trial_indx,:])
-        self.nfeval += 1
-        if self.gray_training:
-            self.after_score_ui[trial_indx, :] = self.evaluator.refined_individual()
-        return tempval
+    def evolve_async(self):
+        """Steady-state evolution: keep every worker busy, and select each trial against its
+        target individual as soon as it is scored. Returns after population_size trials.
+        """
+        if self.seed is not None:
+            np.random.seed([self.seed, self.count])
+        if not hasattr(self, 'done_queue'):
+            self.done_queue = queue.Queue()
+        n_done = 0
+        while n_done < self.population_size:
+            self.submit_trials()
+            trial_indx, trial, seed, result, cached = self.done_queue.get()
+            del self.in_flight[trial_indx]
+            if isinstance(result, BaseException):
+                raise result
+            trial_score, refined, candidate = result
+            if not cached:
+                self.record_score(trial_indx, trial, trial_score, candidate)
+                self.nfeval += 1
+            n_done += 1
+            if trial_score < self.scores[trial_indx]:
+                self.population[trial_indx, :] = candidate
+                self.scores[trial_indx] = trial_score
+                if self.gray_training:
+                    self.after_score_pop[trial_indx, :] = refined
+            self.print_ind(trial_indx, self.scores[trial_indx], self.population[trial_indx, :],
+                           self.after_score_pop[trial_indx, :])
+        self.save_last_generation()
+
+    def submit_trials(self):
+        """Start trials for individuals that don't have one running, until all the workers are busy.
+        A trial already in the score cache is put straight on the done queue, without a worker.
+        """
+        # Each individual has at most one trial running
+        while len(self.in_flight) < min(self.n_workers, self.population_size):
+            trial_indx = self.n_submitted % self.population_size
+            self.n_submitted += 1
+            if trial_indx in self.in_flight:
+                continue
+            trial = self.cal_trial(trial_indx)
+            seed = None if self.seed is None else [self.seed, self.n_submitted]
+            self.in_flight[trial_indx] = trial
+
+            key = self.cache_key(trial)
+            if (not self.gray_training) and (key in self.score_cache):
+                score, candidate = self.score_cache[key]
+                self.done_queue.put((trial_indx, trial, seed, (score, None, candidate.copy()), True))
+                continue
+
+            # An exception raised by the target is put on the queue too, and re-raised by evolve_async
+            def callback(result, trial_indx=trial_indx, trial=trial, seed=seed):
+                self.done_queue.put((trial_indx, trial, seed, result, False))
+            self.pool.apply_async(_evaluate, ((trial.copy(), seed, self.gray_training),), callback=callback,
+                                  error_callback=callback)
+
+    def cache_key(self, candidate):
+        return np.asarray(candidate, dtype=float).tobytes()
+
+    def record_score(self, indx, candidate, score, scored_candidate):
+        """Remember a candidate's score, and append it to the score log.
+        scored_candidate is the candidate as the evaluator left it (target can modify it).
+        """
+        scored_candidate = np.array(scored_candidate, dtype=float)
+        self.score_cache[self.cache_key(candidate)] = (score, scored_candidate)
+        if self.score_log is not None:
+            with open(self.score_log, 'a') as log_file:
+                values = [self.count, indx, score] + list(np.asarray(candidate, dtype=float)) + list(scored_candidate)
+                log_file.write(' '.join(['%.17g' % value for value in values]) + '\n')
+
+    def load_score_log(self):
+        if (self.score_log is None) or (not os.path.isfile(self.score_log)):
+            return
+        log = np.loadtxt(self.score_log, ndmin=2)
+        for row in log:
+            if row.size == 2*self.D + 3:
+                self.score_cache[self.cache_key(row[3:3+self.D])] = (row[2], row[3+self.D:])
+        print('Loaded {} scores from {}'.format(len(self.score_cache), self.score_log))
 
     def monitor(self):
         if self.count != 0 and self.count % self.monitor_cycle == 0:
@@ -159,10 +375,7 @@ class DE_optimizer(object):
         self.score_population()
 
     def cal_trials(self):
-        popold = self.population
-
         rot = np.arange(0, self.population_size)
-        rotd= np.arange(0, self.D)
         ind    = np.random.permutation(4)
 
         a1 = np.random.permutation(self.population_size)
@@ -175,21 +388,41 @@ class DE_optimizer(object):
         rt = (rot + ind[3]) % self.population_size
         a5 = a4[rt]
 
-        pm1 = self.population[a1,:]
-        pm2 = self.population[a2,:]
-        pm3 = self.population[a3,:]
-        pm4 = self.population[a4,:]
-        pm5 = self.population[a5,:]
+        return self.mutate(self.population, [a1, a2, a3, a4, a5])
+
+    def cal_trial(self, trial_indx):
+        """Make the trial for one individual, without making a whole population of them.
+
+        Returns
+        -------
+        np.array of length D
+        """
+        donors = np.random.choice(self.population_size, 5, replace=self.population_size < 5)
+        donors = [donors[i:i+1] for i in range(5)]
+        return self.mutate(self.population[trial_indx:trial_indx+1, :], donors)[0, :]
+
+    def mutate(self, popold, donors):
+        """Mutation and crossover of the target individuals popold, with the donor individuals
+        at indices donors (five arrays with an index per row of popold).
+        """
+        n_rows = np.shape(popold)[0]
+        rotd= np.arange(0, self.D)
+
+        pm1 = self.population[donors[0],:]
+        pm2 = self.population[donors[1],:]
+        pm3 = self.population[donors[2],:]
+        pm4 = self.population[donors[3],:]
+        pm5 = self.population[donors[4],:]
 
-        pop_of_best_ind = np.zeros((self.population_size,self.D))
-        for i in range(0, self.population_size) :
+        pop_of_best_ind = np.zeros((n_rows,self.D))
+        for i in range(0, n_rows) :
             pop_of_best_ind[i] = self.best_ind
 
-        cr_decision = np.random.rand(self.population_size,self.D) < self.cr
+        cr_decision = np.random.rand(n_rows,self.D) < self.cr
 
         if (self.strategy > 5) :
             cr_decision = np.sort(np.transpose(cr_decision))
-            for i in range(0, self.population_size) :
+            for i in range(0, n_rows) :
                 n = np.floor(np.random.rand(1) * self.D)
                 if n > 0 :
                     rtd = (rotd + n) % self.D
@@ -253,6 +486,7 @@ class DE_optimizer(object):
     def save_last_generation(self):
         np.save('last_gen_pop', self.population)
         np.save('last_gen_scr', self.scores)
+        np.save('last_gen_state', np.array([self.count, self.nfeval]))
 
     def load_generation(self):
         try:
@@ -266,6 +500,8 @@ class DE_optimizer(object):
             else:
                 self.population = temp_population
                 self.scores = np.load('last_gen_scr.npy')
+                if os.path.isfile('last_gen_state.npy'):
+                    self.count, self.nfeval = np.load('last_gen_state.npy')
                 print('Warm start: DE starts with a previously evolved population')
 
         except:
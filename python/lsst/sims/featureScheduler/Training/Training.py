@@ -1,42 +1,101 @@
 import numpy as np
 import lsst.sims.featureScheduler.Training as opt
 import lsst.sims.featureScheduler as fs
-from lsst.sims.speedObservatory import Speed_observatory
+import lsst.sims.featureScheduler.basis_functions as bf
+from lsst.sims.featureScheduler.surveys import Greedy_survey
+from lsst.sims.featureScheduler.schedulers import Core_scheduler
+from lsst.sims.featureScheduler.modelObservatory import Model_observatory
+from lsst.sims.featureScheduler.utils import standard_goals
 
 
+def simple_performance_measure(observations, preferences):
+    """Preference weighted sum of the number of visits and their mean five-sigma depth.
+    """
+    if np.size(observations) == 0:
+        return 0.
+    measures = np.array([np.size(observations), np.mean(observations['fivesigmadepth'])])
+    preferences = np.asarray(preferences, dtype=float)
+    return np.sum(preferences * measures[:np.size(preferences)])
+
 
 class BlackTraining(object):
-    def __init__(self, preferences = [1], gray_train = False, custom_period = 1):
+    def __init__(self, preferences = [1], gray_train = False, custom_period = 1, warmup_length = None, use_fork = True,
+                 nside = 32):
 
         self.pref       = preferences
+        self.nside      = nside
 
         self.survey_length = 0.2  # days
+        # If set, simulate this many days once and score every candidate from there (see warm_up)
+        self.warmup_length = warmup_length
+        self.use_fork = use_fork
+        self.snapshot = None
         self.surveys = []
         survey_filters = ['r']
+        target_map = standard_goals(nside=nside)
         for f in survey_filters:
             self.bfs = []
-            self.bfs.append(fs.Slewtime_basis_function_cost(filtername=f))
-            self.bfs.append(fs.Visit_repeat_basis_function_cost(filtername=f,survey_filters=survey_filters))
-            self.bfs.append(fs.Target_map_basis_function_cost(filtername=f, survey_filters=survey_filters))
-            self.bfs.append(fs.Normalized_alt_basis_function_cost(filtername=f))
-            self.bfs.append(fs.Hour_angle_basis_function_cost())
-            self.bfs.append(fs.Depth_percentile_basis_function_cost())
-            weights = np.array([5,2,1,1,2,1])
-            self.surveys.append(fs.Simple_greedy_survey_fields_cost(self.bfs, weights, filtername=f, block_size= 10))
-
-    def DE_opt(self, N_p, F, Cr, maxIter, D, domain, load_candidate_solution, gray_trianing = False):
+            self.bfs.append(bf.Slewtime_basis_function(filtername=f, nside=nside))
+            self.bfs.append(bf.Visit_repeat_basis_function(filtername=f, nside=nside))
+            self.bfs.append(bf.Target_map_basis_function(filtername=f, target_map=target_map[f],
+                                                         out_of_bounds_val=np.nan, nside=nside))
+            self.bfs.append(bf.M5_diff_basis_function(filtername=f, nside=nside))
+            self.bfs.append(bf.Filter_change_basis_function(filtername=f))
+            self.bfs.append(bf.Strict_filter_basis_function(filtername=f))
+            # Masks, not trained
+            self.bfs.append(bf.Zenith_shadow_mask_basis_function(nside=nside, shadow_minutes=60., max_alt=76.))
+            self.bfs.append(bf.Moon_avoidance_basis_function(nside=nside, moon_distance=30.))
+            weights = np.array([5,2,1,1,2,1,0,0])
+            self.surveys.append(Greedy_survey(self.bfs, weights, filtername=f, block_size= 10, nside=nside))
+
+    def set_weights(self, surveys, x):
+        """Set the trained weights of the surveys, the masks keep a weight of zero.
+        """
+        for survey in surveys:
+            weights = np.zeros(np.size(survey.basis_weights))
+            weights[:np.size(x)] = x
+            survey.basis_weights = weights
+
+    def DE_opt(self, N_p, F, Cr, maxIter, D, domain, load_candidate_solution, gray_trianing = False,
+               n_workers = 1, seed = None, async_generations = False, score_log = None):
         self.D               = D
         self.domain          = domain
-        self.optimizer       = opt.DE_optimizer(self, N_p, F, Cr, maxIter, gray_training = gray_trianing, load_candidate_solution = load_candidate_solution)
+        if self.warmup_length is not None and self.snapshot is None:
+            self.warm_up()
+        self.optimizer       = opt.DE_optimizer(self, N_p, F, Cr, maxIter, gray_training = gray_trianing,
+                                            load_candidate_solution = load_candidate_solution,
+                                            n_workers = n_workers, seed = seed,
+                                            async_generations = async_generations, score_log = score_log)
+
+    def warm_up(self):
+        """Simulate the warm-up period with the starting weights and snapshot the result.
+        """
+        scheduler = Core_scheduler(self.surveys, nside=self.nside)
+        observatory = Model_observatory(nside=self.nside)
+        observatory, scheduler, observations = fs.sim_runner(observatory, scheduler, survey_length=self.warmup_length,
+                                                             verbose=False)
+        self.snapshot = opt.Sim_snapshot(observatory, scheduler)
+
+    def score_window(self, x, observatory, scheduler):
+        """Set the weights and score only the observations after the snapshot.
+        """
+        for surveys in scheduler.survey_lists:
+            self.set_weights(surveys, x)
+        observatory, scheduler, observations = fs.sim_runner(observatory, scheduler, survey_length=self.survey_length,
+                                                             verbose=False)
+        return -1 * simple_performance_measure(observations, self.pref)
 
     def target(self, x):
         x[0] = 5 # reduce redundant solutions
-        for survey in self.surveys:
-            survey.basis_weights = x
-        scheduler = fs.Core_scheduler_cost(self.surveys)
-        observatory = Speed_observatory()
-        observatory, scheduler, observations = fs.sim_runner(observatory, scheduler, survey_length=self.survey_length)
-        return -1 * fs.simple_performance_measure(observations, self.pref)
+        if self.snapshot is not None:
+            return self.snapshot.evaluate(lambda observatory, scheduler: self.score_window(x, observatory, scheduler),
+                                          fork=self.use_fork)
+        self.set_weights(self.surveys, x)
+        scheduler = Core_scheduler(self.surveys, nside=self.nside)
+        observatory = Model_observatory(nside=self.nside)
+        observatory, scheduler, observations = fs.sim_runner(observatory, scheduler, survey_length=self.survey_length,
+                                                             verbose=False)
+        return -1 * simple_performance_measure(observations, self.pref)
 
     def refined_individual(self):
         return np.zeros(self.D)
@@ -50,12 +109,16 @@ Cr      = 0.8    # algorithm meta parameter (crossover rate that determines the
 maxIter = 100    # maximum number of iterations. maximum number of function evaluations = N_p * maxIter,
 Domain  = np.array([[0,10], [0,10], [0,10], [0,10], [0,10], [0,10]]) # Final solution would lie in this domain
 D       = 6      # weights dimension
+n_workers = 1    # number of processes to score candidates with
+seed    = 42     # makes the run reproducible, and resumable from the score log
+score_log = 'Output/scores.txt'  # every candidate score, so an interrupted run does not score them again
 
 
 
 
 train   = BlackTraining()
-train.DE_opt(N_p, F, Cr, maxIter, D, Domain, load_candidate_solution = False)
+train.DE_opt(N_p, F, Cr, maxIter, D, Domain, load_candidate_solution = False,
+             n_workers = n_workers, seed = seed, score_log = score_log)
 
 
 
@@ -1,2 +1,3 @@
 
 from .DEoptimizer import *
+from .snapshot import *
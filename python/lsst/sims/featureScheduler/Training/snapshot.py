@@ -0,0 +1,83 @@
+import copy
+import os
+import pickle
+import traceback
+
+__all__ = ['Sim_snapshot']
+
+
+class Sim_snapshot(object):
+    """A saved observatory and scheduler state that candidates can be evaluated from.
+
+    Training usually scores every candidate over the same window of time, after a warm-up
+    period that is identical for all of them. Simulate the warm-up once, snapshot it, then
+    evaluate each candidate from the snapshot.
+
+    Parameters
+    ----------
+    observatory : observatory object
+        The observatory at the end of the warm-up.
+    scheduler : lsst.sims.featureScheduler.schedulers.Core_scheduler
+        The scheduler at the end of the warm-up.
+    shared : list (None)
+        Large read-only objects that copies should share rather than duplicate. Defaults to the
+        observatory sky_model and almanac, if it has them.
+    """
+    def __init__(self, observatory, scheduler, shared=None):
+        if shared is None:
+            shared = [getattr(observatory, name) for name in ['sky_model', 'almanac']
+                      if hasattr(observatory, name)]
+        self.shared = shared
+        self.observatory, self.scheduler = self._copy(observatory, scheduler)
+
+    def _copy(self, observatory, scheduler):
+        # Putting the shared objects in the memo makes deepcopy use them as-is
+        memo = {id(obj): obj for obj in self.shared}
+        return copy.deepcopy((observatory, scheduler), memo)
+
+    def restore(self):
+        """Return a fresh (observatory, scheduler) copy of the snapshot.
+        """
+        return self._copy(self.observatory, self.scheduler)
+
+    def evaluate(self, func, fork=True):
+        """Run func(observatory, scheduler) starting from the snapshot and return the result.
+
+        Parameters
+        ----------
+        func : callable
+            Runs the candidate and returns its score. Free to modify the observatory and scheduler.
+        fork : bool (True)
+            Run func in a forked child process. The child sees the snapshot copy-on-write, so nothing
+            is copied up front. The result is sent back pickled. If False (or fork is not
+            available), func runs here on a deep copy.
+        """
+        if (not fork) or (not hasattr(os, 'fork')):
+            observatory, scheduler = self.restore()
+            return func(observatory, scheduler)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child. Whatever happens, don't return into the parent's code.
+            try:
+                os.close(read_fd)
+                try:
+                    result = (True, func(self.observatory, self.scheduler))
+                except Exception:
+                    result = (False, traceback.format_exc())
+                with os.fdopen(write_fd, 'wb') as out_file:
+                    pickle.dump(result, out_file)
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as in_file:
+            data = in_file.read()
+        os.waitpid(pid, 0)
+        if len(data) == 0:
+            raise RuntimeError('Evaluation process %i died without a result' % pid)
+        success, result = pickle.loads(data)
+        if not success:
+            raise RuntimeError('Evaluation from snapshot failed:\n%s' % result)
+        return result
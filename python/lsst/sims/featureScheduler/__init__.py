@@ -1,2 +1,19 @@
+import importlib
 from .version import *
 from .sim_runner import *
+from .ensemble_runner import *
+
+# Subpackages are imported the first time they are used, so importing the package itself is
+# quick. `import lsst.sims.featureScheduler.surveys` etc. work as usual.
+_subpackages = ['basis_functions', 'detailers', 'features', 'modelObservatory', 'schedulers',
+                'surveys', 'thomson', 'utils', 'Training']
+
+
+def __getattr__(name):
+    if name in _subpackages:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_subpackages))
@@ -4,7 +4,6 @@ from lsst.sims.featureScheduler import utils
 from lsst.sims.featureScheduler.utils import int_rounded
 import healpy as hp
 from lsst.sims.skybrightness_pre import M5percentiles
-import matplotlib.pylab as plt
 import warnings
 from lsst.sims.utils import _hpid2RaDec
 
@@ -25,6 +24,9 @@ __all__ = ['Base_basis_function', 'Constant_basis_function', 'Target_map_basis_f
 class Base_basis_function(object):
     """Class that takes features and computes a reward function when called.
     """
+    # Attributes that are never modified in place, so copies made with a survey's clone
+    # method can share them
+    clone_shared = ()
 
     def __init__(self, nside=None, filtername=None, **kwargs):
 
@@ -69,6 +71,43 @@ class Base_basis_function(object):
         """
         return True
 
+    def shared_objects(self):
+        """The objects named in clone_shared
+        """
+        return [getattr(self, name) for name in self.clone_shared if hasattr(self, name)]
+
+    def feasible_intervals(self, conditions):
+        """The times during the current night that check_feasibility could return True.
+
+        Basis functions whose feasibility only depends on the time and the nightly almanac
+        values can publish it ahead of time, so a whole survey can be ruled out without being
+        evaluated (see lsst.sims.featureScheduler.schedulers.Feasibility_calendar). The intervals
+        may be a superset of the feasible times, but must not leave any feasible time out.
+
+        Returns
+        -------
+        (N, 2) np.array of [start, end] MJD intervals, or None if feasibility can't be
+        known ahead of time.
+        """
+        return None
+
+    def max_value(self, conditions):
+        """An upper bound on the value, found without evaluating the basis function.
+
+        Used by surveys to bound their reward cheaply (see BaseMarkovDF_survey.upper_bound).
+        Should be np.inf if the value could include an infinity.
+
+        Returns
+        -------
+        float, or None if there is no cheap bound.
+        """
+        return None
+
+    def min_value(self, conditions):
+        """A lower bound on the value, like max_value. Used for negative weights.
+        """
+        return None
+
     def _calc_value(self, conditions, **kwarge):
         self.value = 0
         # Update the last time we had an mjd
@@ -109,6 +148,12 @@ class Constant_basis_function(Base_basis_function):
     def __call__(self, conditions, **kwargs):
         return 1
 
+    def max_value(self, conditions):
+        return 1
+
+    def min_value(self, conditions):
+        return 1
+
 
 class Target_map_basis_function(Base_basis_function):
     """Basis function that tracks number of observations and tries to match a specified spatial distribution
@@ -130,6 +175,8 @@ class Target_map_basis_function(Base_basis_function):
     out_of_bounds_val : float (-10.)
         Reward value to give regions where there are no observations requested (unitless).
     """
+    clone_shared = ('target_map', 'out_of_bounds_area', 'all_indx')
+
     def __init__(self, filtername='r', nside=None, target_map=None,
                  norm_factor=None,
                  out_of_bounds_val=-10.):
@@ -193,6 +240,8 @@ def azRelPoint(azs, pointAz):
 class N_obs_high_am_basis_function(Base_basis_function):
     """Reward only reward/count observations at high airmass
     """
+    clone_shared = ('footprint', 'out_footprint')
+
 
     def __init__(self, nside=None, filtername='r', footprint=None, n_obs=3, season=300.,
                  am_limits=[1.5, 2.2], out_of_bounds_val=np.nan):
@@ -270,6 +319,8 @@ class N_obs_per_year_basis_function(Base_basis_function):
     season_end_hour : float (2)
         When to consider a season ending, the RA relative to the sun + 180 degrees. (hours)
     """
+    clone_shared = ('footprint', 'out_footprint')
+
     def __init__(self, filtername='r', nside=None, footprint=None, n_obs=3, season=300,
                  season_start_hour=-4., season_end_hour=2.):
         super(N_obs_per_year_basis_function, self).__init__(nside=nside, filtername=filtername)
@@ -363,6 +414,8 @@ class Season_coverage_basis_function(Base_basis_function):
     season_frac_start : float (0.5)
         Only start trying to gather observations after a season is fractionally this far over.
     """
+    clone_shared = ('footprint',)
+
     def __init__(self, filtername='r', nside=None, footprint=None, n_per_season=3, offset=None,
                  season_frac_start=0.5):
         super(Season_coverage_basis_function, self).__init__(nside=nside, filtername=filtername)
@@ -398,11 +451,13 @@ class Footprint_nvis_basis_function(Base_basis_function):
     nvis : int (1)
         The number of visits to try and gather
     """
+    clone_shared = ('footprint', 'footprint_indx')
+
     def __init__(self, filtername='r', nside=None, footprint=None,
                  nvis=1, out_of_bounds_val=np.nan):
         super(Footprint_nvis_basis_function, self).__init__(nside=nside, filtername=filtername)
-        self.footprint = footprint
         self.nvis = nvis
+        self.footprint = footprint
 
         # Have a feature that tracks how many observations we have
         self.survey_features = {}
@@ -412,14 +467,27 @@ class Footprint_nvis_basis_function(Base_basis_function):
         self.result.fill(out_of_bounds_val)
         self.out_of_bounds_val = out_of_bounds_val
 
+    @property
+    def footprint(self):
+        return self._footprint
+
+    @footprint.setter
+    def footprint(self, footprint):
+        # Pixels outside the footprint never need visits, so only the ones inside are checked
+        self._footprint = footprint
+        if footprint is None:
+            self.footprint_indx = None
+        else:
+            self.footprint_indx = np.where(footprint > 0)[0]
+        self.recalc = True
+
     def _calc_value(self, conditions, indx=None):
         result = self.result.copy()
-        diff = int_rounded(self.footprint*self.nvis - self.survey_features['N_obs'].feature)
-
-        result[np.where(diff > 0)] = 1
+        fp_indx = self.footprint_indx
+        diff = int_rounded(self.footprint[fp_indx]*self.nvis - self.survey_features['N_obs'].feature[fp_indx])
 
-        # Any spot where we have enough visits is out of bounds now.
-        result[np.where(diff <= 0)] = self.out_of_bounds_val
+        # Any spot where we have enough visits is out of bounds, same as outside the footprint
+        result[fp_indx[np.where(diff > int_rounded(0))]] = 1
         return result
 
 
@@ -566,6 +634,8 @@ class M5_diff_basis_function(Base_basis_function):
     Look up the best depth a healpixel achieves, and compute
     the limiting depth difference given current conditions
     """
+    clone_shared = ('dark_map',)
+
     def __init__(self, filtername='r', nside=None):
 
         super(M5_diff_basis_function, self).__init__(nside=nside, filtername=filtername)
@@ -824,6 +894,10 @@ class Slewtime_basis_function(Base_basis_function):
         # No tracking of observations in this basis function. Purely based on conditions.
         pass
 
+    def max_value(self, conditions):
+        # Slewtimes are never negative
+        return 0.
+
     def _calc_value(self, conditions, indx=None):
         # If we are in a different filter, the Filter_change_basis_function will take it
         if conditions.current_filter != self.filtername:
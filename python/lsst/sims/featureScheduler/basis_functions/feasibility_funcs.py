@@ -1,6 +1,5 @@
 import numpy as np
 from lsst.sims.featureScheduler import features
-import matplotlib.pylab as plt
 from lsst.sims.featureScheduler.basis_functions import Base_basis_function
 from lsst.sims.featureScheduler.utils import int_rounded
 
@@ -53,6 +52,11 @@ class Night_modulo_basis_function(Base_basis_function):
         result = self.pattern[indx]
         return result
 
+    def feasible_intervals(self, conditions):
+        if self.check_feasibility(conditions):
+            return np.array([[-np.inf, np.inf]])
+        return np.zeros((0, 2))
+
 
 class Time_in_twilight_basis_function(Base_basis_function):
     """Make sure there is some time left in twilight.
@@ -79,6 +83,10 @@ class Time_in_twilight_basis_function(Base_basis_function):
                     result = True
         return result
 
+    def feasible_intervals(self, conditions):
+        latest = max(conditions.sun_n18_setting, conditions.sun_n12_rising) - self.time_needed
+        return np.array([[-np.inf, latest]])
+
 
 class End_of_evening_basis_function(Base_basis_function):
     """Only let observations happen in a limited time before twilight
@@ -93,6 +101,10 @@ class End_of_evening_basis_function(Base_basis_function):
         result = int_rounded(available_time) < self.time_remaining
         return result
 
+    def feasible_intervals(self, conditions):
+        rising = getattr(conditions, 'sun_n' + self.alt_limit + '_rising')
+        return np.array([[rising - self.time_remaining.initial, np.inf]])
+
 
 class Time_to_twilight_basis_function(Base_basis_function):
     """Make sure there is enough time before twilight. Useful
@@ -115,6 +127,10 @@ class Time_to_twilight_basis_function(Base_basis_function):
         result = available_time > self.time_needed
         return result
 
+    def feasible_intervals(self, conditions):
+        rising = getattr(conditions, 'sun_n' + self.alt_limit + '_rising')
+        return np.array([[-np.inf, rising - self.time_needed]])
+
 
 class Not_twilight_basis_function(Base_basis_function):
     def __init__(self, sun_alt_limit=-18):
@@ -132,6 +148,10 @@ class Not_twilight_basis_function(Base_basis_function):
             result = False
         return result
 
+    def feasible_intervals(self, conditions):
+        return np.array([[getattr(conditions, 'sun_'+self.sun_alt_limit+'_setting'),
+                          getattr(conditions, 'sun_'+self.sun_alt_limit+'_rising')]])
+
 
 class Force_delay_basis_function(Base_basis_function):
     """Keep a survey from executing to rapidly.
@@ -211,6 +231,24 @@ class Hour_Angle_limit_basis_function(Base_basis_function):
 
         return result
 
+    def feasible_intervals(self, conditions):
+        # The hour angle advances at the sidereal rate, so the windows can be found from the current
+        # lmst. Worked out for the next day, anything after that is left feasible.
+        rate = 24.*1.0027379093  # sidereal hours per day
+        start = conditions.mjd
+        end = conditions.mjd + 1.
+        target_HA = (conditions.lmst - self.ra_hours) % 24
+        windows = []
+        for limit in self.HA_limits:
+            for wrap in [-24., 0., 24., 48.]:
+                window_start = start + (limit[0] - target_HA + wrap)/rate
+                window_end = start + (limit[1] - target_HA + wrap)/rate
+                if (window_end >= start) & (window_start <= end):
+                    windows.append([window_start, window_end])
+        windows.append([-np.inf, start])
+        windows.append([end, np.inf])
+        return np.array(windows)
+
 
 class Moon_down_basis_function(Base_basis_function):
     """Demand the moon is down """
@@ -220,6 +258,19 @@ class Moon_down_basis_function(Base_basis_function):
             result = False
         return result
 
+    def feasible_intervals(self, conditions):
+        moonrise = conditions.moonrise
+        moonset = conditions.moonset
+        if (moonrise is None) or (moonset is None):
+            return None
+        if not (np.isfinite(moonrise) & np.isfinite(moonset)):
+            return None
+        if moonrise < moonset:
+            # Moon rises during the night, then sets
+            return np.array([[-np.inf, moonrise], [moonset, np.inf]])
+        # Moon sets during the night, then rises again
+        return np.array([[moonset, moonrise]])
+
 
 class Fraction_of_obs_basis_function(Base_basis_function):
     """Limit the fraction of all observations that can be labled a certain
@@ -370,6 +421,16 @@ class Sun_alt_limit_basis_function(Base_basis_function):
             result = False
         return result
 
+    def feasible_intervals(self, conditions):
+        # The sun can only be below the limit between the matching almanac times
+        if self.alt_limit <= np.radians(-18.):
+            return np.array([[conditions.sun_n18_setting, conditions.sun_n18_rising]])
+        if self.alt_limit <= np.radians(-12.):
+            return np.array([[conditions.sun_n12_setting, conditions.sun_n12_rising]])
+        if self.alt_limit <= 0:
+            return np.array([[conditions.sunset, conditions.sunrise]])
+        return None
+
 
 ## XXX--TODO:  Can include checks to see if downtime is coming, clouds are coming, moon rising, or surveys in a higher tier 
 # Have observations they want to execute soon.
\ No newline at end of file
@@ -1,9 +1,8 @@
 import numpy as np
 import healpy as hp
-from lsst.sims.utils import _hpid2RaDec, Site, _angularSeparation, _xyz_from_ra_dec
-import matplotlib.pylab as plt
+from lsst.sims.utils import _hpid2RaDec, Site, _xyz_from_ra_dec
 from lsst.sims.featureScheduler.basis_functions import Base_basis_function
-from lsst.sims.featureScheduler.utils import hp_in_lsst_fov, int_rounded
+from lsst.sims.featureScheduler.utils import int_rounded
 
 
 __all__ = ['Zenith_mask_basis_function', 'Zenith_shadow_mask_basis_function',
@@ -55,15 +54,14 @@ class Planet_mask_basis_function(Base_basis_function):
             planets = ['venus', 'mars', 'jupiter']
         self.planets = planets
         self.mask_radius = np.radians(mask_radius)
+        self.mask_radius_deg = mask_radius
+        self.scale = scale
         self.result = np.zeros(hp.nside2npix(nside))
-        # set up a kdtree. Could maybe use healpy.query_disc instead.
-        self.in_fov = hp_in_lsst_fov(nside=nside, fov_radius=mask_radius, scale=scale)
 
     def _calc_value(self, conditions, indx=None):
         result = self.result.copy()
-        for pn in self.planets:
-            indices = self.in_fov(conditions.planet_positions[pn+'_RA'], conditions.planet_positions[pn+'_dec'])
-            result[indices] = np.nan
+        # Shared with any other basis function masking the same planets at this time
+        result[conditions.planet_mask(self.mask_radius_deg, self.planets, scale=self.scale)] = np.nan
 
         return result
 
@@ -136,11 +134,8 @@ class Moon_avoidance_basis_function(Base_basis_function):
     def _calc_value(self, conditions, indx=None):
         result = self.result.copy()
 
-        angular_distance = _angularSeparation(conditions.az, conditions.alt,
-                                              conditions.moonAz,
-                                              conditions.moonAlt)
-
-        result[int_rounded(angular_distance) < self.moon_distance] = np.nan
+        # Shared with any other basis function avoiding the moon at this time
+        result[int_rounded(conditions.moon_distance) < self.moon_distance] = np.nan
 
         return result
 
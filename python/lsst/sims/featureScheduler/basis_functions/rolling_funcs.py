@@ -2,7 +2,6 @@ import numpy as np
 from lsst.sims.featureScheduler import features
 from lsst.sims.featureScheduler import utils
 import healpy as hp
-import matplotlib.pylab as plt
 import warnings
 from lsst.sims.featureScheduler.basis_functions import Base_basis_function
 
@@ -138,20 +137,20 @@ class Footprint_rolling_basis_function(Base_basis_function):
     def _calc_value(self, conditions, indx=None):
         result = self.result.copy()
 
-        # Compute what season it is at each pixel
-        seasons = utils.season_calc(conditions.night, offset=self.day_offset,
-                                    modulo=self.season_modulo, max_season=self.max_season,
-                                    season_length=self.season_length)
+        # What season it is at each pixel, shared with everything else using the same offset
+        seasons = utils.season_map(conditions.night, offset=self.day_offset,
+                                   modulo=self.season_modulo, max_season=self.max_season,
+                                   season_length=self.season_length)
 
         # Compute the constant parts of the footprint like before
         desired = self.footprints[-1] / self.all_footprints_sum * np.sum(self.survey_features['N_obs_all_-1'].feature)
         result[self.constant_footprint_indx] = desired[self.constant_footprint_indx] - self.survey_features['N_obs_-1'].feature[self.constant_footprint_indx]
 
         # Now for the rolling sections
-        for season in np.unique(seasons[self.rolling_footprint_indx]):
-            season_indx = np.where(seasons[self.rolling_footprint_indx] == season)[0]
-            desired = self.footprints[season][self.rolling_footprint_indx][season_indx] / self.all_rolling_sum * np.sum(self.survey_features['N_obs_all_%i' % season].feature[self.rolling_footprint_indx])
-            result[self.rolling_footprint_indx[season_indx]] = desired - self.survey_features['N_obs_%i' % season].feature[self.rolling_footprint_indx][season_indx]
+        for season, season_indx in seasons.groups(self.rolling_footprint_indx):
+            pix = self.rolling_footprint_indx[season_indx]
+            desired = self.footprints[season][pix] / self.all_rolling_sum * np.sum(self.survey_features['N_obs_all_%i' % season].feature[self.rolling_footprint_indx])
+            result[pix] = desired - self.survey_features['N_obs_%i' % season].feature[pix]
 
         result[self.out_of_bounds_area] = self.out_of_bounds_val
         return result
@@ -263,18 +262,17 @@ class Target_map_modulo_basis_function(Base_basis_function):
         if indx is None:
             indx = self.all_indx
 
-        # Compute what season it is at each pixel
-        seasons = utils.season_calc(conditions.night, offset=self.day_offset,
-                                    modulo=self.season_modulo, max_season=self.max_season,
-                                    season_length=self.season_length)
+        # What season it is at each pixel, shared with everything else using the same offset
+        seasons = utils.season_map(conditions.night, offset=self.day_offset,
+                                   modulo=self.season_modulo, max_season=self.max_season,
+                                   season_length=self.season_length)
 
         composite_target = self.result.copy()[indx]
         composite_nobs = self.result.copy()[indx]
 
         composite_goal_N = self.result.copy()[indx]
 
-        for season in np.unique(seasons):
-            season_indx = np.where(seasons == season)[0]
+        for season, season_indx in seasons.groups():
             composite_target[season_indx] = self.target_maps[season][season_indx]
             composite_nobs[season_indx] = self.survey_features['N_obs_%i' % season].feature[season_indx]
             composite_goal_N[season_indx] = composite_target[season_indx] * self.survey_features['N_obs_count_all_%i' % season].feature * self.norm_factor
@@ -1,10 +1,56 @@
 from lsst.sims.utils import _raDec2Hpid, _approx_RaDec2AltAz, _angularSeparation
 import numpy as np
-from lsst.sims.featureScheduler.utils import approx_altaz2pa, int_rounded
-import copy
+from lsst.sims.featureScheduler.utils import approx_altaz2pa, int_rounded, ObservationBatch
 
 __all__ = ["Base_detailer", "Zero_rot_detailer", "Comcam_90rot_detailer", "Close_alt_detailer",
-           "Take_as_pairs_detailer", "Twilight_triple_detailer", "Spider_rot_detailer"]
+           "Take_as_pairs_detailer", "Twilight_triple_detailer", "Spider_rot_detailer",
+           "Detailer_chain", "Batch_altaz"]
+
+
+class Batch_altaz(object):
+    """Alt, az, and parallactic angle of a block of observations, computed once when first needed.
+
+    Several detailers need the alt/az of every observation in a block. Passing one of these
+    along a Detailer_chain means the coordinate transform is done once per block rather than
+    once per detailer (or per observation).
+
+    Parameters
+    ----------
+    observations : lsst.sims.featureScheduler.utils.ObservationBatch
+        The observations to compute coordinates for.
+    conditions : lsst.sims.featureScheduler.conditions object
+    """
+    def __init__(self, observations, conditions):
+        self.observations = observations
+        self.conditions = conditions
+        self._alt = None
+        self._az = None
+        self._pa = None
+
+    def _calc_altaz(self):
+        obs_array = self.observations.array
+        self._alt, self._az = _approx_RaDec2AltAz(obs_array['RA'], obs_array['dec'],
+                                                  self.conditions.site.latitude_rad,
+                                                  self.conditions.site.longitude_rad,
+                                                  self.conditions.mjd)
+
+    @property
+    def alt(self):
+        if self._alt is None:
+            self._calc_altaz()
+        return self._alt
+
+    @property
+    def az(self):
+        if self._az is None:
+            self._calc_altaz()
+        return self._az
+
+    @property
+    def pa(self):
+        if self._pa is None:
+            self._pa = approx_altaz2pa(self.alt, self.az, self.conditions.site.latitude_rad)
+        return self._pa
 
 
 class Base_detailer(object):
@@ -15,7 +61,12 @@ class Base_detailer(object):
     to, or what to use for an exposure time. We could also modify the order of the proposed observations.
     For Deep Drilling Fields, a detailer could be useful for computing dither positions and modifying
     the exact RA,Dec positions.
+
+    Subclasses should override `detail_batch`, which works on whole columns of an ObservationBatch.
     """
+    # Set to True if the detailer changes the RA,Dec of observations in place, so any
+    # alt/az values computed before it ran are out of date.
+    moves_pointings = False
 
     def __init__(self, nside=32):
         """
@@ -40,16 +91,65 @@ class Base_detailer(object):
         """
         Parameters
         ----------
-        observation_list : list of observations
+        observation_list : lsst.sims.featureScheduler.utils.ObservationBatch (or list of observations)
             The observations to detail.
         conditions : lsst.sims.featureScheduler.conditions object
 
         Returns
         -------
-        List of observations.
+        ObservationBatch
+        """
+        observations = ObservationBatch.from_list(observation_list)
+        return self.detail_batch(observations, conditions, Batch_altaz(observations, conditions))
+
+    def detail_batch(self, observations, conditions, altaz):
+        """
+        Parameters
+        ----------
+        observations : lsst.sims.featureScheduler.utils.ObservationBatch
+            The observations to detail. Can be modified in place.
+        conditions : lsst.sims.featureScheduler.conditions object
+        altaz : Batch_altaz
+            Alt, az, and parallactic angle of the observations.
+
+        Returns
+        -------
+        ObservationBatch (the input batch, or a new one if observations were added, removed or re-ordered)
         """
+        return observations
 
-        return observation_list
+
+class Detailer_chain(Base_detailer):
+    """Run a sequence of detailers as a single detailer.
+
+    The block of observations is converted to an ObservationBatch once, and each detailer
+    works on its columns in turn. The alt/az of the block is computed at most once and shared
+    down the chain until a detailer moves, adds, or re-orders observations.
+
+    Parameters
+    ----------
+    detailers : list of lsst.sims.featureScheduler.detailers objects
+        The detailers to apply, in order.
+    """
+    def __init__(self, detailers):
+        super(Detailer_chain, self).__init__()
+        self.detailers = list(detailers)
+
+    def add_observation(self, observation, indx=None):
+        for detailer in self.detailers:
+            detailer.add_observation(observation, indx=indx)
+
+    def detail_batch(self, observations, conditions, altaz):
+        for detailer in self.detailers:
+            if type(detailer).__call__ is Base_detailer.__call__:
+                result = detailer.detail_batch(observations, conditions, altaz)
+            else:
+                # Detailer only knows how to be called, can't share the batch state with it
+                result = ObservationBatch.from_list(detailer(observations, conditions))
+            if (result is not observations) | detailer.moves_pointings:
+                altaz = Batch_altaz(result, conditions)
+            observations = result
+        return observations
 
 
 class Zero_rot_detailer(Base_detailer):
@@ -60,16 +160,9 @@ class Zero_rot_detailer(Base_detailer):
     But, wait, what? Is it really the other way?
     """
 
-    def __call__(self, observation_list, conditions):
-
-        # XXX--should I convert the list into an array and get rid of this loop?
-        for obs in observation_list:
-            alt, az = _approx_RaDec2AltAz(obs['RA'], obs['dec'], conditions.site.latitude_rad,
-                                          conditions.site.longitude_rad, conditions.mjd)
-            obs_pa = approx_altaz2pa(alt, az, conditions.site.latitude_rad)
-            obs['rotSkyPos'] = obs_pa
-
-        return observation_list
+    def detail_batch(self, observations, conditions, altaz):
+        observations.array['rotSkyPos'] = altaz.pa
+        return observations
 
 
 class Spider_rot_detailer(Base_detailer):
@@ -78,15 +171,15 @@ class Spider_rot_detailer(Base_detailer):
     and columns
     """
 
-    def __call__(self, observation_list, conditions):
+    def detail_batch(self, observations, conditions, altaz):
         indx = int(conditions.night % 2)
         rotTelPos = np.radians([45., 315.][indx])
 
-        for obs in observation_list:
-            obs['rotSkyPos'] = np.nan
-            obs['rotTelPos'] = rotTelPos
+        obs_array = observations.array
+        obs_array['rotSkyPos'] = np.nan
+        obs_array['rotTelPos'] = rotTelPos
 
-        return observation_list
+        return observations
 
 
 class Comcam_90rot_detailer(Base_detailer):
@@ -95,23 +188,17 @@ class Comcam_90rot_detailer(Base_detailer):
     is closest to rotTelPos of zero.
     """
 
-    def __call__(self, observation_list, conditions):
+    def detail_batch(self, observations, conditions, altaz):
         favored_rotSkyPos = np.radians([0., 90., 180., 270., 360.]).reshape(5, 1)
-        obs_array =np.concatenate(observation_list)
-        alt, az = _approx_RaDec2AltAz(obs_array['RA'], obs_array['dec'], conditions.site.latitude_rad,
-                                      conditions.site.longitude_rad, conditions.mjd)
-        parallactic_angle = approx_altaz2pa(alt, az, conditions.site.latitude_rad)
         # If we set rotSkyPos to parallactic angle, rotTelPos will be zero. So, find the
         # favored rotSkyPos that is closest to PA to keep rotTelPos as close as possible to zero.
-        ang_diff = np.abs(parallactic_angle - favored_rotSkyPos)
+        ang_diff = np.abs(altaz.pa - favored_rotSkyPos)
         min_indxs = np.argmin(ang_diff, axis=0)
         # can swap 360 and zero if needed?
-        final_rotSkyPos = favored_rotSkyPos[min_indxs]
         # Set all the observations to the proper rotSkyPos
-        for rsp, obs in zip(final_rotSkyPos, observation_list):
-            obs['rotSkyPos'] = rsp
+        observations.array['rotSkyPos'] = favored_rotSkyPos[min_indxs].ravel()
 
-        return observation_list
+        return observations
 
 
 class Close_alt_detailer(Base_detailer):
@@ -127,10 +214,9 @@ class Close_alt_detailer(Base_detailer):
         super(Close_alt_detailer, self).__init__()
         self.alt_band = int_rounded(np.radians(alt_band))
 
-    def __call__(self, observation_list, conditions):
-        obs_array = np.concatenate(observation_list)
-        alt, az = _approx_RaDec2AltAz(obs_array['RA'], obs_array['dec'], conditions.site.latitude_rad,
-                                      conditions.site.longitude_rad, conditions.mjd)
+    def detail_batch(self, observations, conditions, altaz):
+        alt = altaz.alt
+        az = altaz.az
         alt_diff = np.abs(alt - conditions.telAlt)
         in_band = np.where(int_rounded(alt_diff) <= self.alt_band)[0]
         if in_band.size == 0:
@@ -140,8 +226,9 @@ class Close_alt_detailer(Base_detailer):
         ang_dist = _angularSeparation(az[in_band], alt[in_band], conditions.telAz, conditions.telAlt)
         good = np.min(np.where(ang_dist == ang_dist.min())[0])
         indx = in_band[good]
-        result = observation_list[indx:] + observation_list[:indx]
-        return result
+        if indx == 0:
+            return observations
+        return ObservationBatch(np.roll(observations.array, -indx))
 
 
 class Take_as_pairs_detailer(Base_detailer):
@@ -151,26 +238,21 @@ class Take_as_pairs_detailer(Base_detailer):
         super(Take_as_pairs_detailer, self).__init__()
         self.filtername = filtername
 
-    def __call__(self, observation_list, conditions):
-        paired = copy.deepcopy(observation_list)
-        for obs in paired:
-            obs['filter'] = self.filtername
+    def detail_batch(self, observations, conditions, altaz):
+        obs_array = observations.array
+        paired = obs_array.copy()
+        paired['filter'] = self.filtername
         if conditions.current_filter == self.filtername:
-            for obs in paired:
-                obs['note'] = obs['note'][0] + ', a'
-            for obs in observation_list:
-                obs['note'] = obs['note'][0] + ', b'
-            result = paired + observation_list
+            paired['note'] = np.char.add(paired['note'], ', a')
+            obs_array['note'] = np.char.add(obs_array['note'], ', b')
+            result = np.concatenate([paired, obs_array])
         else:
-            for obs in paired:
-                obs['note'] = obs['note'][0] + ', b'
-            for obs in observation_list:
-                obs['note'] = obs['note'][0] + ', a'
-            result = observation_list + paired
+            paired['note'] = np.char.add(paired['note'], ', b')
+            obs_array['note'] = np.char.add(obs_array['note'], ', a')
+            result = np.concatenate([obs_array, paired])
         # XXX--maybe a temp debugging thing, label what part of sequence each observation is.
-        for i, obs in enumerate(result):
-            obs['survey_id'] = i
-        return result
+        result['survey_id'] = np.arange(result.size)
+        return ObservationBatch(result)
 
 
 class Twilight_triple_detailer(Base_detailer):
@@ -179,9 +261,9 @@ class Twilight_triple_detailer(Base_detailer):
         self.slew_estimate = slew_estimate
         self.n_repeat = n_repeat
 
-    def __call__(self, observation_list, conditions):
+    def detail_batch(self, observations, conditions, altaz):
 
-        obs_array = np.concatenate(observation_list)
+        obs_array = observations.array
 
         # Estimate how much time is left in the twilgiht block
         potential_times = np.array([conditions.sun_n18_setting - conditions.mjd,
@@ -203,18 +285,7 @@ class Twilight_triple_detailer(Base_detailer):
                 max_indx = np.max(max_indx)
                 if max_indx == 0:
                     max_indx += 1
-            observation_list = observation_list[0:max_indx]
+            obs_array = obs_array[0:max_indx]
 
         # Repeat the observations n times
-        out_obs = []
-        for i in range(self.n_repeat):
-            out_obs.extend(copy.deepcopy(observation_list))
-
-        return out_obs
-
-
-
-
-
-
-
+        return ObservationBatch(np.tile(obs_array, self.n_repeat))
@@ -1,7 +1,5 @@
 import numpy as np
 from lsst.sims.featureScheduler.detailers import Base_detailer
-from lsst.sims.utils import _approx_RaDec2AltAz
-from lsst.sims.featureScheduler.utils import approx_altaz2pa
 
 
 __all__ = ["Dither_detailer", "Camera_rot_detailer"]
@@ -43,6 +41,8 @@ class Dither_detailer(Base_detailer):
 
 
     """
+    moves_pointings = True
+
     def __init__(self, max_dither=0.7, seed=42, per_night=True):
         self.survey_features = {}
 
@@ -68,17 +68,17 @@ class Dither_detailer(Base_detailer):
 
         return offsets
 
-    def __call__(self, observation_list, conditions):
+    def detail_batch(self, observations, conditions, altaz):
 
         # Generate offsets in RA and Dec
-        offsets = self._generate_offsets(len(observation_list), conditions.night)
+        offsets = self._generate_offsets(len(observations), conditions.night)
 
-        obs_array = np.concatenate(observation_list)
+        # Columns of the batch are views, so this updates the observations in place
+        obs_array = observations.array
         newRA, newDec = gnomonic_project_tosky(offsets[0, :], offsets[1, :], obs_array['RA'], obs_array['dec'])
-        for i, obs in enumerate(observation_list):
-            observation_list[i]['RA'] = newRA[i]
-            observation_list[i]['dec'] = newDec[i]
-        return observation_list
+        obs_array['RA'] = newRA
+        obs_array['dec'] = newDec
+        return observations
 
 
 class Camera_rot_detailer(Base_detailer):
@@ -118,15 +118,11 @@ class Camera_rot_detailer(Base_detailer):
 
         return offsets
 
-    def __call__(self, observation_list, conditions):
+    def detail_batch(self, observations, conditions, altaz):
 
         # Generate offsets in RA and Dec
-        offsets = self._generate_offsets(len(observation_list), conditions.night)
+        offsets = self._generate_offsets(len(observations), conditions.night)
 
-        for i, obs in enumerate(observation_list):
-            alt, az = _approx_RaDec2AltAz(obs['RA'], obs['dec'], conditions.site.latitude_rad,
-                                          conditions.site.longitude_rad, conditions.mjd)
-            obs_pa = approx_altaz2pa(alt, az, conditions.site.latitude_rad)
-            obs['rotSkyPos'] = (obs_pa + offsets[i]) % (2.*np.pi)
+        observations.array['rotSkyPos'] = (altaz.pa + offsets) % (2.*np.pi)
 
-        return observation_list
+        return observations
@@ -1,10 +1,9 @@
 from lsst.sims.featureScheduler.detailers import Base_detailer
 from lsst.sims.utils import _raDec2Hpid, m5_flat_sed
 import lsst.sims.featureScheduler.features as features
-from lsst.sims.featureScheduler.utils import hp_in_lsst_fov
+from lsst.sims.featureScheduler.utils import hp_in_lsst_fov, ObservationBatch
 import numpy as np
 import healpy as hp
-import matplotlib.pylab as plt
 
 __all__ = ['Short_expt_detailer']
 
@@ -38,27 +37,27 @@ class Short_expt_detailer(Base_detailer):
         # Need to be able to look up hpids for each observation
         self.obs2hpid = hp_in_lsst_fov(nside=nside)
 
-    def __call__(self, observation_list, conditions):
-        out_observations = []
+    def detail_batch(self, observations, conditions, altaz):
+        obs_array = observations.array
         # Compute how many observations we should have taken by now
         n_goal = self.nobs * np.round((conditions.mjd - self.mjd0)/365.25 + 1)
-        time_to_add = 0.
-        for observation in observation_list:
-            out_observations.append(observation)
-            if observation['filter'] == self.filtername:
-                hpids = self.obs2hpid(observation['RA'], observation['dec'])
-                # Crop off anything outside the target footprint
-                hpids = hpids[np.where(self.footprint[hpids] > 0)]
-                # Crop off things where we already have enough observation
-                hpids = hpids[np.where(self.survey_features['nobs'].feature[hpids] < n_goal)]
-                if np.size(hpids) > 0:
-                    new_obs = observation.copy()
-                    new_obs['exptime'] = self.exp_time
-                    new_obs['nexp'] = 1
-                    new_obs['note'] = self.survey_name
-                    out_observations.append(new_obs)
-                    time_to_add += new_obs['exptime'] + self.read_approx
+        needs_short = np.zeros(obs_array.size, dtype=bool)
+        for indx in np.where(obs_array['filter'] == self.filtername)[0]:
+            hpids = self.obs2hpid(obs_array['RA'][indx], obs_array['dec'][indx])
+            # Crop off anything outside the target footprint
+            hpids = hpids[np.where(self.footprint[hpids] > 0)]
+            # Crop off things where we already have enough observation
+            hpids = hpids[np.where(self.survey_features['nobs'].feature[hpids] < n_goal)]
+            needs_short[indx] = np.size(hpids) > 0
+        if not np.any(needs_short):
+            return observations
+
+        short_obs = obs_array[needs_short]
+        short_obs['exptime'] = self.exp_time
+        short_obs['nexp'] = 1
+        short_obs['note'] = self.survey_name
+        time_to_add = np.sum(short_obs['exptime'] + self.read_approx)
         # pump up the flush time
-        for observation in observation_list:
-            observation['flush_by_mjd'] += time_to_add/3600./24.
-        return out_observations
+        obs_array['flush_by_mjd'] += time_to_add/3600./24.
+        # Each short exposure goes right after the observation it was copied from
+        return ObservationBatch(np.insert(obs_array, np.where(needs_short)[0] + 1, short_obs))
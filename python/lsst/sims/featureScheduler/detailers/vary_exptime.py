@@ -57,19 +57,8 @@ class Vary_expt_detailer(Base_detailer):
         else:
             self.target_m5 = target_m5
 
-    def __call__(self, observation_list, conditions):
-        """
-        Parameters
-        ----------
-        observation_list : list of observations
-            The observations to detail.
-        conditions : lsst.sims.featureScheduler.conditions object
-
-        Returns
-        -------
-        List of observations.
-        """
-        obs_array = np.concatenate(observation_list)
+    def detail_batch(self, observations, conditions, altaz):
+        obs_array = observations.array
         hpids = _raDec2Hpid(self.nside, obs_array['RA'], obs_array['dec'])
         new_expts = np.zeros(obs_array.size, dtype=float)
         for filtername in np.unique(obs_array['filter']):
@@ -94,7 +83,6 @@ class Vary_expt_detailer(Base_detailer):
         # I'm not sure what level of precision we can expect, so let's just limit to seconds
         new_expts = np.round(new_expts)
 
-        for i, observation in enumerate(observation_list):
-            observation['exptime'] = new_expts[i]
+        obs_array['exptime'] = new_expts
 
-        return observation_list
+        return observations
@@ -0,0 +1,172 @@
+import multiprocessing
+import time
+import traceback
+from lsst.sims.featureScheduler.sim_runner import sim_runner
+
+__all__ = ['ensemble_runner', 'load_shared_data', 'run_sim']
+
+# Set in each worker process by _init_worker
+_worker_shared = None
+_worker_run_func = None
+
+
+def load_shared_data(nside=None, mjd_start=59853.5, quickTest=True):
+    """Load the read-only data that every simulation in an ensemble can share.
+
+    The sky model is only partly shared: SkyModelPre holds one file of sky brightness at a time,
+    and loads the next when a simulation moves past it. The workers share the file loaded here,
+    but a worker that runs past its time span loads (and holds) its own copy of the next one.
+    The almanac, goal maps, fields and kd-tree stay shared for the whole run.
+
+    Parameters
+    ----------
+    nside : int (None)
+        The healpix nside resolution
+    mjd_start : float (59853.5)
+        The MJD the simulations start at (the almanac is set up for it).
+    quickTest : bool (True)
+        Passed to the sky model, only load a small part of the sky brightness files.
+
+    Returns
+    -------
+    dict with the sky model, almanac, goal maps and field tessellation
+    """
+    import lsst.sims.skybrightness_pre as sb
+    from lsst.sims.almanac import Almanac
+    from lsst.sims.featureScheduler.utils import set_default_nside, standard_goals, read_fields, hp_kd_tree
+
+    if nside is None:
+        nside = set_default_nside()
+    shared = {'nside': nside, 'mjd_start': mjd_start}
+    shared['sky_model'] = sb.SkyModelPre(speedLoad=quickTest)
+    shared['almanac'] = Almanac(mjd_start=mjd_start)
+    shared['goals'] = standard_goals(nside=nside)
+    shared['fields'] = read_fields()
+    # Build the healpix kd-tree now so the forked workers all share this copy of it
+    hp_kd_tree(nside=nside)
+    return shared
+
+
+def run_sim(shared, make_scheduler, filename=None, survey_length=365.25, observatory_kwargs=None,
+            sim_kwargs=None, **kwargs):
+    """Run one simulation of an ensemble.
+
+    Parameters
+    ----------
+    shared : dict
+        The shared data from `load_shared_data`.
+    make_scheduler : callable
+        Called as make_scheduler(shared, **kwargs) and should return a Core_scheduler.
+        Must be a module level function so it can be sent to worker processes.
+    filename : str (None)
+        Where to write the output database.
+    survey_length : float (365.25)
+        Length of the simulation (days).
+    observatory_kwargs : dict (None)
+        Extra kwargs for Model_observatory, e.g., {'cloud_offset_year': 3, 'seed': 7}.
+    sim_kwargs : dict (None)
+        Extra kwargs for sim_runner.
+    **kwargs
+        Passed to make_scheduler (e.g., basis function weights).
+    """
+    from lsst.sims.featureScheduler.modelObservatory import Model_observatory
+
+    if observatory_kwargs is None:
+        observatory_kwargs = {}
+    if sim_kwargs is None:
+        sim_kwargs = {}
+
+    observatory = Model_observatory(nside=shared['nside'], mjd_start=shared['mjd_start'],
+                                    sky_model=shared['sky_model'], almanac=shared['almanac'],
+                                    **observatory_kwargs)
+    scheduler = make_scheduler(shared, **kwargs)
+    observatory, scheduler, observations = sim_runner(observatory, scheduler, survey_length=survey_length,
+                                                      filename=filename, verbose=False, **sim_kwargs)
+    return {'filename': filename, 'n_visits': observations.size}
+
+
+def _init_worker(shared, run_func):
+    global _worker_shared, _worker_run_func
+    _worker_shared = shared
+    _worker_run_func = run_func
+
+
+def _run_one(indexed_config):
+    index, config = indexed_config
+    t0 = time.time()
+    error = None
+    try:
+        result = _worker_run_func(_worker_shared, **config)
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    if not isinstance(result, dict):
+        result = {'result': result}
+    result.update({'index': index, 'runtime': time.time() - t0, 'error': error})
+    return result
+
+
+def ensemble_runner(run_configs, run_func=run_sim, shared=None, n_workers=None, verbose=True):
+    """Run many simulations in parallel, sharing read-only data between them.
+
+    The shared data is loaded once, then worker processes are forked so they all see the
+    same copy of it (pages are only copied if a worker writes to them). Each worker runs
+    one simulation and exits, so the memory used per run is its own scheduler and
+    observatory state, plus any sky brightness files it loads after moving past the span
+    loaded before forking (see load_shared_data).
+
+    Parameters
+    ----------
+    run_configs : list of dict
+        kwargs for each call to run_func, e.g.
+        {'make_scheduler': my_func, 'filename': 'run1.db', 'observatory_kwargs': {'cloud_offset_year': 1}}
+    run_func : callable (run_sim)
+        Called as run_func(shared, **config) in a worker. Should return a dict of results.
+    shared : dict (None)
+        The read-only data to share. If None, load_shared_data() is used.
+    n_workers : int (None)
+        Number of worker processes. Defaults to the number of cores.
+    verbose : bool (True)
+        Print progress and throughput.
+
+    Returns
+    -------
+    list of dict, one per run in the same order as run_configs. Each has the run_func result
+    plus 'runtime' (seconds) and 'error' (traceback string, or None if the run succeeded).
+    """
+    t0 = time.time()
+    if shared is None:
+        shared = load_shared_data()
+    t_loaded = time.time()
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(1, min(n_workers, len(run_configs)))
+
+    # Forking lets the workers inherit the shared data without pickling it
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    results = [None] * len(run_configs)
+    with context.Pool(n_workers, initializer=_init_worker, initargs=(shared, run_func),
+                      maxtasksperchild=1) as pool:
+        for n_done, result in enumerate(pool.imap_unordered(_run_one, enumerate(run_configs))):
+            results[result['index']] = result
+            if verbose:
+                status = 'failed' if result['error'] is not None else 'done'
+                print('run %i %s in %.1f min (%i/%i)' % (result['index'], status, result['runtime']/60.,
+                                                          n_done + 1, len(run_configs)))
+
+    if verbose:
+        runtime = time.time() - t0
+        n_failed = len([result for result in results if result['error'] is not None])
+        n_visits = sum([result.get('n_visits', 0) for result in results if result['error'] is None])
+        print('Loaded shared data in %.1f s' % (t_loaded - t0))
+        print('Completed %i runs (%i failed) on %i workers in %.1f min' % (len(results), n_failed,
+                                                                        n_workers, runtime/60.))
+        print('Throughput: %.2f runs/hour, %.1f visits/s' % (len(results)/runtime*3600., n_visits/runtime))
+        for result in results:
+            if result['error'] is not None:
+                print('run %i failed:\n%s' % (result['index'], result['error']))
+    return results
@@ -1,11 +1,72 @@
 import numpy as np
-from lsst.sims.utils import _approx_RaDec2AltAz, Site, _hpid2RaDec, m5_flat_sed
+from lsst.sims.utils import Site, _hpid2RaDec, m5_flat_sed, calcLmstLast, _angularSeparation
 import healpy as hp
-from lsst.sims.featureScheduler.utils import set_default_nside, match_hp_resolution, approx_altaz2pa
+from lsst.sims.featureScheduler.utils import set_default_nside, match_hp_resolution, hp_in_lsst_fov
 
 __all__ = ['Conditions']
 
 
+# The healpix grid and the site never change, so the trig of the RA, Dec and latitude is
+# computed once per (nside, latitude) and shared by every Conditions object.
+_grid_trig_cache = {}
+
+
+def _grid_trig(nside, ra, dec, latitude_rad):
+    key = (nside, latitude_rad)
+    if key not in _grid_trig_cache:
+        sin_dec = np.sin(dec)
+        cos_dec = np.cos(dec)
+        tables = {'sin_ra': np.sin(ra), 'cos_ra': np.cos(ra), 'sin_dec': sin_dec,
+                  'sin_lat': np.sin(latitude_rad), 'cos_lat': np.cos(latitude_rad)}
+        tables['sin_dec_sin_lat'] = sin_dec*tables['sin_lat']
+        tables['cos_dec_cos_lat'] = cos_dec*tables['cos_lat']
+        _grid_trig_cache[key] = tables
+    return _grid_trig_cache[key]
+
+
+def _grid_alt_az_pa(tables, lmst):
+    """Approximate alt, az and parallactic angle of a fixed grid at one sidereal time.
+
+    Same equations as lsst.sims.utils._approx_RaDec2AltAz and utils.approx_altaz2pa, but the
+    hour angle terms come from rotating the cached sin/cos RA by the LMST, and the sin/cos of
+    alt and az from identities, leaving only arcsin, arccos and arctan2 to compute per pixel.
+
+    Parameters
+    ----------
+    tables : dict
+        Output of _grid_trig.
+    lmst : float
+        Local mean sidereal time (hours).
+
+    Returns
+    -------
+    alt, az, pa : np.array (radians)
+    """
+    lmst_rad = lmst/12.*np.pi
+    sin_lmst = np.sin(lmst_rad)
+    cos_lmst = np.cos(lmst_rad)
+    # ha = lmst - ra
+    cos_ha = cos_lmst*tables['cos_ra'] + sin_lmst*tables['sin_ra']
+    sin_ha = sin_lmst*tables['cos_ra'] - cos_lmst*tables['sin_ra']
+
+    sin_alt = np.clip(tables['sin_dec_sin_lat'] + tables['cos_dec_cos_lat']*cos_ha, -1., 1.)
+    alt = np.arcsin(sin_alt)
+    cos_alt = np.sqrt(1. - sin_alt**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_az = (tables['sin_dec'] - sin_alt*tables['sin_lat'])/(cos_alt*tables['cos_lat'])
+    cos_az = np.clip(cos_az, -1., 1.)
+    az = np.arccos(cos_az)
+    sin_az = np.sqrt(1. - cos_az**2)
+    flip = np.where(sin_ha > 0)
+    az[flip] = 2.*np.pi - az[flip]
+    sin_az[flip] *= -1
+
+    y = -sin_az*tables['cos_lat']
+    x = cos_alt*tables['sin_lat'] - sin_alt*tables['cos_lat']*cos_az
+    pa = np.arctan2(y, x) % (2.*np.pi)
+    return alt, az, pa
+
+
 class Conditions(object):
     """
     Class to hold telemetry information
@@ -131,7 +192,8 @@ class Conditions(object):
             The parallactic angle of each healpixel (radians). Recaclulated if mjd is updated.
             Based on the fast approximate alt,az values.
         lmst : float
-            The local mean sidearal time (hours). Updates is mjd is changed.
+            The local mean sidearal time (hours). Updates is mjd is changed. Computed from the mjd
+            if alt, az, or pa are needed before it is set.
         M5Depth : dict of np.array
             the 5-sigma limiting depth healpix maps, keyed by filtername (mags). Will be recalculated
             if the skybrightness, seeing, or airmass are updated.
@@ -139,11 +201,23 @@ class Conditions(object):
             Healpix map of the hour angle of each healpixel (radians).
         az_to_sun : np.array
             Healpix map of the azimuthal distance to the sun for each healpixel (radians)
+        moon_distance : np.array
+            Healpix map of the angular distance to the moon (radians). Computed from the alt,az
+            of the healpixels and moonAlt, moonAz. Recalculated if mjd, lmst, moonAlt or moonAz is updated.
+        sun_distance : np.array
+            Healpix map of the angular distance to the sun (radians). Computed from sunRA, sunDec.
+            Recalculated if mjd, sunRA or sunDec is updated.
+
+        The derived maps are shared by all the basis functions that use them, so they should not be
+        modified in place.
 
         Attributes (set by the scheduler)
         -------------------------------
-        queue : list of observation objects
+        queue : lsst.sims.featureScheduler.utils.ObservationBatch
             The current queue of observations core_scheduler is waiting to execute.
+        update_id : int
+            A number that is new every time the conditions are passed to Core_scheduler.update_conditions.
+            Results memoized by surveys within a decision are keyed on it.
 
         """
         if nside is None:
@@ -180,6 +254,7 @@ class Conditions(object):
 
         # Attribute to hold the current observing queue
         self.queue = None
+        self.update_id = None
 
         # Moon
         self.moonAlt = None
@@ -216,6 +291,12 @@ class Conditions(object):
         self._cloud_map = None
         self._HA = None
 
+        # Maps derived from the sun, moon, and planet positions
+        self._az_to_sun = None
+        self._moon_distance = None
+        self._sun_distance = None
+        self._planet_masks = {}
+
         # XXX--document
         self.bulk_cloud = None
 
@@ -229,9 +310,64 @@ class Conditions(object):
 
     @lmst.setter
     def lmst(self, value):
+        # alt, az and pa are computed from the lmst, so redo them (and the maps that use them) if it changed
+        if value != self._lmst:
+            self._alt = None
+            self._az = None
+            self._pa = None
+            self._moon_distance = None
         self._lmst = value
         self._HA = None
 
+    # The maps derived from the sun, moon and planet positions are reset when a position is set
+
+    @property
+    def moonAlt(self):
+        return self._moonAlt
+
+    @moonAlt.setter
+    def moonAlt(self, value):
+        self._moonAlt = value
+        self._moon_distance = None
+
+    @property
+    def moonAz(self):
+        return self._moonAz
+
+    @moonAz.setter
+    def moonAz(self, value):
+        self._moonAz = value
+        self._moon_distance = None
+
+    @property
+    def sunRA(self):
+        return self._sunRA
+
+    @sunRA.setter
+    def sunRA(self, value):
+        self._sunRA = value
+        self._sun_distance = None
+        self._az_to_sun = None
+
+    @property
+    def sunDec(self):
+        return self._sunDec
+
+    @sunDec.setter
+    def sunDec(self, value):
+        self._sunDec = value
+        self._sun_distance = None
+
+    @property
+    def planet_positions(self):
+        return self._planet_positions
+
+    @planet_positions.setter
+    def planet_positions(self, value):
+        # Set a new dict rather than modifying it in place, or the masks won't be reset
+        self._planet_positions = value
+        self._planet_masks = {}
+
     @property
     def HA(self):
         if self._HA is None:
@@ -278,7 +414,7 @@ class Conditions(object):
         return self._pa
 
     def calc_pa(self):
-        self._pa = approx_altaz2pa(self.alt, self.az, self.site.latitude_rad)
+        self.calc_altAz()
 
     @property
     def alt(self):
@@ -293,9 +429,10 @@ class Conditions(object):
         return self._az
 
     def calc_altAz(self):
-        self._alt, self._az = _approx_RaDec2AltAz(self.ra, self.dec,
-                                                  self.site.latitude_rad,
-                                                  self.site.longitude_rad, self._mjd)
+        if self._lmst is None:
+            self._lmst, last = calcLmstLast(self._mjd, self.site.longitude_rad)
+        tables = _grid_trig(self.nside, self.ra, self.dec, self.site.latitude_rad)
+        self._alt, self._az, self._pa = _grid_alt_az_pa(tables, self._lmst)
 
     @property
     def mjd(self):
@@ -311,6 +448,9 @@ class Conditions(object):
         self._HA = None
         self._lmst = None
         self._az_to_sun = None
+        self._moon_distance = None
+        self._sun_distance = None
+        self._planet_masks = {}
 
     @property
     def skybrightness(self):
@@ -361,3 +501,50 @@ class Conditions(object):
         if self._az_to_sun is None:
             self.calc_az_to_sun()
         return self._az_to_sun
+
+    @property
+    def moon_distance(self):
+        if self._moon_distance is None:
+            self.calc_moon_distance()
+        return self._moon_distance
+
+    def calc_moon_distance(self):
+        self._moon_distance = _angularSeparation(self.az, self.alt, self.moonAz, self.moonAlt)
+
+    @property
+    def sun_distance(self):
+        if self._sun_distance is None:
+            self.calc_sun_distance()
+        return self._sun_distance
+
+    def calc_sun_distance(self):
+        self._sun_distance = _angularSeparation(self.ra, self.dec, self.sunRA, self.sunDec)
+
+    def planet_mask(self, radius, planets=None, scale=1e5):
+        """Healpixels near the planets, cached until the mjd is updated.
+
+        Parameters
+        ----------
+        radius : float
+            The radius around each planet (degrees).
+        planets : list of str (None)
+            Planet names in planet_positions. Defaults to ['venus', 'mars', 'jupiter'].
+        scale : float (1e5)
+            Passed to utils.hp_in_lsst_fov.
+
+        Returns
+        -------
+        np.array of bool, True for healpixels within radius of a planet
+        """
+        if planets is None:
+            planets = ['venus', 'mars', 'jupiter']
+        key = (radius, tuple(planets), scale)
+        if key not in self._planet_masks:
+            in_fov = hp_in_lsst_fov(nside=self.nside, fov_radius=radius, scale=scale)
+            mask = np.zeros(self.ra.size, dtype=bool)
+            for pn in planets:
+                indices = in_fov(self.planet_positions[pn+'_RA'], self.planet_positions[pn+'_dec'])
+                if indices.size > 0:
+                    mask[indices] = True
+            self._planet_masks[key] = mask
+        return self._planet_masks[key]
@@ -1,58 +1,176 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
 import numpy as np
-from astroplan import Observer
-import astropy.units as u
-from astropy.time import Time
-from lsst.sims.utils import Site
 
-# Trying out the astroplan sunrise/set code.
+# Uses the astroplan sunrise/set code.
 # conda install -c astropy astroplan
-mjd_start = 59853.5 - 3.*365.25
-duration = 25.*365.25
-pad_around = 40
-t_step = 0.7
 
-mjds = np.arange(mjd_start-pad_around, duration+mjd_start+pad_around+t_step, t_step)
+names = ['night', 'sunset', 'sun_n12_setting', 'sun_n18_setting', 'sun_n18_rising',
+         'sun_n12_rising', 'sunrise', 'moonrise', 'moonset']
+types = [int]
+types.extend([float]*(len(names)-1))
 
-site = Site('LSST')
-observer = Observer(longitude=site.longitude*u.deg, latitude=site.latitude*u.deg,
-                    elevation=site.height*u.m, name="LSST")
 
+def almanac_chunk(mjds):
+    """Compute the almanac rows for the nights that start in a block of times.
 
-# This blows up if I try to do it all at once? 250 GB of memory?
-results = []
+    Parameters
+    ----------
+    mjds : np.array
+        Times to search for sunsets from (days).
 
-mjds_list = np.array_split(mjds, 500)
+    Returns
+    -------
+    np.array with the almanac columns ('night' is left at zero).
+    """
+    from astroplan import Observer
+    import astropy.units as u
+    from astropy.time import Time
+    from lsst.sims.utils import Site
+
+    site = Site('LSST')
+    observer = Observer(longitude=site.longitude*u.deg, latitude=site.latitude*u.deg,
+                        elevation=site.height*u.m, name="LSST")
 
-for i, mjds in enumerate(mjds_list):
-    print('chunk %i of %i'%(i, len(mjds_list)))
     times = Time(mjds, format='mjd')
-    print('getting sunsets')
     sunsets = observer.sun_set_time(times)
-
     sunsets = np.unique(np.round(sunsets.mjd, decimals=4))
 
-    names = ['night', 'sunset', 'sun_n12_setting', 'sun_n18_setting', 'sun_n18_rising',
-             'sun_n12_rising', 'sunrise', 'moonrise', 'moonset']
-    types = [int]
-    types.extend([float]*(len(names)-1))
     almanac = np.zeros(sunsets.size, dtype=list(zip(names, types)))
     almanac['sunset'] = sunsets
 
     times = Time(sunsets, format='mjd')
-    print('evening twilight 1')
     almanac['sun_n12_setting'] = observer.twilight_evening_nautical(times).mjd
     almanac['sun_n18_setting'] = observer.twilight_evening_astronomical(times).mjd
     almanac['sun_n18_rising'] = observer.twilight_morning_astronomical(times).mjd
     almanac['sun_n12_rising'] = observer.twilight_morning_nautical(times).mjd
     almanac['sunrise'] = observer.sun_rise_time(times).mjd
     almanac['moonset'] = observer.moon_set_time(times).mjd
-    print('moonrise')
     almanac['moonrise'] = observer.moon_rise_time(times).mjd
-    results.append(almanac)
+    return almanac
+
+
+def _chunk_filename(checkpoint_dir, i):
+    return os.path.join(checkpoint_dir, 'almanac_chunk_%05i.npy' % i)
+
+
+def _run_chunk(args):
+    i, mjds, checkpoint_dir = args
+    t0 = time.time()
+    almanac = almanac_chunk(mjds)
+    # Write then rename, so an interrupted run never leaves a partial chunk behind
+    filename = _chunk_filename(checkpoint_dir, i)
+    temp_name = filename + '.tmp.npy'
+    np.save(temp_name, almanac)
+    os.replace(temp_name, filename)
+    return i, time.time() - t0
+
+
+def merge_chunks(filenames):
+    """Merge almanac chunks into the layout lsst.sims.almanac.Almanac reads.
+
+    Sunsets found by more than one chunk are only kept once, and the nights are numbered in order.
+    """
+    almanac = np.concatenate([np.load(filename) for filename in filenames])
+    umjds, indx = np.unique(almanac['sunset'], return_index=True)
+    almanac = almanac[indx]
+    almanac['night'] = np.arange(almanac['night'].size)
+    return almanac
+
+
+def build_almanac(outfile='sunsets.npz', mjd_start=59853.5 - 3.*365.25, duration=25.*365.25,
+                  pad_around=40, t_step=0.7, n_chunks=500, n_workers=None,
+                  checkpoint_dir='almanac_chunks', verbose=True):
+    """Compute the sunset/twilight/moon almanac in parallel chunks.
+
+    astroplan needs a lot of memory for big blocks of times (hundreds of GB for the whole
+    survey at once), so the time range is split into chunks. Each chunk runs in its own worker
+    process, which exits when the chunk is done, so memory is bounded by the chunk size. Every
+    finished chunk is saved in checkpoint_dir, and a rerun only computes the missing ones.
+
+    Parameters
+    ----------
+    outfile : str ('sunsets.npz')
+        Where to save the merged almanac.
+    mjd_start : float
+        Start of the almanac (days).
+    duration : float (25 years)
+        Length of the almanac (days).
+    pad_around : float (40)
+        Extra time to cover before and after (days).
+    t_step : float (0.7)
+        Spacing of the times sunsets are searched from (days).
+    n_chunks : int (500)
+        Number of chunks to split the times into. More chunks use less memory per worker.
+    n_workers : int (None)
+        Number of worker processes. Defaults to the number of cores.
+    checkpoint_dir : str ('almanac_chunks')
+        Directory for the finished chunks.
+    verbose : bool (True)
+        Print progress and throughput.
+
+    Returns
+    -------
+    np.array of the merged almanac
+    """
+    mjds = np.arange(mjd_start-pad_around, duration+mjd_start+pad_around+t_step, t_step)
+    mjds_list = np.array_split(mjds, n_chunks)
+
+    # Chunks saved for different times can't be reused
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    params = {'mjd_start': mjd_start, 'duration': duration, 'pad_around': pad_around,
+              't_step': t_step, 'n_chunks': n_chunks}
+    params_file = os.path.join(checkpoint_dir, 'params.json')
+    if os.path.isfile(params_file):
+        with open(params_file) as params_in:
+            saved_params = json.load(params_in)
+        if saved_params != params:
+            raise ValueError('%s has chunks for %s, not %s. Use a different checkpoint_dir.' %
+                             (checkpoint_dir, saved_params, params))
+    else:
+        with open(params_file, 'w') as params_out:
+            json.dump(params, params_out)
+
+    todo = [(i, chunk, checkpoint_dir) for i, chunk in enumerate(mjds_list)
+            if not os.path.isfile(_chunk_filename(checkpoint_dir, i))]
+    if verbose:
+        print('%i of %i chunks already done, computing %i' % (n_chunks - len(todo), n_chunks, len(todo)))
+
+    if len(todo) > 0:
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        n_workers = max(1, min(n_workers, len(todo)))
+        t0 = time.time()
+        with multiprocessing.Pool(n_workers, maxtasksperchild=1) as pool:
+            for n_done, (i, runtime) in enumerate(pool.imap_unordered(_run_chunk, todo)):
+                if verbose:
+                    # Throughput so far, and the time left at that rate
+                    elapsed = time.time() - t0
+                    rate = (n_done + 1)/elapsed
+                    remaining = (len(todo) - n_done - 1)/rate
+                    print('chunk %i done in %.1f s (%i/%i), %.1f chunks/min, %.1f min left' %
+                          (i, runtime, n_done + 1, len(todo), rate*60., remaining/60.))
+
+    almanac = merge_chunks([_chunk_filename(checkpoint_dir, i) for i in range(n_chunks)])
+    np.savez(outfile, almanac=almanac)
+    if verbose:
+        print('Wrote %i nights to %s' % (almanac.size, outfile))
+    return almanac
+
 
-almanac = np.concatenate(results)
-umjds, indx = np.unique(almanac['sunset'], return_index=True)
-almanac = almanac[indx]
-almanac['night'] = np.arange(almanac['night'].size)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate the sunset/twilight/moon almanac")
+    parser.add_argument("--outfile", type=str, default='sunsets.npz')
+    parser.add_argument("--mjd_start", type=float, default=59853.5 - 3.*365.25)
+    parser.add_argument("--duration", type=float, default=25.*365.25, help="length (days)")
+    parser.add_argument("--n_chunks", type=int, default=500)
+    parser.add_argument("--n_workers", type=int, default=None)
+    parser.add_argument("--checkpoint_dir", type=str, default='almanac_chunks',
+                        help="finished chunks are saved here so a rerun can resume")
+    args = parser.parse_args()
 
-np.savez('sunsets.npz', almanac=almanac)
+    build_almanac(outfile=args.outfile, mjd_start=args.mjd_start, duration=args.duration,
+                  n_chunks=args.n_chunks, n_workers=args.n_workers, checkpoint_dir=args.checkpoint_dir)
@@ -1,8 +1,8 @@
+import multiprocessing
 import numpy as np
 from lsst.sims.utils import Site
 from astropy.coordinates import get_sun, get_moon, EarthLocation, AltAz
 from astropy.time import Time
-from scipy.optimize import minimize, Bounds
 
 
 __all__ = ['generate_nights']
@@ -16,47 +16,149 @@ def lin_interp(x, x0, x1, y0, y1):
     return y
 
 
-def alt_passing_interp(times, altitudes, goal_alt=0., rising=True):
-    """find time when a body passses some altitude
+def body_altitude(mjds, location, body='sun'):
+    """Altitude of the sun or moon (degrees) at an array of times.
     """
-    if rising:
-        below = np.where((altitudes < goal_alt) & (np.roll(altitudes, -1) > goal_alt))[0]
-        above = below + 1
+    times = Time(mjds, format='mjd')
+    if body == 'sun':
+        coords = get_sun(times)
     else:
-        above = np.where((altitudes > goal_alt) & (np.roll(altitudes, -1) < goal_alt))[0]
-        below = above + 1
+        coords = get_moon(times)
+    aa = AltAz(location=location, obstime=times)
+    return coords.transform_to(aa).alt.deg
 
-    if (below.max() >= np.size(below)) | (above.max() >= np.size(above)):
-        below = below[:-1]
-        above = above[:-1]
 
-    pass_times = lin_interp(goal_alt, altitudes[above], altitudes[below], times[above], times[below])
-    return pass_times
+def _altitudes_chunk(args):
+    mjds, lat, lon, height = args
+    location = EarthLocation(lat=lat, lon=lon, height=height)
+    return body_altitude(mjds, location, 'sun'), body_altitude(mjds, location, 'moon')
 
 
-def alt_sun_sum(in_mjds, location, offset):
+def sample_altitudes(mjds, site, n_chunks=None, n_workers=None):
+    """Compute the sun and moon altitudes at a grid of times, in chunks spread over processes.
 
-    times = Time(in_mjds, format='mjd')
-    sun = get_sun(times)
-    aa = AltAz(location=location, obstime=times)
-    sun = sun.transform_to(aa)
-    result = np.sum(np.abs(sun.alt.deg + offset))
-    return result
+    Parameters
+    ----------
+    mjds : np.array
+        The times to sample.
+    site : lsst.sims.utils.Site
+    n_chunks : int (None)
+        Number of chunks to split the times into. Defaults to 4 per worker.
+    n_workers : int (None)
+        Number of worker processes. Defaults to the number of cores, 1 runs in this process.
+
+    Returns
+    -------
+    sun_alt, moon_alt : np.array (degrees)
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if n_chunks is None:
+        n_chunks = 4*n_workers
+    chunks = [(chunk, site.latitude, site.longitude, site.height)
+              for chunk in np.array_split(mjds, max(1, min(n_chunks, mjds.size)))]
+    if n_workers > 1:
+        # Forked workers don't need to re-import astropy
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(n_workers) as pool:
+            results = pool.map(_altitudes_chunk, chunks)
+    else:
+        results = [_altitudes_chunk(chunk) for chunk in chunks]
+    sun_alt = np.concatenate([result[0] for result in results])
+    moon_alt = np.concatenate([result[1] for result in results])
+    return sun_alt, moon_alt
 
 
-def alt_moon_sum(in_mjds, location, offset):
+def find_crossings(altitudes, goal_alt=0., rising=True):
+    """Find the samples a body crosses an altitude between.
 
-    times = Time(in_mjds, format='mjd')
-    moon = get_moon(times)
-    aa = AltAz(location=location, obstime=times)
-    moon = moon.transform_to(aa)
-    result = np.sum(np.abs(moon.alt.deg + offset))
-    return result
+    Returns
+    -------
+    indx : np.array
+        The body crosses goal_alt between samples indx and indx+1.
+    """
+    diff = altitudes - goal_alt
+    if rising:
+        indx = np.where((diff[:-1] < 0) & (diff[1:] >= 0))[0]
+    else:
+        indx = np.where((diff[:-1] >= 0) & (diff[1:] < 0))[0]
+    return indx
+
+
+def refine_crossings(t0, t1, f0, f1, bodies, goal_alts, location, tol=1e-6, max_iter=30):
+    """Refine many altitude crossings at once with a bracketed root finder.
 
+    Uses the Illinois variant of regula falsi. Every iteration evaluates the sun and the
+    moon once each, for all the crossings that have not converged yet.
 
-def generate_nights(mjd_start, duration=3653., rough_step=2, verbose=False):
+    Parameters
+    ----------
+    t0, t1 : np.array
+        Times that bracket each crossing (days).
+    f0, f1 : np.array
+        Altitude minus goal altitude at t0 and t1 (degrees), opposite signs.
+    bodies : np.array of str
+        'sun' or 'moon' for each crossing.
+    goal_alts : np.array
+        The altitude being crossed (degrees).
+    location : astropy EarthLocation
+    tol : float (1e-6)
+        Stop when successive estimates change by less than this (days).
+    max_iter : int (30)
+        Maximum number of iterations.
+
+    Returns
+    -------
+    rough : np.array
+        The linear interpolation between the brackets (days).
+    refined : np.array
+        The refined crossing times (days).
+    """
+    a = np.array(t0, dtype=float)
+    b = np.array(t1, dtype=float)
+    fa = np.array(f0, dtype=float)
+    fb = np.array(f1, dtype=float)
+    rough = b - fb*(b - a)/(fb - fa)
+    result = rough.copy()
+    active = np.arange(a.size)
+
+    for i in range(max_iter):
+        if active.size == 0:
+            break
+        c = result[active]
+        fc = np.empty(c.size)
+        for body in ['sun', 'moon']:
+            in_body = np.where(bodies[active] == body)[0]
+            if in_body.size > 0:
+                fc[in_body] = body_altitude(c[in_body], location, body) - goal_alts[active][in_body]
+
+        # Keep the root bracketed. If the same end was kept twice, halve its value (Illinois)
+        swap = fc*fb[active] < 0
+        a[active] = np.where(swap, b[active], a[active])
+        fa[active] = np.where(swap, fb[active], fa[active]/2.)
+        b[active] = c
+        fb[active] = fc
+
+        denom = fb[active] - fa[active]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            new_c = b[active] - fb[active]*(b[active] - a[active])/denom
+        # Landed right on the root
+        new_c = np.where((fc == 0) | (denom == 0), c, new_c)
+        result[active] = new_c
+        active = active[np.abs(new_c - c) > tol]
+
+    return rough, result
+
+
+def generate_nights(mjd_start, duration=3653., rough_step=2, verbose=False, n_workers=None, tol=1e-6):
     """Generate the sunset and twilight times for a range of dates
 
+    The sun and moon altitudes are sampled every rough_step (in parallel chunks), then every
+    altitude crossing over the whole duration is refined together with `refine_crossings`.
+
     Parameters
     ----------
     mjd_start : float
@@ -65,112 +167,87 @@ def generate_nights(mjd_start, duration=3653., rough_step=2, verbose=False):
         How long to compute times for (days)
     rough_step : float (2.)
         Time step for computing first pass rough sunrise times (hours)
+    n_workers : int (None)
+        Number of processes for the rough sampling. Defaults to the number of cores.
+    tol : float (1e-6)
+        Convergence tolerance of the refined times (days).
+
+    Returns
+    -------
+    alt_info_array : np.array
+        The times from linear interpolation of the rough sampling.
+    refined_mjds : np.array
+        The refined times.
     """
 
-    # Let's find the nights first, find the times where the sun crosses the meridian.
     site = Site('LSST')
     location = EarthLocation(lat=site.latitude, lon=site.longitude, height=site.height)
-    # go on 1/10th of a day steps
     t_step = rough_step/24.
     pad_around = 30./24.
-    t_sparse = Time(np.arange(mjd_start-pad_around, duration+mjd_start+pad_around+t_step, t_step),
-                    format='mjd', location=location)
-    sun = get_sun(t_sparse)
-    aa = AltAz(location=location, obstime=t_sparse)
-    sun_aa_sparse = sun.transform_to(aa)
-
-    moon = get_moon(t_sparse)
-    moon_aa_sparse = moon.transform_to(aa)
-
-    # Indices right before sunset
-    mjd_sunset_rough = alt_passing_interp(t_sparse.mjd, sun_aa_sparse.alt.deg,
-                                          goal_alt=0., rising=False)
+    mjds = np.arange(mjd_start-pad_around, duration+mjd_start+pad_around+t_step, t_step)
+    if verbose:
+        print('sampling %i times' % mjds.size)
+    alts = {}
+    alts['sun'], alts['moon'] = sample_altitudes(mjds, site, n_workers=n_workers)
+
+    # (body, altitude, rising) for each column
+    crossings = {'sunset': ('sun', 0., False), 'sun_n12_setting': ('sun', -12., False),
+                 'sun_n18_setting': ('sun', -18., False), 'sun_n18_rising': ('sun', -18., True),
+                 'sun_n12_rising': ('sun', -12., True), 'sunrise': ('sun', 0., True),
+                 'moonrise': ('moon', 0., True), 'moonset': ('moon', 0., False)}
+
+    # Bracket every crossing, then refine them all together
+    keys = []
+    indices = []
+    bodies = []
+    goal_alts = []
+    for key in crossings:
+        body, goal_alt, rising = crossings[key]
+        indx = find_crossings(alts[body], goal_alt=goal_alt, rising=rising)
+        keys.append(np.repeat(key, indx.size))
+        indices.append(indx)
+        bodies.append(np.repeat(body, indx.size))
+        goal_alts.append(np.repeat(goal_alt, indx.size))
+    keys = np.concatenate(keys)
+    indices = np.concatenate(indices)
+    bodies = np.concatenate(bodies)
+    goal_alts = np.concatenate(goal_alts)
+    f0 = np.where(bodies == 'sun', alts['sun'][indices], alts['moon'][indices]) - goal_alts
+    f1 = np.where(bodies == 'sun', alts['sun'][indices+1], alts['moon'][indices+1]) - goal_alts
+    if verbose:
+        print('refining %i crossings' % keys.size)
+    rough, refined = refine_crossings(mjds[indices], mjds[indices+1], f0, f1, bodies, goal_alts,
+                                      location, tol=tol)
 
     names = ['night', 'sunset', 'sun_n12_setting', 'sun_n18_setting', 'sun_n18_rising',
              'sun_n12_rising', 'sunrise', 'moonrise', 'moonset']
     types = [int]
     types.extend([float]*(len(names)-1))
-    alt_info_array = np.zeros(mjd_sunset_rough.size, dtype=list(zip(names, types)))
-    alt_info_array['sunset'] = mjd_sunset_rough
+    in_key = np.where(keys == 'sunset')[0]
+    alt_info_array = np.zeros(in_key.size, dtype=list(zip(names, types)))
+    alt_info_array['sunset'] = rough[in_key]
+    refined_mjds = alt_info_array.copy()
+    refined_mjds['sunset'] = refined[in_key]
     # label the nights
-    alt_info_array['night'] = np.arange(mjd_sunset_rough.size)
+    alt_info_array['night'] = np.arange(in_key.size)
     night_1_index = np.searchsorted(alt_info_array['sunset'], mjd_start)
     alt_info_array['night'] += 1-alt_info_array['night'][night_1_index]
+    refined_mjds['night'] = alt_info_array['night']
 
-    # OK, now I have sunset times
-    sunrises = alt_passing_interp(t_sparse.mjd, sun_aa_sparse.alt.deg,
-                                  goal_alt=0., rising=True)
-    # Make sure sunrise happens after sunset
-    insert_indices = np.searchsorted(alt_info_array['sunset'], sunrises, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['sunrise'][insert_indices[good_indices]] = sunrises[good_indices]
-
-    # Should probably write the function to get rin of the copy-pasta
-    point = alt_passing_interp(t_sparse.mjd, sun_aa_sparse.alt.deg,
-                               goal_alt=-12., rising=False)
-    insert_indices = np.searchsorted(alt_info_array['sunset'], point, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['sun_n12_setting'][insert_indices[good_indices]] = point[good_indices]
-
-    point = alt_passing_interp(t_sparse.mjd, sun_aa_sparse.alt.deg,
-                               goal_alt=-12., rising=True)
-    insert_indices = np.searchsorted(alt_info_array['sunset'], point, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['sun_n12_rising'][insert_indices[good_indices]] = point[good_indices]
-
-    point = alt_passing_interp(t_sparse.mjd, sun_aa_sparse.alt.deg,
-                               goal_alt=-18., rising=True)
-    insert_indices = np.searchsorted(alt_info_array['sunset'], point, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['sun_n18_rising'][insert_indices[good_indices]] = point[good_indices]
-
-    point = alt_passing_interp(t_sparse.mjd, sun_aa_sparse.alt.deg,
-                               goal_alt=-18., rising=False)
-    insert_indices = np.searchsorted(alt_info_array['sunset'], point, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['sun_n18_setting'][insert_indices[good_indices]] = point[good_indices]
-
-    point = alt_passing_interp(t_sparse.mjd, moon_aa_sparse.alt.deg, goal_alt=0., rising=True)
-    insert_indices = np.searchsorted(alt_info_array['sunset'], point, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['moonrise'][insert_indices[good_indices]] = point[good_indices]
-
-    point = alt_passing_interp(t_sparse.mjd, moon_aa_sparse.alt.deg, goal_alt=0., rising=False)
-    insert_indices = np.searchsorted(alt_info_array['sunset'], point, side='left')-1
-    good_indices = np.where(insert_indices > 0)[0]
-    alt_info_array['moonset'][insert_indices[good_indices]] = point[good_indices]
+    # Put each crossing in the night that it happens after the sunset of
+    for key in crossings:
+        if key == 'sunset':
+            continue
+        in_key = np.where(keys == key)[0]
+        insert_indices = np.searchsorted(alt_info_array['sunset'], rough[in_key], side='left')-1
+        good_indices = np.where(insert_indices > 0)[0]
+        alt_info_array[key][insert_indices[good_indices]] = rough[in_key][good_indices]
+        refined_mjds[key][insert_indices[good_indices]] = refined[in_key][good_indices]
 
     # Crop off some regions that might not have been filled
     good = np.where(alt_info_array['night'] > 0)[0]
     alt_info_array = alt_info_array[good[:-1]]
-
-    # Put bounds so we don't go to far from rough fit
-    refined_mjds = np.empty_like(alt_info_array)
-    refined_mjds['night'] = alt_info_array['night']
-
-    names_dict = {'sunset': 0., 'sun_n12_setting': 12., 'sun_n18_setting': 18., 'sun_n18_rising': 18.,
-                  'sun_n12_rising': 12., 'sunrise': 0}
-
-    # Need to keep the runtime reasonable
-    options = {'maxiter': 5}
-    for key in names_dict:
-        if verbose:
-            print(key)
-        bounds = Bounds(alt_info_array[key]-rough_step/10./24., alt_info_array[key] + rough_step/10./24.)
-        new_mjds = minimize(alt_sun_sum, alt_info_array[key],
-                            bounds=bounds, args=(location, names_dict[key]), options=options)
-        refined_mjds[key] = new_mjds.x
-
-    for key in ['moonrise', 'moonset']:
-        if verbose:
-            print(key)
-        bounds = Bounds(alt_info_array[key]-rough_step/10./24., alt_info_array[key] + rough_step/10./24.)
-        new_mjds = minimize(alt_moon_sum, alt_info_array[key], bounds=bounds,
-                            args=(location, 0.), options=options)
-        refined_mjds[key] = new_mjds.x
-
-    # Note, there is the possibility that some moonrise/moonset times changed nights upon refinement. I suppose
-    # I could do another seatchsorted pass here just to be extra sure nothing changed.
+    refined_mjds = refined_mjds[good[:-1]]
 
     return alt_info_array, refined_mjds
 
@@ -178,10 +255,8 @@ if __name__ == '__main__':
 
     # Let's use astropy to pre-compute the sunrise/sunset/twilight/moonrise/moonset times we're interested in.
     mjd_start = 59853.5
-    # 
+    #
     rough_times, refined_mjds = generate_nights(mjd_start-365.25*2-40., duration=365.25*24+80, rough_step=2)
     #rough_times, refined_mjds = generate_nights(mjd_start, duration=50, rough_step=2)
     # Maybe just use pandas to dump it to a csv file?
     np.savez('night_info.npz', rough_times=rough_times, refined_mjds=refined_mjds)
-
-
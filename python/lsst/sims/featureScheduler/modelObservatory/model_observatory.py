@@ -1,4 +1,5 @@
 import logging
+import time
 import numpy as np
 from lsst.sims.utils import (_hpid2RaDec, _raDec2Hpid, Site, calcLmstLast,
                              m5_flat_sed, _approx_RaDec2AltAz, _angularSeparation)
@@ -16,9 +17,9 @@ from astropy.coordinates import EarthLocation
 from astropy.time import Time
 from lsst.sims.almanac import Almanac
 import warnings
-import matplotlib.pylab as plt
 from lsst.ts.observatory.model import ObservatoryState
 from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
 
 __all__ = ['Model_observatory']
 
@@ -276,7 +277,8 @@ class Model_observatory(object):
 
     def __init__(self, nside=None, mjd_start=59853.5, seed=42, quickTest=True,
                  alt_min=5., lax_dome=True, cloud_limit=0.3, sim_ToO=None,
-                 seeing_db=None, cloud_db=None, cloud_offset_year=0):
+                 seeing_db=None, cloud_db=None, cloud_offset_year=0, sky_model=None, almanac=None,
+                 background_load=True):
         """
         Parameters
         ----------
@@ -298,7 +300,19 @@ class Model_observatory(object):
             Offset into the cloud database by 'offset_year' years. Default 0.
         cloud_db : filename of the cloud data database (None)
             If one would like to use an alternate seeing database
+        sky_model : lsst.sims.skybrightness_pre.SkyModelPre (None)
+            An already loaded sky model to use. Loaded if None. Handy for sharing one
+            sky model between many simulations (see ensemble_runner).
+        almanac : lsst.sims.almanac.Almanac (None)
+            An already loaded almanac, made with the same mjd_start. Loaded if None.
+        background_load : bool (True)
+            The downtime, seeing, cloud, sky and observatory models are loaded concurrently on
+            worker threads. If True, __init__ only waits for the ones it needs (almanac, clouds and
+            downtime) and the rest finish in the background while the scheduler is set up, each
+            blocking the first time it is used. If False, wait for all of them before returning.
         """
+        # For measuring the time to the first scheduler decision. sim_runner uses it once, then clears it
+        self.t_start = time.time()
 
         if nside is None:
             nside = set_default_nside()
@@ -321,16 +335,89 @@ class Model_observatory(object):
         self.location = EarthLocation(lat=self.site.latitude, lon=self.site.longitude,
                                       height=self.site.height)
 
-        # Load up all the models we need
-
+        # Load up all the models we need. Each loader returns a dict of attributes, which are
+        # filled in by __getattr__ the first time one of them is used.
         mjd_start_time = Time(self.mjd_start, format='mjd')
-        # Downtime
-        self.down_nights = []
-        self.sched_downtime_data = ScheduledDowntimeData(mjd_start_time)
-        self.unsched_downtime_data = UnscheduledDowntimeData(mjd_start_time)
+        loaders = [(self._load_downtimes, (mjd_start_time,)),
+                   (self._load_seeing, (mjd_start_time, seeing_db)),
+                   (self._load_clouds, (mjd_start_time, cloud_db, cloud_offset_year)),
+                   (self._load_observatory_model, ())]
+        if sky_model is None:
+            loaders.append((self._load_sky_model, (quickTest,)))
+        else:
+            self.sky_model = sky_model
+        if almanac is None:
+            loaders.append((self._load_almanac, (mjd_start,)))
+        else:
+            self.almanac = almanac
+
+        self._pending = {}
+        executor = ThreadPoolExecutor(max_workers=len(loaders))
+        for loader, args in loaders:
+            future = executor.submit(loader, *args)
+            for name in self._loader_attributes[loader.__name__]:
+                self._pending[name] = future
+        executor.shutdown(wait=False)
+
+        self.filterlist = ['u', 'g', 'r', 'i', 'z', 'y']
+        self.seeing_FWHMeff = {}
+        for key in self.filterlist:
+            self.seeing_FWHMeff[key] = np.zeros(hp.nside2npix(self.nside), dtype=float)
+
+        # Let's make sure we're at an openable MJD
+        good_mjd = False
+        to_set_mjd = mjd_start
+        while not good_mjd:
+            good_mjd, to_set_mjd = self.check_mjd(to_set_mjd)
+        self.mjd = to_set_mjd
+
+        # Sun and moon positions at the current mjd, see sun_moon_positions
+        self._sun_moon_mjd = None
+        self._sun_moon_info = None
 
-        sched_downtimes = self.sched_downtime_data()
-        unsched_downtimes = self.unsched_downtime_data()
+        self.obsID_counter = 0
+
+        if not background_load:
+            self._finish_loading()
+
+    # The attributes each loader sets
+    _loader_attributes = {'_load_downtimes': ['sched_downtime_data', 'unsched_downtime_data', 'downtimes',
+                                              'down_nights'],
+                          '_load_seeing': ['seeing_data', 'seeing_model', 'seeing_indx_dict'],
+                          '_load_clouds': ['cloud_data'],
+                          '_load_observatory_model': ['observatory'],
+                          '_load_sky_model': ['sky_model'],
+                          '_load_almanac': ['almanac']}
+
+    def __getattr__(self, name):
+        # Only called if name isn't set yet, so check if it is still loading
+        pending = self.__dict__.get('_pending')
+        if (pending is None) or (name not in pending):
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+        attributes = pending[name].result()
+        for key in attributes:
+            self.__dict__[key] = attributes[key]
+            pending.pop(key, None)
+        return attributes[name]
+
+    def _finish_loading(self):
+        """Wait for all the models to be loaded.
+        """
+        for name in list(self._pending.keys()):
+            if name in self._pending:
+                getattr(self, name)
+
+    def __getstate__(self):
+        # Futures can't be pickled or copied
+        self._finish_loading()
+        return self.__dict__.copy()
+
+    def _load_downtimes(self, mjd_start_time):
+        sched_downtime_data = ScheduledDowntimeData(mjd_start_time)
+        unsched_downtime_data = UnscheduledDowntimeData(mjd_start_time)
+
+        sched_downtimes = sched_downtime_data()
+        unsched_downtimes = unsched_downtime_data()
 
         down_starts = []
         down_ends = []
@@ -341,54 +428,52 @@ class Model_observatory(object):
             down_starts.append(dt['start'].mjd)
             down_ends.append(dt['end'].mjd)
 
-        self.downtimes = np.array(list(zip(down_starts, down_ends)), dtype=list(zip(['start', 'end'], [float, float])))
-        self.downtimes.sort(order='start')
+        downtimes = np.array(list(zip(down_starts, down_ends)), dtype=list(zip(['start', 'end'], [float, float])))
+        downtimes.sort(order='start')
 
         # Make sure there aren't any overlapping downtimes
-        diff = self.downtimes['start'][1:] - self.downtimes['end'][0:-1]
+        diff = downtimes['start'][1:] - downtimes['end'][0:-1]
         while np.min(diff) < 0:
             # Should be able to do this wihtout a loop, but this works
-            for i, dt in enumerate(self.downtimes[0:-1]):
-                if self.downtimes['start'][i+1] < dt['end']:
-                    new_end = np.max([dt['end'], self.downtimes['end'][i+1]])
-                    self.downtimes[i]['end'] = new_end
-                    self.downtimes[i+1]['end'] = new_end
-
-            good = np.where(self.downtimes['end'] - np.roll(self.downtimes['end'], 1) != 0)
-            self.downtimes = self.downtimes[good]
-            diff = self.downtimes['start'][1:] - self.downtimes['end'][0:-1]
-
-        self.seeing_data = SeeingData(mjd_start_time, seeing_db=seeing_db)
-        self.seeing_model = SeeingModel()
-        self.seeing_indx_dict = {}
-        for i, filtername in enumerate(self.seeing_model.filter_list):
-            self.seeing_indx_dict[filtername] = i
-
-        self.cloud_data = CloudData(mjd_start_time, cloud_db=cloud_db, offset_year=cloud_offset_year)
-        sched_logger.info(f"Using {self.cloud_data.cloud_db} as cloud database with start year {self.cloud_data.start_time.iso}")
-        
-        self.sky_model = sb.SkyModelPre(speedLoad=quickTest)
-
-        self.observatory = ExtendedObservatoryModel()
-        self.observatory.configure_from_module()
+            for i, dt in enumerate(downtimes[0:-1]):
+                if downtimes['start'][i+1] < dt['end']:
+                    new_end = np.max([dt['end'], downtimes['end'][i+1]])
+                    downtimes[i]['end'] = new_end
+                    downtimes[i+1]['end'] = new_end
+
+            good = np.where(downtimes['end'] - np.roll(downtimes['end'], 1) != 0)
+            downtimes = downtimes[good]
+            diff = downtimes['start'][1:] - downtimes['end'][0:-1]
+
+        return {'sched_downtime_data': sched_downtime_data, 'unsched_downtime_data': unsched_downtime_data,
+                'downtimes': downtimes, 'down_nights': []}
+
+    def _load_seeing(self, mjd_start_time, seeing_db):
+        seeing_data = SeeingData(mjd_start_time, seeing_db=seeing_db)
+        seeing_model = SeeingModel()
+        seeing_indx_dict = {}
+        for i, filtername in enumerate(seeing_model.filter_list):
+            seeing_indx_dict[filtername] = i
+        return {'seeing_data': seeing_data, 'seeing_model': seeing_model,
+                'seeing_indx_dict': seeing_indx_dict}
+
+    def _load_clouds(self, mjd_start_time, cloud_db, cloud_offset_year):
+        cloud_data = CloudData(mjd_start_time, cloud_db=cloud_db, offset_year=cloud_offset_year)
+        sched_logger.info(f"Using {cloud_data.cloud_db} as cloud database with start year {cloud_data.start_time.iso}")
+        return {'cloud_data': cloud_data}
+
+    def _load_observatory_model(self):
+        observatory = ExtendedObservatoryModel()
+        observatory.configure_from_module()
         # Make it so it respects my requested rotator angles
-        self.observatory.params.rotator_followsky = True
+        observatory.params.rotator_followsky = True
+        return {'observatory': observatory}
 
-        self.filterlist = ['u', 'g', 'r', 'i', 'z', 'y']
-        self.seeing_FWHMeff = {}
-        for key in self.filterlist:
-            self.seeing_FWHMeff[key] = np.zeros(hp.nside2npix(self.nside), dtype=float)
+    def _load_sky_model(self, quickTest):
+        return {'sky_model': sb.SkyModelPre(speedLoad=quickTest)}
 
-        self.almanac = Almanac(mjd_start=mjd_start)
-
-        # Let's make sure we're at an openable MJD
-        good_mjd = False
-        to_set_mjd = mjd_start
-        while not good_mjd:
-            good_mjd, to_set_mjd = self.check_mjd(to_set_mjd)
-        self.mjd = to_set_mjd
-
-        self.obsID_counter = 0
+    def _load_almanac(self, mjd_start):
+        return {'almanac': Almanac(mjd_start=mjd_start)}
 
     def get_info(self):
         """
@@ -486,10 +571,7 @@ class Model_observatory(object):
         self.conditions.slewtime = slewtimes
 
         # Let's get the sun and moon
-        sun_moon_info = self.almanac.get_sun_moon_positions(self.mjd)
-        # convert these to scalars
-        for key in sun_moon_info:
-            sun_moon_info[key] = sun_moon_info[key].max()
+        sun_moon_info = self.sun_moon_positions()
         self.conditions.moonPhase = sun_moon_info['moon_phase']
 
         self.conditions.moonAlt = sun_moon_info['moon_alt']
@@ -531,6 +613,18 @@ class Model_observatory(object):
 
         return self.conditions
 
+    def sun_moon_positions(self):
+        """Sun and moon positions at the current mjd, as scalars.
+
+        The almanac is only asked once per mjd: the conditions for the next decision are
+        made at the same mjd as the metadata of the visit that was just completed.
+        """
+        if self._sun_moon_mjd != self.mjd:
+            sun_moon_info = self.almanac.get_sun_moon_positions(self.mjd)
+            self._sun_moon_info = {key: np.max(sun_moon_info[key]) for key in sun_moon_info}
+            self._sun_moon_mjd = self.mjd
+        return self._sun_moon_info
+
     @property
     def mjd(self):
         return self._mjd
@@ -572,7 +666,7 @@ class Model_observatory(object):
         lmst, last = calcLmstLast(self.mjd, self.site.longitude_rad)
         observation['lmst'] = lmst
 
-        sun_moon_info = self.almanac.get_sun_moon_positions(self.mjd)
+        sun_moon_info = self.sun_moon_positions()
         observation['sunAlt'] = sun_moon_info['sun_alt']
         observation['sunAz'] = sun_moon_info['sun_az']
         observation['sunRA'] = sun_moon_info['sun_RA']
@@ -1,2 +1,4 @@
+from .feasibility_calendar import *
 from .core_scheduler import *
 from .filter_scheduler import *
+from .scheduler_service import *
@@ -3,16 +3,104 @@ from builtins import object
 import numpy as np
 import healpy as hp
 from lsst.sims.utils import _hpid2RaDec
-from lsst.sims.featureScheduler.utils import hp_in_lsst_fov, set_default_nside, hp_in_comcam_fov, int_rounded
+from lsst.sims.featureScheduler.utils import (hp_in_lsst_fov, set_default_nside, hp_in_comcam_fov, int_rounded,
+                                              ObservationBatch)
 from lsst.sims.utils import _approx_RaDec2AltAz
 from lsst.sims.featureScheduler.utils import approx_altaz2pa
-
-
+from lsst.sims.featureScheduler.schedulers.feasibility_calendar import Feasibility_calendar
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import copy
+import itertools
 import logging
 
 
 __all__ = ['Core_scheduler']
 
+# Numbers each call to Core_scheduler.update_conditions. Shared by every scheduler, so a
+# speculation's copy of the conditions never gets the same number as the original.
+_update_ids = itertools.count()
+
+
+def _observations_match(predicted, observed, mjd_tol):
+    """Check if an observation is the same as the one that was predicted.
+
+    Parameters
+    ----------
+    predicted : np.array
+        The predicted observation.
+    observed : np.array
+        The observation that was actually taken.
+    mjd_tol : float
+        How much the mjd can differ by (days).
+    """
+    for name in predicted.dtype.names:
+        if name == 'mjd':
+            if np.abs(predicted[name] - observed[name]).max() > mjd_tol:
+                return False
+        elif predicted.dtype[name].kind == 'f':
+            if not np.all(np.isclose(predicted[name], observed[name], rtol=1e-9, atol=0., equal_nan=True)):
+                return False
+        elif not np.all(predicted[name] == observed[name]):
+            return False
+    return True
+
+
+def _too_ids(conditions):
+    if conditions.targets_of_opportunity is None:
+        return []
+    return [too.id for too in conditions.targets_of_opportunity]
+
+
+def _conditions_match(predicted, actual):
+    """Check if the conditions a speculation used agree with the real ones.
+
+    Compares the filters, the bulk cloud level, and the targets of opportunity. The healpix maps
+    (seeing, sky brightness, slewtime, cloud map) are not compared.
+    """
+    if predicted.current_filter != actual.current_filter:
+        return False
+    if not np.array_equal(predicted.mounted_filters, actual.mounted_filters):
+        return False
+    if (predicted.bulk_cloud is None) | (actual.bulk_cloud is None):
+        if (predicted.bulk_cloud is not None) | (actual.bulk_cloud is not None):
+            return False
+    elif not np.isclose(predicted.bulk_cloud, actual.bulk_cloud, rtol=1e-9, atol=0.):
+        return False
+    return _too_ids(predicted) == _too_ids(actual)
+
+
+class _Speculation_cancelled(Exception):
+    """Raised on the worker thread when a speculation is no longer wanted.
+    """
+    pass
+
+
+class _Speculation(object):
+    """Book-keeping for a next queue being computed in the background.
+    """
+    def __init__(self, predicted_observation, predicted_conditions):
+        self.predicted_observation = predicted_observation
+        self.predicted_conditions = predicted_conditions
+        # Observations that came in while the speculation was running, and have not
+        # been added to the surveys yet.
+        self.pending = []
+        self.conditions_updated = False
+        # Set once the worker has its own copy of the surveys, so it is safe to touch them again
+        self.copied = threading.Event()
+        # Set when the result won't be used, so the worker stops early
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def cancel_and_wait(self):
+        """Stop the worker as soon as it checks, and wait for it to finish.
+        """
+        self.cancelled.set()
+        try:
+            self.future.result()
+        except Exception:
+            pass
+
 
 class Core_scheduler(object):
     """Core scheduler that takes completed observations and observatory status and requests observations
@@ -33,7 +121,8 @@ class Core_scheduler(object):
         generate a default if set to None.
     """
 
-    def __init__(self, surveys, nside=None, camera='LSST', rotator_limits=[85., 275.]):
+    def __init__(self, surveys, nside=None, camera='LSST', rotator_limits=[85., 275.],
+                 speculation_tolerance=1., prune_surveys=False, use_feasibility_calendar=False):
         """
         Parameters
         ----------
@@ -47,13 +136,21 @@ class Core_scheduler(object):
             Which camera to use for computing overlapping HEALpixels for an observation.
             Can be 'LSST' or 'comcam'
         rotator_limits : sequence of floats
+        speculation_tolerance : float (1.)
+            How far (seconds) the real observation and conditions can be from the ones passed
+            to `speculate` and still use the speculatively computed queue.
+        prune_surveys : bool (False)
+            Skip computing the full reward of a survey when its `upper_bound` shows it can't beat
+            the best reward found so far in its tier. The selected survey is the same either way.
+        use_feasibility_calendar : bool (False)
+            Skip surveys that the nightly Feasibility_calendar shows can't be feasible now.
         """
         if nside is None:
             nside = set_default_nside()
 
         self.log = logging.getLogger("Core_scheduler")
         # initialize a queue of observations to request
-        self.queue = []
+        self.queue = ObservationBatch()
         # The indices of self.survey_lists that provided the last addition(s) to the queue
         self.survey_index = [None, None]
 
@@ -77,11 +174,154 @@ class Core_scheduler(object):
         self.flushed = 0
         self.rotator_limits = np.sort(np.radians(rotator_limits))
 
+        # For pipelined scheduling, see `speculate`
+        self.speculation_tolerance = speculation_tolerance/3600./24.
+        self.speculation_hits = 0
+        self.speculation_misses = 0
+        self._speculation = None
+        self._executor = None
+        # Set on the speculative copy of the scheduler, see `_run_speculation`
+        self._cancel = None
+
+        # Branch-and-bound survey selection, see `_fill_queue`
+        self.prune_surveys = prune_surveys
+        self.n_pruned = 0
+
+        if use_feasibility_calendar:
+            self.feasibility_calendar = Feasibility_calendar()
+        else:
+            self.feasibility_calendar = None
+
+    def __getstate__(self):
+        # Threads can't be pickled or copied, drop any speculation in progress
+        self._resolve_speculation(commit=False)
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def speculate(self, predicted_observation, predicted_conditions):
+        """Start computing the next queue in the background while the current observation executes.
+
+        The surveys are copied, the predicted observation and conditions are applied to the copy,
+        and the queue is filled from it on a worker thread. While this runs, observations passed to
+        `add_observation` are held back. On the next `request_observation`, if exactly the predicted
+        observation was added, the conditions are at the predicted time, and their filters, bulk
+        cloud and targets of opportunity match the predicted ones, the speculative surveys and queue
+        are adopted. Otherwise the speculation is stopped and thrown away, the held observations are
+        added, and the queue is filled as usual.
+
+        The healpix maps in the conditions (seeing, sky brightness, slewtime, cloud map) are not
+        compared, so an adopted queue is only the same as the serial one if those were predicted
+        exactly (as they are when predicted with the same observatory model).
+
+        Parameters
+        ----------
+        predicted_observation : np.array
+            The observation expected to be completed next (e.g., the last requested observation as
+            the observatory model would complete it).
+        predicted_conditions : lsst.sims.featureScheduler.features.Conditions
+            The conditions expected when the next observation is requested.
+        """
+        self._resolve_speculation(commit=False)
+        # The caller keeps updating its conditions object while the worker runs
+        speculation = _Speculation(predicted_observation, copy.deepcopy(predicted_conditions))
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        speculation.future = self._executor.submit(self._run_speculation, speculation)
+        self._speculation = speculation
+
+    def cancel_speculation(self):
+        """Stop any speculation in progress and add the observations it was holding back.
+        """
+        self._resolve_speculation(commit=False)
+
+    def _run_speculation(self, speculation):
+        """Executed on the worker thread. Returns a scheduler with the next queue ready.
+        """
+        try:
+            # Not copy.copy, that would go through __getstate__
+            spec_sched = Core_scheduler.__new__(Core_scheduler)
+            spec_sched.__dict__.update(self.__dict__)
+            spec_sched.survey_lists = copy.deepcopy(self.survey_lists)
+            spec_sched.queue = self.queue.copy()
+            spec_sched.survey_index = list(self.survey_index)
+            if self.feasibility_calendar is not None:
+                spec_sched.feasibility_calendar = self.feasibility_calendar.copy()
+        finally:
+            speculation.copied.set()
+        spec_sched._speculation = None
+        spec_sched._executor = None
+        spec_sched._cancel = speculation.cancelled
+        try:
+            spec_sched.add_observation(speculation.predicted_observation)
+            spec_sched.update_conditions(speculation.predicted_conditions)
+            spec_sched._prepare_queue(speculation.predicted_conditions.mjd)
+        except _Speculation_cancelled:
+            return None
+        spec_sched._cancel = None
+        return spec_sched
+
+    def _resolve_speculation(self, commit=True, mjd=None):
+        """Finish any speculation in progress, adopting its result if it is still valid.
+
+        Parameters
+        ----------
+        commit : bool (True)
+            If False, the speculative result is thrown away regardless.
+        mjd : float (None)
+            The MJD the next observation is being requested for.
+
+        Returns
+        -------
+        bool : True if the speculative result was adopted.
+        """
+        speculation = self._speculation
+        if speculation is None:
+            return False
+        self._speculation = None
+        speculation.copied.wait()
+
+        valid = commit & (len(speculation.pending) == 1)
+        if valid:
+            if mjd is None:
+                mjd = self.conditions.mjd
+            valid = _observations_match(speculation.predicted_observation, speculation.pending[0],
+                                        self.speculation_tolerance)
+        if valid:
+            valid = np.abs(mjd - speculation.predicted_conditions.mjd) <= self.speculation_tolerance
+        if valid & speculation.conditions_updated:
+            valid = _conditions_match(speculation.predicted_conditions, self.conditions)
+
+        if valid:
+            try:
+                spec_sched = speculation.future.result()
+            except Exception:
+                self.log.exception('Speculative queue fill failed')
+                valid = False
+        else:
+            # Don't leave a stale fill running, it would compete with the serial one
+            speculation.cancel_and_wait()
+
+        if valid:
+            self.survey_lists = spec_sched.survey_lists
+            self.queue = spec_sched.queue
+            self.survey_index = spec_sched.survey_index
+            self.flushed = spec_sched.flushed
+            self.feasibility_calendar = spec_sched.feasibility_calendar
+            self.conditions.queue = self.queue
+            self.speculation_hits += 1
+        else:
+            for observation in speculation.pending:
+                self._add_observation(observation)
+            self.speculation_misses += 1
+        return valid
+
     def flush_queue(self):
         """"
         Like it sounds, clear any currently queued desired observations.
         """
-        self.queue = []
+        self._resolve_speculation(commit=False)
+        self.queue = ObservationBatch()
         self.survey_index = [None, None]
 
     def add_observation(self, observation):
@@ -94,7 +334,14 @@ class Core_scheduler(object):
             An object that contains the relevant information about a
             completed observation (e.g., mjd, ra, dec, filter, rotation angle, etc)
         """
+        if self._speculation is not None:
+            # Hold on to it until we know if the speculation was right
+            self._speculation.copied.wait()
+            self._speculation.pending.append(observation)
+        else:
+            self._add_observation(observation)
 
+    def _add_observation(self, observation):
         # Find the healpixel centers that are included in an observation
         indx = self.pointing2hpindx(observation['RA'], observation['dec'],
                                     rotSkyPos=observation['rotSkyPos'])
@@ -109,10 +356,15 @@ class Core_scheduler(object):
         conditions : dict-like
             The current conditions of the telescope (pointing position, loaded filters, cloud-mask, etc)
         """
+        if self._speculation is not None:
+            self._speculation.conditions_updated = True
         # Add the current queue and scheduled queue to the conditions
         self.conditions = conditions_in
         # put the local queue in the conditions
         self.conditions.queue = self.queue
+        # The conditions may have changed without the mjd changing (e.g., a new filter or cloud
+        # map), so the results surveys memoized for the old conditions can't be used
+        self.conditions.update_id = next(_update_ids)
 
         # XXX---TODO:  Could potentially put more complicated info from all
         # the surveys in the conditions object here. e.g., when a DDF plans to next request
@@ -146,19 +398,12 @@ class Core_scheduler(object):
         """
         if mjd is None:
             mjd = self.conditions.mjd
-        if len(self.queue) == 0:
-            self._fill_queue()
+        self._resolve_speculation(mjd=mjd)
+        self._prepare_queue(mjd)
 
         if len(self.queue) == 0:
             return None
         else:
-            # If the queue has gone stale, flush and refill. Zero means no flush_by was set.
-            if (int_rounded(mjd) > int_rounded(self.queue[0]['flush_by_mjd'])) & (self.queue[0]['flush_by_mjd'] != 0):
-                self.flushed += len(self.queue)
-                self.flush_queue()
-                self._fill_queue()
-            if len(self.queue) == 0:
-                return None
             observation = self.queue.pop(0)
             # If we are limiting the camera rotator
             if self.rotator_limits is not None:
@@ -172,6 +417,20 @@ class Core_scheduler(object):
                     observation['rotSkyPos'] = (obs_pa - self.rotator_limits[limit_indx]) % (2.*np.pi)
             return observation
 
+    def _prepare_queue(self, mjd):
+        """
+        Make sure the queue is filled and not stale at the given MJD.
+        """
+        if len(self.queue) == 0:
+            self._fill_queue()
+
+        if len(self.queue) > 0:
+            # If the queue has gone stale, flush and refill. Zero means no flush_by was set.
+            if (int_rounded(mjd) > int_rounded(self.queue[0]['flush_by_mjd'])) & (self.queue[0]['flush_by_mjd'] != 0):
+                self.flushed += len(self.queue)
+                self.flush_queue()
+                self._fill_queue()
+
     def _fill_queue(self):
         """
         Compute reward function for each survey and fill the observing queue with the
@@ -181,8 +440,25 @@ class Core_scheduler(object):
         rewards = None
         for ns, surveys in enumerate(self.survey_lists):
             rewards = np.zeros(len(surveys))
+            best = -np.inf
             for i, survey in enumerate(surveys):
+                if (self._cancel is not None) and self._cancel.is_set():
+                    raise _Speculation_cancelled()
+                if self.feasibility_calendar is not None:
+                    if not self.feasibility_calendar.could_be_feasible((ns, i), survey, self.conditions):
+                        rewards[i] = -np.inf
+                        continue
+                # Ties go to the earlier survey, so a survey that can at best match
+                # the current best can't be selected
+                if self.prune_surveys & (best > -np.inf) & hasattr(survey, 'upper_bound'):
+                    bound = survey.upper_bound(self.conditions)
+                    if (bound is not None) and (bound <= best):
+                        rewards[i] = -np.inf
+                        self.n_pruned += 1
+                        continue
                 rewards[i] = np.nanmax(survey.calc_reward_function(self.conditions))
+                if rewards[i] > best:
+                    best = rewards[i]
             # If we have a good reward, break out of the loop
             if np.nanmax(rewards) > -np.inf:
                 self.survey_index[0] = ns
@@ -198,7 +474,27 @@ class Core_scheduler(object):
 
             # Survey return list of observations
             result = self.survey_lists[self.survey_index[0]][self.survey_index[1]].generate_observations(self.conditions)
-            self.queue = result
+            # Hold the queue as a single block, popping from the front only moves a cursor
+            self.queue = ObservationBatch.from_list(result)
 
         if len(self.queue) == 0:
             self.log.warning('Failed to fill queue')
+
+    def feasibility_stats(self):
+        """Statistics on the basis function feasibility checks of every survey.
+
+        Returns
+        -------
+        list of dict, one per basis function that has been checked. Has the survey tier and
+        index, survey_name, plus the entries from Feasibility_checker.stats.
+        """
+        result = []
+        for ns, surveys in enumerate(self.survey_lists):
+            for i, survey in enumerate(surveys):
+                if not hasattr(survey, 'feasibility_stats'):
+                    continue
+                for row in survey.feasibility_stats():
+                    row.update({'tier': ns, 'survey_index': i,
+                                'survey_name': getattr(survey, 'survey_name', '')})
+                    result.append(row)
+        return result
@@ -0,0 +1,78 @@
+import numpy as np
+from lsst.sims.featureScheduler.utils import in_intervals
+
+__all__ = ['Feasibility_calendar']
+
+
+class Feasibility_calendar(object):
+    """Keep track of when each survey could be feasible during the current night.
+
+    Surveys (through their basis functions) publish the times they could be feasible. Those are
+    looked up once per night, then each decision only needs an interval check to drop surveys
+    that can't be feasible now, before any reward is computed.
+
+    Parameters
+    ----------
+    margin : float (10.)
+        Pad the published intervals by this much (minutes), so estimates made from almanac
+        interpolations never drop a survey that would have been feasible.
+    """
+    def __init__(self, margin=10.):
+        self.margin = margin/60./24.
+        self.night_key = None
+        # survey key : padded intervals (or None)
+        self.intervals = {}
+        self.n_skipped = 0
+
+    def copy(self):
+        """A copy with its own cache (the interval arrays themselves are shared, they are never modified)
+        """
+        result = Feasibility_calendar()
+        result.__dict__.update(self.__dict__)
+        result.intervals = self.intervals.copy()
+        return result
+
+    def reset(self):
+        """Forget the intervals, e.g., if the surveys have been changed
+        """
+        self.night_key = None
+        self.intervals = {}
+
+    def _night_key(self, conditions):
+        return (conditions.night, conditions.sunset, conditions.sunrise,
+                conditions.moonrise, conditions.moonset)
+
+    def could_be_feasible(self, key, survey, conditions):
+        """
+        Parameters
+        ----------
+        key : hashable
+            Identifies the survey's place in the scheduler, e.g., (tier, index). Intervals are
+            looked up once per key per night.
+        survey : lsst.sims.featureScheduler.surveys object
+        conditions : lsst.sims.featureScheduler.features.Conditions object
+
+        Returns
+        -------
+        bool : False if the survey is certainly infeasible at conditions.mjd
+        """
+        night_key = self._night_key(conditions)
+        if night_key != self.night_key:
+            self.night_key = night_key
+            self.intervals = {}
+        if key not in self.intervals:
+            intervals = None
+            if hasattr(survey, 'feasible_intervals'):
+                intervals = survey.feasible_intervals(conditions)
+            if intervals is not None:
+                intervals = np.array(intervals, dtype=float).reshape(-1, 2)
+                intervals[:, 0] -= self.margin
+                intervals[:, 1] += self.margin
+            self.intervals[key] = intervals
+        intervals = self.intervals[key]
+        if intervals is None:
+            return True
+        result = in_intervals(conditions.mjd, intervals)
+        if not result:
+            self.n_skipped += 1
+        return result
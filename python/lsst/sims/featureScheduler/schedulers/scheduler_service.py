@@ -0,0 +1,409 @@
+import abc
+import asyncio
+import json
+import logging
+import struct
+import numpy as np
+from lsst.sims.featureScheduler.features import Conditions
+from lsst.sims.featureScheduler.utils import TargetoO
+
+__all__ = ['Scheduler_service', 'Scheduler_client', 'In_process_client', 'pack_message', 'unpack_message',
+           'conditions_to_message', 'update_conditions_from_message']
+
+# Each message is a fixed size prefix (length of the JSON header, length of the binary payload),
+# then the JSON header, then the payload. Arrays in the payload are described in the header
+# and are read back with np.frombuffer, so maps are never converted element by element.
+_prefix = struct.Struct('!IQ')
+# Arrays in the payload start on multiples of this many bytes
+_alignment = 8
+
+# Conditions attributes that are sent as JSON
+_condition_scalars = ['night', 'bulk_cloud', 'current_filter', 'mounted_filters', 'lmst',
+                      'moonAlt', 'moonAz', 'moonRA', 'moonDec', 'moonPhase',
+                      'sunAlt', 'sunAz', 'sunRA', 'sunDec',
+                      'sunset', 'sun_n12_setting', 'sun_n18_setting', 'sun_n18_rising',
+                      'sun_n12_rising', 'sunrise', 'moonrise', 'moonset',
+                      'telRA', 'telDec', 'telAlt', 'telAz', 'rotTelPos', 'planet_positions']
+# Conditions attributes that are healpix maps
+_condition_maps = ['slewtime', 'airmass', 'cloud_map']
+# Conditions attributes that are dicts of healpix maps, keyed by filtername
+_condition_map_dicts = ['skybrightness', 'FWHMeff']
+
+
+def _json_default(value):
+    # numpy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('Can not convert %s to JSON' % type(value))
+
+
+def _from_json(value):
+    """Numbers come back as numpy scalars, like they would be set from the observatory model.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return np.int64(value)
+    if isinstance(value, float):
+        return np.float64(value)
+    if isinstance(value, dict):
+        return {key: _from_json(value[key]) for key in value}
+    return value
+
+
+def pack_message(header, arrays=None):
+    """Pack a message for sending.
+
+    Parameters
+    ----------
+    header : dict
+        JSON serializable information. Must have a 'type' key.
+    arrays : dict of np.array (None)
+        Arrays to send in binary, keyed by name.
+
+    Returns
+    -------
+    list of bytes-like objects to be written in order. Array data is not copied.
+    """
+    if arrays is None:
+        arrays = {}
+    descriptions = []
+    buffers = []
+    offset = 0
+    for name in arrays:
+        array = np.ascontiguousarray(arrays[name])
+        descriptions.append([name, np.lib.format.dtype_to_descr(array.dtype), list(array.shape), offset])
+        data = array.reshape(-1).view(np.uint8)
+        buffers.append(memoryview(data))
+        offset += data.size
+        pad = -offset % _alignment
+        if pad > 0:
+            buffers.append(bytes(pad))
+            offset += pad
+    header = dict(header, arrays=descriptions)
+    header_bytes = json.dumps(header, default=_json_default).encode('utf-8')
+    return [_prefix.pack(len(header_bytes), offset), header_bytes] + buffers
+
+
+def unpack_message(header_bytes, payload):
+    """Unpack a received message.
+
+    Parameters
+    ----------
+    header_bytes : bytes
+        The JSON header.
+    payload : bytes-like
+        The binary payload. Arrays are views into it, so pass a bytearray if they need to be writeable.
+
+    Returns
+    -------
+    header : dict
+    arrays : dict of np.array
+    """
+    header = json.loads(header_bytes.decode('utf-8'))
+    arrays = {}
+    for name, descr, shape, offset in header.pop('arrays', []):
+        dtype = np.lib.format.descr_to_dtype(_descr_from_json(descr))
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return header, arrays
+
+
+def _descr_from_json(descr):
+    # JSON turns the tuples of a structured dtype description into lists
+    if isinstance(descr, list):
+        return [tuple(_descr_from_json(item) for item in field) if isinstance(field, list) else field
+                for field in descr]
+    return descr
+
+
+async def read_message(reader):
+    """Read one message from an asyncio.StreamReader. Returns None if the connection closed.
+    """
+    try:
+        prefix = await reader.readexactly(_prefix.size)
+    except asyncio.IncompleteReadError:
+        return None
+    header_size, payload_size = _prefix.unpack(prefix)
+    header_bytes = await reader.readexactly(header_size)
+    payload = bytearray(await reader.readexactly(payload_size))
+    return unpack_message(header_bytes, payload)
+
+
+async def write_message(writer, header, arrays=None):
+    """Write one message to an asyncio.StreamWriter.
+    """
+    writer.writelines(pack_message(header, arrays))
+    await writer.drain()
+
+
+def conditions_to_message(conditions):
+    """Split a Conditions object into JSON-able fields and healpix maps.
+
+    Returns
+    -------
+    fields : dict
+    arrays : dict of np.array
+    """
+    fields = {'mjd': conditions.mjd}
+    arrays = {}
+    for name in _condition_scalars:
+        fields[name] = getattr(conditions, name)
+    for name in _condition_maps:
+        value = getattr(conditions, name)
+        if value is not None:
+            arrays[name] = value
+    for name in _condition_map_dicts:
+        for filtername, value in getattr(conditions, name).items():
+            arrays[name + '/' + filtername] = value
+    if conditions.targets_of_opportunity is not None:
+        toos = []
+        for i, too in enumerate(conditions.targets_of_opportunity):
+            toos.append({'id': too.id, 'mjd_start': too.mjd_start, 'duration': too.duration})
+            arrays['targets_of_opportunity/%i' % i] = too.footprint
+        fields['targets_of_opportunity'] = toos
+    return fields, arrays
+
+
+def update_conditions_from_message(conditions, fields, arrays):
+    """Set the values sent by `conditions_to_message` on a Conditions object.
+    """
+    # mjd first, setting it resets derived values (like lmst)
+    conditions.mjd = _from_json(fields['mjd'])
+    for name in _condition_scalars:
+        setattr(conditions, name, _from_json(fields.get(name)))
+    for name in _condition_maps:
+        if name in arrays:
+            setattr(conditions, name, arrays[name])
+    for name in _condition_map_dicts:
+        indict = {}
+        for key in arrays:
+            if key.startswith(name + '/'):
+                indict[key.split('/', 1)[1]] = arrays[key]
+        setattr(conditions, name, indict)
+    toos = fields.get('targets_of_opportunity')
+    if toos is not None:
+        toos = [TargetoO(too['id'], arrays['targets_of_opportunity/%i' % i], too['mjd_start'], too['duration'])
+                for i, too in enumerate(toos)]
+    conditions.targets_of_opportunity = toos
+    return conditions
+
+
+class Scheduler_service(object):
+    """Serve a Core_scheduler to other processes over a local socket.
+
+    Messages (the 'type' key of the header) are:
+
+    update_conditions
+        The header has 'conditions' (from `conditions_to_message`), healpix maps are sent as binary arrays.
+    request_observation
+        Optional 'mjd' in the header. Replies with the observation as the 'observation' array, or no arrays
+        if the scheduler returned None.
+    add_observation
+        The completed observation as the 'observation' array.
+    flush_queue
+        Clear the scheduler queue.
+    status
+        Replies with queue length and other monitoring info. Answered even while another client's
+        request is being computed.
+
+    Replies have type 'ok' or 'error' (with a 'message'). Any number of clients can be connected, calls
+    that touch the scheduler are run one at a time in the order they arrive.
+
+    Parameters
+    ----------
+    scheduler : lsst.sims.featureScheduler.schedulers.Core_scheduler
+        The scheduler to serve.
+    conditions : lsst.sims.featureScheduler.features.Conditions (None)
+        Conditions object to update with incoming values. Made with the scheduler nside if None.
+    """
+    def __init__(self, scheduler, conditions=None):
+        self.scheduler = scheduler
+        if conditions is None:
+            conditions = Conditions(nside=scheduler.nside)
+        self.conditions = conditions
+        self.log = logging.getLogger("Scheduler_service")
+        self.server = None
+        self.n_clients = 0
+        self.n_messages = 0
+        self._lock = None
+
+    def dispatch(self, header, arrays):
+        """Handle one message, returning the reply header and arrays.
+        """
+        msg_type = header.get('type')
+        if msg_type == 'update_conditions':
+            update_conditions_from_message(self.conditions, header['conditions'], arrays)
+            self.scheduler.update_conditions(self.conditions)
+            return {'type': 'ok'}, None
+        elif msg_type == 'request_observation':
+            mjd = header.get('mjd')
+            observation = self.scheduler.request_observation(mjd=mjd)
+            if observation is None:
+                return {'type': 'ok'}, None
+            return {'type': 'ok'}, {'observation': observation}
+        elif msg_type == 'add_observation':
+            self.scheduler.add_observation(arrays['observation'])
+            return {'type': 'ok'}, None
+        elif msg_type == 'flush_queue':
+            self.scheduler.flush_queue()
+            return {'type': 'ok'}, None
+        elif msg_type == 'status':
+            return self.status(), None
+        raise ValueError('Unknown message type %s' % msg_type)
+
+    def status(self):
+        return {'type': 'ok', 'queue_length': len(self.scheduler.queue),
+                'survey_index': self.scheduler.survey_index, 'flushed': self.scheduler.flushed,
+                'mjd': self.conditions.mjd, 'n_clients': self.n_clients, 'n_messages': self.n_messages}
+
+    async def dispatch_async(self, header, arrays):
+        """Handle a message without blocking the event loop. Replies with an error message on failure.
+        """
+        self.n_messages += 1
+        try:
+            if header.get('type') == 'status':
+                return self.dispatch(header, arrays)
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(None, self.dispatch, header, arrays)
+        except Exception as error:
+            self.log.exception('Failed to handle %s message', header.get('type'))
+            return {'type': 'error', 'message': '%s: %s' % (type(error).__name__, error)}, None
+
+    async def _handle_client(self, reader, writer):
+        self.n_clients += 1
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                reply_header, reply_arrays = await self.dispatch_async(*message)
+                await write_message(writer, reply_header, reply_arrays)
+        finally:
+            self.n_clients -= 1
+            writer.close()
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """Start listening. Uses a unix socket if path is set, otherwise TCP on host, port.
+        Port 0 picks a free port, see self.server.sockets.
+        """
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._handle_client, path=path)
+        else:
+            self.server = await asyncio.start_server(self._handle_client, host, port)
+        self.log.info('Listening on %s', self.server.sockets[0].getsockname())
+        return self.server
+
+    def run(self, path=None, host='127.0.0.1', port=0):
+        """Serve until interrupted.
+        """
+        async def _serve():
+            server = await self.start(path=path, host=host, port=port)
+            async with server:
+                await server.serve_forever()
+        asyncio.run(_serve())
+
+
+class _Base_client(object, metaclass=abc.ABCMeta):
+    """Messages to a Scheduler_service. Subclasses provide how they get there.
+    """
+    @abc.abstractmethod
+    async def _send(self, header, arrays=None):
+        """Send one message and return the (header, arrays) reply.
+        """
+        pass
+
+    async def _call(self, header, arrays=None):
+        reply_header, reply_arrays = await self._send(header, arrays)
+        if reply_header['type'] == 'error':
+            raise RuntimeError(reply_header['message'])
+        return reply_header, reply_arrays
+
+    async def update_conditions(self, conditions):
+        fields, arrays = conditions_to_message(conditions)
+        await self._call({'type': 'update_conditions', 'conditions': fields}, arrays)
+
+    async def request_observation(self, mjd=None):
+        reply_header, reply_arrays = await self._call({'type': 'request_observation', 'mjd': mjd})
+        return reply_arrays.get('observation')
+
+    async def add_observation(self, observation):
+        await self._call({'type': 'add_observation'}, {'observation': observation})
+
+    async def flush_queue(self):
+        await self._call({'type': 'flush_queue'})
+
+    async def status(self):
+        reply_header, reply_arrays = await self._call({'type': 'status'})
+        return reply_header
+
+
+class Scheduler_client(_Base_client):
+    """Connect to a Scheduler_service over a socket. Calls made concurrently (e.g., with
+    asyncio.gather) are sent one at a time.
+
+    Parameters
+    ----------
+    path : str (None)
+        Unix socket path. If None, connects over TCP to host, port.
+    """
+    def __init__(self, path=None, host='127.0.0.1', port=None):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self._lock = None
+
+    async def connect(self):
+        if self.path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def _send(self, header, arrays=None):
+        # Replies come back in order, so one call at a time on the connection
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.writer is None:
+                await self.connect()
+            await write_message(self.writer, header, arrays)
+            message = await read_message(self.reader)
+        if message is None:
+            raise ConnectionError('Scheduler service closed the connection')
+        return message
+
+
+class In_process_client(_Base_client):
+    """Stand-in for Scheduler_client that talks to a Scheduler_service in the same process.
+
+    Messages still go through packing and unpacking, so this exercises the whole protocol
+    without needing a socket.
+    """
+    def __init__(self, service):
+        self.service = service
+
+    @staticmethod
+    def _round_trip(header, arrays):
+        buffers = pack_message(header, arrays)
+        return unpack_message(buffers[1], bytearray(b''.join(buffers[2:])))
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _send(self, header, arrays=None):
+        reply = await self.service.dispatch_async(*self._round_trip(header, arrays))
+        return self._round_trip(*reply)
@@ -1,18 +1,14 @@
 import warnings
 import sys
 import numpy as np
-from lsst.sims.featureScheduler.utils import run_info_table, schema_converter
-from lsst.sims.featureScheduler.schedulers import simple_filter_sched
 import time
-import sqlite3
-import pandas as pd
 
 __all__ = ['sim_runner']
 
 
 def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, survey_length=3.,
                filename=None, delete_past=True, n_visit_limit=None, step_none=15., verbose=True,
-               extra_info=None, event_table=None):
+               extra_info=None, event_table=None, speculate=False):
     """
     run a simulation
 
@@ -24,14 +20,32 @@ def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, su
         The amount of time to advance if the scheduler fails to return a target (minutes).
     extra_info : dict (None)
         If present, dict gets added onto the information from the observatory model.
+        The time to the first decision is added to it.
     event_table : np.array (None)
         Any ToO events that were included in the simulation
+    speculate : bool (False)
+        Run the scheduler in pipelined mode: after each visit, start computing the next queue
+        with Core_scheduler.speculate from the completed observation and the conditions after it.
+        Nothing else runs during a simulated exposure, so this doesn't make simulations faster,
+        it checks that the pipelined mode schedules the same visits as the serial one.
     """
+    from lsst.sims.featureScheduler.utils import run_info_table, schema_converter
+    from lsst.sims.featureScheduler.schedulers import simple_filter_sched
 
     if extra_info is None:
         extra_info = {}
+    else:
+        extra_info = dict(extra_info)
 
     t0 = time.time()
+    # Count from when the observatory started loading if this is its first run, so startup is
+    # included. Clear it, so later runs with the same (or a copied) observatory count from t0.
+    t_start = getattr(observatory, 't_start', None)
+    if t_start is None:
+        t_start = t0
+    else:
+        observatory.t_start = None
+    t_first_decision = None
 
     if filter_scheduler is None:
         filter_scheduler = simple_filter_sched()
@@ -56,6 +70,8 @@ def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, su
         if not scheduler._check_queue_mjd_only(observatory.mjd):
             scheduler.update_conditions(observatory.return_conditions())
         desired_obs = scheduler.request_observation(mjd=observatory.mjd)
+        if t_first_decision is None:
+            t_first_decision = time.time() - t_start
         if desired_obs is None:
             # No observation. Just step into the future and try again.
             warnings.warn('No observation. Step into the future and trying again.')
@@ -64,6 +80,8 @@ def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, su
             nskip += 1
             continue
         completed_obs, new_night = observatory.observe(desired_obs)
+        if speculate & (completed_obs is not None) & (not new_night):
+            scheduler.speculate(completed_obs[0], observatory.return_conditions())
         if completed_obs is not None:
             scheduler.add_observation(completed_obs[0])
             observations.append(completed_obs)
@@ -93,11 +111,20 @@ def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, su
         # XXX--handy place to interupt and debug
         # if len(observations) > 3:
         #    import pdb ; pdb.set_trace()
+    if speculate:
+        # The last visit may still be held back by a speculation
+        scheduler.cancel_speculation()
     runtime = time.time() - t0
     print('Skipped %i observations' % nskip)
     print('Flushed %i observations from queue for being stale' % scheduler.flushed)
     print('Completed %i observations' % len(observations))
+    if speculate:
+        print('Speculative queues used %i times, recomputed %i times' % (scheduler.speculation_hits,
+                                                                          scheduler.speculation_misses))
     print('ran in %i min = %.1f hours' % (runtime/60., runtime/3600.))
+    if t_first_decision is not None:
+        print('time to first decision %.1f s' % t_first_decision)
+        extra_info['time to first decision (s)'] = '%.2f' % t_first_decision
     print('Writing results to ', filename)
     observations = np.array(observations)[:, 0]
     if filename is not None:
@@ -105,6 +132,9 @@ def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, su
         converter = schema_converter()
         converter.obs2opsim(observations, filename=filename, info=info, delete_past=delete_past)
     if event_table is not None:
+        import sqlite3
+        import pandas as pd
+
         df = pd.DataFrame(event_table)
         con = sqlite3.connect(filename)
         df.to_sql('events', con)
@@ -1,12 +1,87 @@
+import copy
+import time
+import warnings
 import numpy as np
 from lsst.sims.featureScheduler.utils import (empty_observation, set_default_nside,
                                               hp_in_lsst_fov, read_fields, hp_in_comcam_fov,
-                                              comcamTessellate)
+                                              comcamTessellate, ObservationBatch, intersect_intervals)
 import healpy as hp
 from lsst.sims.featureScheduler.thomson import xyz2thetaphi, thetaphi2xyz
-from lsst.sims.featureScheduler.detailers import Zero_rot_detailer
+from lsst.sims.featureScheduler.detailers import Zero_rot_detailer, Detailer_chain
 
-__all__ = ['BaseSurvey', 'BaseMarkovDF_survey']
+__all__ = ['BaseSurvey', 'BaseMarkovDF_survey', 'Reward_plan', 'Feasibility_checker']
+
+# Healpixel to field maps for the un-rotated field tessellations, keyed by (camera, nside)
+_hp2fields_cache = {}
+
+
+class Feasibility_checker(object):
+    """Run the feasibility checks of a list of basis functions, quickest to reject first.
+
+    A survey is infeasible as soon as one basis function says so. Every check is timed and its
+    rejections counted, and the checks are periodically re-ordered by mean cost divided by
+    rejection rate, so cheap checks that often fail run first. The checks don't change state,
+    so the order doesn't change the result.
+
+    Parameters
+    ----------
+    basis_functions : list of lsst.sims.featureScheduler.basis_function objects
+    reorder_every : int (50)
+        How many feasibility checks to run between re-orderings. Set to None to keep the
+        given order (statistics are still kept).
+    """
+    def __init__(self, basis_functions, reorder_every=50):
+        self.basis_functions = basis_functions
+        self.n_basis_functions = len(basis_functions)
+        self.reorder_every = reorder_every
+        self.order = list(range(self.n_basis_functions))
+        self.n_calls = np.zeros(self.n_basis_functions, dtype=int)
+        self.n_rejections = np.zeros(self.n_basis_functions, dtype=int)
+        self.total_time = np.zeros(self.n_basis_functions, dtype=float)
+        self.n_checks = 0
+
+    def __call__(self, conditions):
+        """Return the result of the first check that fails, or True if they all pass.
+        """
+        result = True
+        for indx in self.order:
+            t0 = time.perf_counter()
+            result = self.basis_functions[indx].check_feasibility(conditions)
+            self.total_time[indx] += time.perf_counter() - t0
+            self.n_calls[indx] += 1
+            if not result:
+                self.n_rejections[indx] += 1
+                break
+        self.n_checks += 1
+        if (self.reorder_every is not None) and (self.n_checks % self.reorder_every == 0):
+            self.reorder()
+        return result
+
+    def reorder(self):
+        """Sort the checks by expected cost per rejection.
+        """
+        mean_time = self.total_time / np.maximum(self.n_calls, 1)
+        # Smooth the rejection rate so checks that have never failed (or run) still get ranked
+        reject_rate = (self.n_rejections + 1.) / (self.n_calls + 2.)
+        self.order = np.argsort(mean_time / reject_rate, kind='stable').tolist()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        list of dict, one per basis function in the survey's order, with the basis function
+        class name, number of calls and rejections, mean time per call (seconds), and current
+        position in the check order.
+        """
+        rank = np.empty(self.n_basis_functions, dtype=int)
+        rank[self.order] = np.arange(self.n_basis_functions)
+        result = []
+        for i, bf in enumerate(self.basis_functions):
+            result.append({'basis_function': bf.__class__.__name__, 'calls': int(self.n_calls[i]),
+                           'rejections': int(self.n_rejections[i]),
+                           'mean_time': float(self.total_time[i] / max(self.n_calls[i], 1)),
+                           'rank': int(rank[i])})
+        return result
 
 
 class BaseSurvey(object):
@@ -27,6 +102,9 @@ class BaseSurvey(object):
     detailers : list of lsst.sims.featureScheduler.detailers objects
         The detailers to apply to the list of observations.
     """
+    # Attributes that are never modified in place, so clones can share them (see `clone`)
+    clone_shared = ()
+
     def __init__(self, basis_functions, extra_features=None,
                  ignore_obs=None, survey_name='', nside=None, detailers=None):
         if nside is None:
@@ -54,6 +132,8 @@ class BaseSurvey(object):
 
         # Attribute to track if the reward function is up-to-date.
         self.reward_checked = False
+        # Number of observations the survey has added (not ignored)
+        self.n_obs_added = 0
 
         # If there's no detailers, add one to set rotation to near zero
         if detailers is None:
@@ -61,6 +141,17 @@ class BaseSurvey(object):
         else:
             self.detailers = detailers
 
+    @property
+    def detailers(self):
+        return self._detailers
+
+    @detailers.setter
+    def detailers(self, detailers):
+        # Run the detailers as one chain so they share a single pass over the block.
+        # The chain is rebuilt whenever the detailers are set.
+        self._detailers = detailers
+        self._detailer_chain = Detailer_chain(detailers)
+
     def add_observation(self, observation, **kwargs):
         # Check each posible ignore string
         checks = [io not in str(observation['note']) for io in self.ignore_obs]
@@ -73,17 +164,75 @@ class BaseSurvey(object):
             for detailer in self.detailers:
                 detailer.add_observation(observation, **kwargs)
             self.reward_checked = False
+            self.n_obs_added += 1
 
-    def _check_feasibility(self, conditions):
+    def shared_objects(self):
+        """The objects a clone of the survey can share: the attributes named in clone_shared,
+        plus those of the basis functions.
         """
-        Check if the survey is feasable in the current conditions
+        result = [getattr(self, name) for name in self.clone_shared if hasattr(self, name)]
+        for bf in self.basis_functions:
+            if hasattr(bf, 'shared_objects'):
+                result.extend(bf.shared_objects())
+        return result
+
+    def clone(self):
+        """Make an independent copy of the survey that shares its read-only parts.
+
+        Like copy.deepcopy, but large objects that are never modified in place (the field
+        tessellation, footprints, kd-trees) are shared rather than copied. Observation counts and
+        anything else that changes as the survey runs are still copied.
         """
+        memo = {id(obj): obj for obj in self.shared_objects()}
+        return copy.deepcopy(self, memo)
+
+    def _check_bf_feasibility(self, conditions):
+        """Run the basis function feasibility checks, see Feasibility_checker
+        """
+        checker = getattr(self, '_feasibility_checker', None)
+        # Start over if the basis functions have been swapped or added to
+        if (checker is None) or (checker.basis_functions is not self.basis_functions) or \
+           (checker.n_basis_functions != len(self.basis_functions)):
+            checker = Feasibility_checker(self.basis_functions)
+            self._feasibility_checker = checker
+        return checker(conditions)
+
+    def _bf_feasible_intervals(self, conditions):
+        """Intersect the feasible intervals of the basis functions that publish them
+        """
+        result = np.array([[-np.inf, np.inf]])
         for bf in self.basis_functions:
-            result = bf.check_feasibility(conditions)
-            if not result:
-                return result
+            intervals = bf.feasible_intervals(conditions) if hasattr(bf, 'feasible_intervals') else None
+            if intervals is not None:
+                result = intersect_intervals(result, intervals)
         return result
 
+    def feasible_intervals(self, conditions):
+        """The times during the current night the survey could be feasible (a superset is fine).
+
+        Only surveys whose reward is -inf whenever a basis function check fails, and that can skip
+        calc_reward_function without changing their state, should return intervals.
+
+        Returns
+        -------
+        (N, 2) np.array of [start, end] MJD intervals, or None if not known ahead of time.
+        """
+        return None
+
+    def feasibility_stats(self):
+        """Per basis function feasibility check statistics (see Feasibility_checker.stats)
+        """
+        checker = getattr(self, '_feasibility_checker', None)
+        if checker is None:
+            return []
+        return checker.stats()
+
+    def _check_feasibility(self, conditions):
+        """
+        Check if the survey is feasable in the current conditions
+        """
+        return self._check_bf_feasibility(conditions)
+
     def calc_reward_function(self, conditions):
         """
         Parameters
@@ -104,6 +253,19 @@ class BaseSurvey(object):
         self.reward_checked = True
         return self.reward
 
+    def upper_bound(self, conditions):
+        """A cheap upper bound on np.nanmax(self.calc_reward_function(conditions)).
+
+        Used by Core_scheduler to skip surveys that can't have the highest reward. Computing the
+        bound must not change any state that later rewards depend on, since calc_reward_function
+        may then not be called.
+
+        Returns
+        -------
+        float, or None if there is no cheap bound.
+        """
+        return None
+
     def generate_observations_rough(self, conditions):
         """
         Returns
@@ -111,6 +273,7 @@ class BaseSurvey(object):
         one of:
             1) None
             2) A list of observations
+            3) An ObservationBatch
         """
         # If the reward function hasn't been updated with the
         # latest info, calculate it
@@ -120,10 +283,8 @@ class BaseSurvey(object):
         return [obs]
 
     def generate_observations(self, conditions):
-        observations = self.generate_observations_rough(conditions)
-        for detailer in self.detailers:
-            observations = detailer(observations, conditions)
-        return observations
+        observations = ObservationBatch.from_list(self.generate_observations_rough(conditions))
+        return self._detailer_chain(observations, conditions)
 
     def viz_config(self):
         # XXX--zomg, we should have a method that goes through all the objects and
@@ -141,6 +302,90 @@ def rotx(theta, x, y, z):
     return xp, yp, zp
 
 
+class Reward_plan(object):
+    """Sum weighted basis function values into a reusable reward map.
+
+    The plain loop `reward += basis_value*weight` makes a new full-sky array for every basis
+    function. Here each term is sorted by what it can contribute:
+
+    * scalar values before the first map are folded into a single constant
+    * maps with a weight of zero can only add a NaN (0*NaN and 0*inf are both NaN), so they are
+      reduced to a boolean mask of their non-finite pixels
+    * other maps are weighted and summed into a preallocated buffer
+
+    The terms are still added in the same order, so the result matches the plain loop exactly.
+
+    Parameters
+    ----------
+    npix : int
+        The number of pixels in the reward maps.
+    """
+    def __init__(self, npix):
+        self.buffer = np.empty(npix, dtype=float)
+        self.temp = np.empty(npix, dtype=float)
+        self.valid = np.empty(npix, dtype=bool)
+        self.temp_valid = np.empty(npix, dtype=bool)
+
+    def __call__(self, basis_functions, basis_weights, conditions, indx=None, values=None):
+        """
+        Parameters
+        ----------
+        basis_functions : list of lsst.sims.featureScheduler.basis_function objects
+        basis_weights : list of float
+        conditions : lsst.sims.featureScheduler.features.Conditions object
+        indx : np.array (None)
+            Passed to the basis functions.
+        values : list (None)
+            The values of the basis functions, if they have already been evaluated.
+
+        Returns
+        -------
+        reward : float or np.array
+            A scalar if none of the basis functions returned a map. Otherwise the plan's buffer,
+            which is overwritten by the next call.
+        """
+        reward = self.buffer
+        constant = 0
+        have_map = False
+        have_mask = False
+        for i, (bf, weight) in enumerate(zip(basis_functions, basis_weights)):
+            # The value may be cached by the basis function, so never modify it in place
+            if values is None:
+                basis_value = bf(conditions, indx=indx)
+            else:
+                basis_value = values[i]
+            if np.size(basis_value) == 1:
+                if have_map:
+                    reward += basis_value*weight
+                else:
+                    constant += basis_value*weight
+            elif weight == 0:
+                if have_mask:
+                    np.isfinite(basis_value, out=self.temp_valid)
+                    np.logical_and(self.valid, self.temp_valid, out=self.valid)
+                else:
+                    np.isfinite(basis_value, out=self.valid)
+                    have_mask = True
+            elif have_map:
+                np.multiply(basis_value, weight, out=self.temp)
+                np.add(reward, self.temp, out=reward)
+            else:
+                np.multiply(basis_value, weight, out=reward)
+                reward += constant
+                have_map = True
+
+        if not (have_map | have_mask):
+            return constant
+        if not have_map:
+            reward[:] = constant
+        if have_mask:
+            # 0/1 = 0 on valid pixels, 0/0 = NaN on masked ones. Faster than reward[~valid] = np.nan
+            with np.errstate(invalid='ignore', divide='ignore'):
+                np.divide(0., self.valid, out=self.temp)
+            np.add(reward, self.temp, out=reward)
+        return reward
+
+
 class BaseMarkovDF_survey(BaseSurvey):
     """ A Markov Decision Function survey object. Uses Basis functions to compute a
     final reward function and decide what to observe based on the reward. Includes
@@ -157,6 +402,9 @@ class BaseMarkovDF_survey(BaseSurvey):
     camera : str ('LSST')
         Should be 'LSST' or 'comcam'
     """
+    # fields is modified in place when the tessellation is spun, hp2fields is only ever replaced
+    clone_shared = ('fields_init', 'hp2fields')
+
     def __init__(self, basis_functions, basis_weights, extra_features=None,
                  smoothing_kernel=None,
                  ignore_obs=None, survey_name='', nside=None, seed=42,
@@ -168,6 +416,7 @@ class BaseMarkovDF_survey(BaseSurvey):
                                                   nside=nside, detailers=detailers)
 
         self.basis_weights = basis_weights
+        self.reward_plan = Reward_plan(hp.nside2npix(self.nside))
         # Check that weights and basis functions are same length
         if len(basis_functions) != np.size(basis_weights):
             raise ValueError('basis_functions and basis_weights must be same length.')
@@ -181,8 +430,12 @@ class BaseMarkovDF_survey(BaseSurvey):
         else:
             ValueError('camera %s unknown, should be "LSST" or "comcam"' %camera)
         self.fields = self.fields_init.copy()
-        self.hp2fields = np.array([])
-        self._hp2fieldsetup(self.fields['RA'], self.fields['dec'])
+        # Every survey starts from the same tessellation, so only map it to healpixels once
+        key = (self.camera, self.nside)
+        if key not in _hp2fields_cache:
+            self._hp2fieldsetup(self.fields['RA'], self.fields['dec'])
+            _hp2fields_cache[key] = self.hp2fields
+        self.hp2fields = _hp2fields_cache[key]
 
         if smoothing_kernel is not None:
             self.smoothing_kernel = np.radians(smoothing_kernel)
@@ -192,6 +445,10 @@ class BaseMarkovDF_survey(BaseSurvey):
         # Start tracking the night
         self.night = -1
 
+        # Feasibility and basis function values shared within one decision, see _decision_memo
+        self._memo_key = None
+        self._memo = {}
+
         # Set the seed
         np.random.seed(seed)
         self.dither = dither
@@ -254,31 +511,77 @@ class BaseMarkovDF_survey(BaseSurvey):
         # XXX-may be doing some ra,dec to conversions xyz more than needed.
         self._hp2fieldsetup(ra, dec)
 
+    def _smooth(self, reward):
+        """Return a smoothed copy of a reward map, keeping the NaN mask.
+        """
+        # Need to swap NaNs to hp.UNSEEN so smoothing doesn't spread mask
+        reward_temp = reward + 0
+        mask = np.isnan(reward_temp)
+        reward_temp[mask] = hp.UNSEEN
+        reward_smooth = hp.sphtfunc.smoothing(reward_temp,
+                                              fwhm=self.smoothing_kernel,
+                                              verbose=False)
+        reward_smooth[mask] = np.nan
+        return reward_smooth
+
     def smooth_reward(self):
         """If we want to smooth the reward function.
         """
         if hp.isnpixok(self.reward.size):
-            # Need to swap NaNs to hp.UNSEEN so smoothing doesn't spread mask
-            reward_temp = self.reward + 0
-            mask = np.isnan(reward_temp)
-            reward_temp[mask] = hp.UNSEEN
-            self.reward_smooth = hp.sphtfunc.smoothing(reward_temp,
-                                                       fwhm=self.smoothing_kernel,
-                                                       verbose=False)
-            self.reward_smooth[mask] = np.nan
+            self.reward_smooth = self._smooth(self.reward)
             self.reward = self.reward_smooth
             #good = ~np.isnan(self.reward_smooth)
             # Round off to prevent strange behavior early on
             #self.reward_smooth[good] = np.round(self.reward_smooth[good], decimals=4)
 
+    def _decision_memo(self, conditions):
+        """Results shared by upper_bound and the calc_reward_function call after it, so neither
+        evaluates a basis function or runs the feasibility checks a second time.
+
+        Keyed on the conditions object, its update_id (new every time Core_scheduler.update_conditions
+        is called), its mjd, and the number of observations added. calc_reward_function empties it.
+        """
+        key = (id(conditions), getattr(conditions, 'update_id', None), conditions.mjd, self.n_obs_added)
+        if key != self._memo_key:
+            self._memo_key = key
+            self._memo = {}
+        return self._memo
+
+    def _clear_decision_memo(self):
+        self._memo_key = None
+        self._memo = {}
+
+    def _feasible(self, conditions):
+        """_check_feasibility, run at most once per decision
+        """
+        memo = self._decision_memo(conditions)
+        if 'feasible' not in memo:
+            memo['feasible'] = self._check_feasibility(conditions)
+        return memo['feasible']
+
+    def _basis_value(self, conditions, i):
+        """The value of basis function i, evaluated at most once per decision
+        """
+        memo = self._decision_memo(conditions)
+        if 'values' not in memo:
+            memo['values'] = [None]*len(self.basis_functions)
+        if memo['values'][i] is None:
+            indx = np.arange(hp.nside2npix(self.nside))
+            memo['values'][i] = self.basis_functions[i](conditions, indx=indx)
+        return memo['values'][i]
+
+    def _basis_values(self, conditions):
+        return [self._basis_value(conditions, i) for i in range(len(self.basis_functions))]
+
     def calc_reward_function(self, conditions):
         self.reward_checked = True
-        if self._check_feasibility(conditions):
-            self.reward = 0
-            indx = np.arange(hp.nside2npix(self.nside))
-            for bf, weight in zip(self.basis_functions, self.basis_weights):
-                basis_value = bf(conditions, indx=indx)
-                self.reward += basis_value*weight
+        feasible = self._feasible(conditions)
+        if feasible:
+            values = self._basis_values(conditions)
+        self._clear_decision_memo()
+        if feasible:
+            self.reward = self.reward_plan(self.basis_functions, self.basis_weights, conditions,
+                                           values=values)
 
             if np.any(np.isinf(self.reward)):
                 self.reward = np.inf
@@ -291,6 +594,147 @@ class BaseMarkovDF_survey(BaseSurvey):
 
         return self.reward
 
+    def feasible_intervals(self, conditions):
+        return self._bf_feasible_intervals(conditions)
+
+    def _fold_upper_bound(self, conditions):
+        """Add up the largest value of each weighted basis function.
+
+        Basis functions with a max_value (or min_value, for negative weights) give their bound
+        without being evaluated. The others are evaluated, and the values are kept for
+        calc_reward_function. Terms with zero weight can't raise the reward (they can only make
+        pixels NaN), so they are skipped.
+
+        The terms are added in the same order Reward_plan adds them. Floating point multiplication
+        and addition are monotonic, so the result is >= every pixel of the summed reward.
+
+        Returns
+        -------
+        bound : float
+            NaN if there's no bound (e.g., a basis function map is all NaN).
+        has_inf : bool
+            True if any weighted basis function map has an infinite value.
+        """
+        bound = 0
+        has_inf = False
+        memo = self._decision_memo(conditions)
+        with warnings.catch_warnings():
+            # All-NaN maps give a NaN bound, no need to warn about it
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for i, (bf, weight) in enumerate(zip(self.basis_functions, self.basis_weights)):
+                if weight == 0:
+                    continue
+                evaluated = ('values' in memo) and (memo['values'][i] is not None)
+                if not evaluated:
+                    if weight > 0:
+                        extreme = bf.max_value(conditions) if hasattr(bf, 'max_value') else None
+                    else:
+                        extreme = bf.min_value(conditions) if hasattr(bf, 'min_value') else None
+                    if extreme is not None:
+                        has_inf = has_inf | np.isinf(extreme)
+                        bound = bound + extreme*weight
+                        continue
+                basis_value = self._basis_value(conditions, i)
+                if np.size(basis_value) == 1:
+                    bound = bound + basis_value*weight
+                else:
+                    low = np.nanmin(basis_value)
+                    high = np.nanmax(basis_value)
+                    has_inf = has_inf | np.isinf(low) | np.isinf(high)
+                    if weight > 0:
+                        bound = bound + high*weight
+                    else:
+                        bound = bound + low*weight
+        return float(np.squeeze(bound)), has_inf
+
+    def upper_bound(self, conditions):
+        """Bound the reward by the sum of the weighted basis function maxima.
+        """
+        # Smoothing can push values above the unsmoothed maximum
+        if self.smoothing_kernel is not None:
+            return None
+        if not self._feasible(conditions):
+            return -np.inf
+        bound, has_inf = self._fold_upper_bound(conditions)
+        # calc_reward_function turns any infinite pixel into a reward of np.inf
+        if has_inf | np.isinf(bound):
+            return np.inf
+        if np.isnan(bound):
+            return None
+        return bound
+
+    def basis_function_stack(self, conditions):
+        """Evaluate each basis function once and stack the results.
+
+        Returns
+        -------
+        np.array with shape (n_basis_functions, npix). Scalar basis function values are
+        repeated across the row.
+        """
+        indx = np.arange(hp.nside2npix(self.nside))
+        stack = np.empty((len(self.basis_functions), indx.size), dtype=float)
+        for i, bf in enumerate(self.basis_functions):
+            stack[i, :] = bf(conditions, indx=indx)
+        return stack
+
+    def calc_reward_multi(self, conditions, weights):
+        """Compute the reward for several sets of basis function weights at once.
+
+        Handy for weight tuning and sensitivity studies: the basis functions are evaluated once,
+        and all the reward maps come from a single matrix product. Does not change the survey state.
+
+        Parameters
+        ----------
+        conditions : lsst.sims.featureScheduler.features.Conditions object
+        weights : np.array
+            Array with shape (K, n_basis_functions), one set of weights per row.
+
+        Returns
+        -------
+        rewards : np.array
+            (K, npix) reward maps, each the same as calc_reward_function would give with that row of
+            weights (a reward that would be np.inf is a row of np.inf, an infeasible survey is all -np.inf).
+        max_hpids : np.array
+            (K,) healpix id of the peak of each reward map (lowest id on ties), -1 if the map has no
+            finite peak.
+        max_fields : np.array
+            (K,) index of the field in self.fields that the peak falls in, -1 if no peak.
+        """
+        weights = np.atleast_2d(np.asarray(weights, dtype=float))
+        if weights.shape[1] != len(self.basis_functions):
+            raise ValueError('weights must have shape (K, %i)' % len(self.basis_functions))
+        npix = hp.nside2npix(self.nside)
+        n_sets = weights.shape[0]
+        max_hpids = np.zeros(n_sets, dtype=int) - 1
+        max_fields = np.zeros(n_sets, dtype=int) - 1
+
+        if not self._check_feasibility(conditions):
+            return np.zeros((n_sets, npix)) - np.inf, max_hpids, max_fields
+
+        stack = self.basis_function_stack(conditions)
+        finite = np.isfinite(stack)
+        bad_pix = np.where(~np.all(finite, axis=0))[0]
+        if np.size(bad_pix) > 0:
+            rewards = np.dot(weights, np.where(finite, stack, 0.))
+            # Pixels with a NaN or inf in any basis function get the element-by-element sum,
+            # so they come out NaN/inf just like the sum in calc_reward_function
+            rewards[:, bad_pix] = np.sum(weights[:, :, np.newaxis] * stack[np.newaxis, :, bad_pix], axis=1)
+        else:
+            rewards = np.dot(weights, stack)
+
+        has_inf = np.any(np.isinf(rewards), axis=1)
+        rewards[has_inf, :] = np.inf
+        for i in range(n_sets):
+            if has_inf[i]:
+                continue
+            if self.smoothing_kernel is not None:
+                rewards[i, :] = self._smooth(rewards[i, :])
+            if np.any(np.isfinite(rewards[i, :])):
+                max_hpids[i] = np.nanargmax(rewards[i, :])
+                max_fields[i] = self.hp2fields[max_hpids[i]]
+
+        return rewards, max_hpids, max_fields
+
     def generate_observations_rough(self, conditions):
 
         self.reward = self.calc_reward_function(conditions)
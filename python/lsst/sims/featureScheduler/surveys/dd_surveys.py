@@ -2,7 +2,7 @@ import numpy as np
 from lsst.sims.featureScheduler.surveys import BaseSurvey
 import copy
 import lsst.sims.featureScheduler.basis_functions as basis_functions
-from lsst.sims.featureScheduler.utils import empty_observation
+from lsst.sims.featureScheduler.utils import empty_observation, ObservationBatch
 from lsst.sims.featureScheduler import features
 import logging
 import random
@@ -114,6 +114,15 @@ class Deep_drilling_survey(BaseSurvey):
                 result = self.extra_features['Ntot'].feature / (self.extra_features['N_survey'].feature+1)
         return result
 
+    def feasible_intervals(self, conditions):
+        return self._bf_feasible_intervals(conditions)
+
+    def upper_bound(self, conditions):
+        # The reward is either this or -inf
+        if self.reward_value is not None:
+            return self.reward_value
+        return self.extra_features['Ntot'].feature / (self.extra_features['N_survey'].feature+1)
+
     def generate_observations_rough(self, conditions):
         result = []
         if self._check_feasibility(conditions):
@@ -130,9 +139,7 @@ class Deep_drilling_survey(BaseSurvey):
             ind2 = np.where(result['filter'] != conditions.current_filter)[0]
             result = result[ind1.tolist() + (ind2.tolist())]
 
-            # convert to list of array. Arglebargle, don't understand why I need a reshape there
-            final_result = [row.reshape(1,) for row in result]
-            result = final_result
+            result = ObservationBatch(result)
 
         return result
 
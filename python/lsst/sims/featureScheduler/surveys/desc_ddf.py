@@ -87,11 +87,7 @@ class DESC_ddf(BaseSurvey):
             return False
 
         # The usual basis function checks
-        for bf in self.basis_functions:
-            result = bf.check_feasibility(conditions)
-            if not result:
-                return result
-        return result
+        return self._check_bf_feasibility(conditions)
 
     def calc_reward_function(self, conditions):
         result = -np.inf
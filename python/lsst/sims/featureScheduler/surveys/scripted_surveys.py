@@ -66,6 +66,10 @@ class Scripted_survey(BaseSurvey):
             self.reward = self.reward_val
         return self.reward
 
+    def upper_bound(self, conditions):
+        # The reward is either this or -inf
+        return self.reward_val
+
     def _slice2obs(self, obs_row):
         """take a slice and return a full observation object
         """
@@ -267,6 +271,10 @@ class Pairs_survey_scripted(Scripted_survey):
         else:
             return False
 
+    def upper_bound(self, conditions):
+        # calc_reward_function purges the queue, so it has to be called every time
+        return None
+
     def calc_reward_function(self, conditions):
         self._purge_queue(conditions)
         result = -np.inf
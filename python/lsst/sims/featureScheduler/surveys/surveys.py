@@ -1,12 +1,12 @@
 import numpy as np
-from lsst.sims.featureScheduler.utils import (empty_observation, set_default_nside)
+from lsst.sims.featureScheduler.utils import (empty_observation, set_default_nside, ObservationBatch)
 import healpy as hp
-import matplotlib.pylab as plt
 from lsst.sims.featureScheduler.surveys import BaseMarkovDF_survey
 from lsst.sims.featureScheduler.utils import (int_binned_stat, int_rounded,
-                                              gnomonic_project_toxy, tsp_convex)
+                                              gnomonic_project_toxy, tsp_convex, neighbor_disks)
 import copy
-from lsst.sims.utils import _angularSeparation, _hpid2RaDec, _approx_RaDec2AltAz, hp_grow_argsort
+import warnings
+from lsst.sims.utils import _hpid2RaDec, _approx_RaDec2AltAz, hp_grow_argsort
 
 __all__ = ['Greedy_survey', 'Blob_survey']
 
@@ -55,8 +55,9 @@ class Greedy_survey(BaseMarkovDF_survey):
         while True:
             best_hp = order[iter*self.block_size:(iter+1)*self.block_size]
             best_fields = np.unique(self.hp2fields[best_hp])
-            observations = []
-            for field in best_fields:
+            observations = ObservationBatch()
+            if np.size(best_fields) > 0:
+                field = best_fields[0]
                 obs = empty_observation()
                 obs['RA'] = self.fields['RA'][field]
                 obs['dec'] = self.fields['dec'][field]
@@ -66,9 +67,7 @@ class Greedy_survey(BaseMarkovDF_survey):
                 obs['exptime'] = self.exptime
                 obs['field_id'] = -1
                 obs['note'] = self.survey_name
-
-                observations.append(obs)
-                break
+                observations = ObservationBatch(obs)
             iter += 1
             if len(observations) > 0 or (iter+2)*self.block_size > len(order):
                 break
@@ -108,6 +107,8 @@ class Blob_survey(Greedy_survey):
     min_area : float (None)
         If set, demand the reward function have an area of so many square degrees before executing
     """
+    clone_shared = BaseMarkovDF_survey.clone_shared + ('hpids', 'ra', 'dec')
+
     def __init__(self, basis_functions, basis_weights,
                  filtername1='r', filtername2='g',
                  slew_approx=7.5, filter_change_approx=140.,
@@ -169,26 +170,63 @@ class Blob_survey(Greedy_survey):
         if (self.filtername2 is None) | (self.filtername1 == self.filtername2):
             self.filtername = self.filtername1
 
+        # Pixels within search_radius of each pixel, looked up when first needed
+        self._neighbor_disks = None
+
+        # The (conditions, update_id, mjd, n_obs_added) state the memoized raw reward was computed for
+        self._raw_reward_key = None
+        self._raw_reward = None
+
+    def _calc_raw_reward(self, conditions):
+        """The weighted sum of the basis functions, before any cuts.
+
+        Memoized so the min_area feasibility check and calc_reward_function only compute it once
+        per decision. The result may be the survey's reward buffer, callers that modify it must
+        clear self._raw_reward_key.
+        """
+        key = (id(conditions), getattr(conditions, 'update_id', None), conditions.mjd, self.n_obs_added)
+        if key != self._raw_reward_key:
+            self._raw_reward = self.reward_plan(self.basis_functions, self.basis_weights, conditions,
+                                                values=self._basis_values(conditions))
+            self._raw_reward_key = key
+        return self._raw_reward
+
     def _check_feasibility(self, conditions):
         """
         Check if the survey is feasable in the current conditions.
         """
-        for bf in self.basis_functions:
-            result = bf.check_feasibility(conditions)
-            if not result:
-                return result
+        result = self._check_bf_feasibility(conditions)
+        if not result:
+            return result
 
         # If we need to check that the reward function has enough area available
         if self.min_area is not None:
-            reward = 0
-            for bf, weight in zip(self.basis_functions, self.basis_weights):
-                basis_value = bf(conditions)
-                reward += basis_value*weight
-            valid_pix = np.where(np.isnan(reward) == False)[0]
-            if np.size(valid_pix)*self.pixarea < self.min_area:
+            reward = self._calc_raw_reward(conditions)
+            n_valid = np.count_nonzero(~np.isnan(reward))
+            if n_valid*self.pixarea < self.min_area:
                 result = False
         return result
 
+    def upper_bound(self, conditions):
+        """Bound the reward by the sum of the weighted basis function maxima. The altitude,
+        radius, and azimuth cuts only mask pixels, so they can only lower the maximum.
+        """
+        if self.smoothing_kernel is not None:
+            return None
+        if not self._feasible(conditions):
+            return -np.inf
+        if self.min_area is not None:
+            # The feasibility check already summed the reward, its peak is the tightest bound
+            with warnings.catch_warnings():
+                # An all-NaN reward gives a NaN bound
+                warnings.simplefilter('ignore', RuntimeWarning)
+                bound = np.nanmax(self._calc_raw_reward(conditions))
+        else:
+            bound, has_inf = self._fold_upper_bound(conditions)
+        if np.isnan(bound):
+            return None
+        return bound
+
     def _set_block_size(self, conditions):
         """
         Update the block size if it's getting near the end of the night.
@@ -222,13 +260,14 @@ class Blob_survey(Greedy_survey):
         # Set the number of observations we are going to try and take
         self._set_block_size(conditions)
         #  Computing reward like usual with basis functions and weights
-        if self._check_feasibility(conditions):
-            self.reward = 0
-            indx = np.arange(hp.nside2npix(self.nside))
-            for bf, weight in zip(self.basis_functions, self.basis_weights):
-                basis_value = bf(conditions, indx=indx)
-                self.reward += basis_value*weight
-                # might be faster to pull this out into the feasabiliity check?
+        feasible = self._feasible(conditions)
+        if feasible:
+            raw_reward = self._calc_raw_reward(conditions)
+        self._clear_decision_memo()
+        if feasible:
+            self.reward = raw_reward
+            # The cuts below modify the reward in place, so the memo can't be reused
+            self._raw_reward_key = None
             if self.smoothing_kernel is not None:
                 self.smooth_reward()
 
@@ -246,18 +285,21 @@ class Blob_survey(Greedy_survey):
                 # Everything is masked, so get out
                 return -np.inf
 
-            # Apply radius selection
-            dists = _angularSeparation(self.ra[peak_reward], self.dec[peak_reward], self.ra, self.dec)
-            out_hp = np.where(int_rounded(dists) > int_rounded(self.search_radius))
-            self.reward[out_hp] = np.nan
+            # Apply radius selection, only pixels in the disk around the peak are kept
+            if self._neighbor_disks is None:
+                self._neighbor_disks = neighbor_disks(nside=self.nside, radius=self.search_radius)
+            disk = self._neighbor_disks[peak_reward]
 
-            # Apply az cut
-            az_centered = conditions.az - conditions.az[peak_reward]
+            # Apply az cut, only needs to be checked inside the disk
+            az_centered = conditions.az[disk] - conditions.az[peak_reward]
             az_centered[np.where(az_centered < 0)] += 2.*np.pi
 
-            az_out = np.where((int_rounded(az_centered) > int_rounded(self.az_range/2.)) &
-                              (int_rounded(az_centered) < int_rounded(2.*np.pi-self.az_range/2.)))
-            self.reward[az_out] = np.nan
+            az_out = ((int_rounded(az_centered) > int_rounded(self.az_range/2.)) &
+                      (int_rounded(az_centered) < int_rounded(2.*np.pi-self.az_range/2.)))
+            keep = disk[~az_out]
+            kept_reward = self.reward[keep]
+            self.reward.fill(np.nan)
+            self.reward[keep] = kept_reward
         else:
             self.reward = -np.inf
         self.reward_checked = True
@@ -315,7 +357,7 @@ class Blob_survey(Greedy_survey):
 
         if len(self.best_fields) == 0:
             # everything was nans, or self.nvisit_block was zero
-            return []
+            return ObservationBatch()
 
         # Let's find the alt, az coords of the points (right now, hopefully doesn't change much in time block)
         pointing_alt, pointing_az = _approx_RaDec2AltAz(self.fields['RA'][self.best_fields],
@@ -352,30 +394,26 @@ class Blob_survey(Greedy_survey):
         # Leaving optimize=False for speed. The optimization step doesn't usually improve much.
         better_order = tsp_convex(towns, optimize=False)
         # XXX-TODO: Could try to roll better_order to start at the nearest/fastest slew from current position.
-        observations = []
-        counter2 = 0
         approx_end_time = np.size(better_order)*(self.slew_approx + self.exptime +
                                                  self.read_approx*(self.nexp - 1))
         flush_time = conditions.mjd + approx_end_time/3600./24. + self.flush_time
-        for i, indx in enumerate(better_order):
-            field = self.best_fields[indx]
-            obs = empty_observation()
-            obs['RA'] = self.fields['RA'][field]
-            obs['dec'] = self.fields['dec'][field]
-            obs['rotSkyPos'] = 0.
-            obs['filter'] = self.filtername1
-            obs['nexp'] = self.nexp
-            obs['exptime'] = self.exptime
-            obs['field_id'] = -1
-            obs['note'] = '%s' % (self.survey_note)
-            obs['block_id'] = self.counter
-            obs['flush_by_mjd'] = flush_time
-            # Add the mjd for debugging
-            # obs['mjd'] = conditions.mjd
-            # XXX temp debugging line
-            obs['survey_id'] = i
-            observations.append(obs)
-            counter2 += 1
-
-        result = observations
+        # Fill the whole block at once, one column at a time
+        fields = self.best_fields[better_order]
+        observations = empty_observation(n=np.size(fields))
+        observations['RA'] = self.fields['RA'][fields]
+        observations['dec'] = self.fields['dec'][fields]
+        observations['rotSkyPos'] = 0.
+        observations['filter'] = self.filtername1
+        observations['nexp'] = self.nexp
+        observations['exptime'] = self.exptime
+        observations['field_id'] = -1
+        observations['note'] = '%s' % (self.survey_note)
+        observations['block_id'] = self.counter
+        observations['flush_by_mjd'] = flush_time
+        # Add the mjd for debugging
+        # observations['mjd'] = conditions.mjd
+        # XXX temp debugging line
+        observations['survey_id'] = np.arange(np.size(fields))
+
+        result = ObservationBatch(observations)
         return result
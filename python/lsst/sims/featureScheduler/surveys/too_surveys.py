@@ -1,7 +1,6 @@
 import numpy as np
 from lsst.sims.featureScheduler.surveys import Blob_survey, BaseSurvey
 import healpy as hp
-import copy
 
 
 __all__ = ['ToO_master', 'ToO_survey']
@@ -36,7 +35,8 @@ class ToO_master(BaseSurvey):
         ----------
         too : lsst.sims.featureScheduler.utils.TargetoO object
         """
-        new_survey = copy.deepcopy(self.example_ToO_survey)
+        # Copies only the per-ToO state, the tessellation and maps are shared with the example
+        new_survey = self.example_ToO_survey.clone()
         new_survey.set_id(too.id)
         new_survey.set_target_map(too.footprint)
 
@@ -123,6 +123,8 @@ class ToO_survey(Blob_survey):
         for basis_func in self.basis_functions:
             if hasattr(basis_func, 'footprint'):
                 basis_func.footprint = newmap
+        # The basis functions changed without an observation being added
+        self._raw_reward_key = None
 
     def generate_observations_rough(self, conditions):
         # Always spin the tesselation before generating a new block.
@@ -1,11 +1,16 @@
 import numpy as np
 
+# Tessellations already made, keyed by (side_length, overlap)
+_tessellation_cache = {}
+
 
 def comcamTessellate(side_length=0.7, overlap=0.11):
     """Tesselate the sphere with a square footprint
 
     XXX--TODO:  This really sucks at the poles, should add some different pole cap behavior.
 
+    Each tessellation is only computed once, later calls return a copy.
+
     Parameters
     ----------
     side_length : float (0.7)
@@ -18,7 +23,13 @@ def comcamTessellate(side_length=0.7, overlap=0.11):
     fields : numpy array
        With 'RA' and 'dec' keys that have the field positions in radians
     """
+    key = (float(side_length), float(overlap))
+    if key not in _tessellation_cache:
+        _tessellation_cache[key] = _comcamTessellate(side_length=side_length, overlap=overlap)
+    return _tessellation_cache[key].copy()
+
 
+def _comcamTessellate(side_length=0.7, overlap=0.11):
     # Convert to radians for all internal work
     side_length = np.radians(side_length)
     overlap = np.radians(overlap)
@@ -9,10 +9,12 @@ the healpix points across the sky, along with their corresponding RA/Dec/Galacti
 """
 
 import os
+import hashlib
+import inspect
+import functools
+import tempfile
 import numpy as np
 import healpy as hp
-from astropy.coordinates import SkyCoord
-from astropy import units as u
 from .utils import set_default_nside, int_rounded
 from lsst.sims.utils import _hpid2RaDec, _angularSeparation
 from lsst.sims.utils import Site
@@ -24,7 +26,94 @@ __all__ = ['ra_dec_hp_map', 'generate_all_sky', 'get_dustmap',
            'galactic_plane_healpixels', #'low_lat_plane_healpixels', 'bulge_healpixels',
            'magellanic_clouds_healpixels',
            'generate_goal_map', 'standard_goals',
-           'calc_norm_factor', 'filter_count_ratios']
+           'calc_norm_factor', 'filter_count_ratios', 'set_footprint_cache_dir', 'footprint_cache_dir']
+
+# Bump this when a cached footprint function changes what it returns, so old maps are not reused.
+_FOOTPRINT_CACHE_VERSION = 1
+# Off unless asked for
+_footprint_cache_dir = os.environ.get('SIMS_FEATURESCHEDULER_CACHE')
+
+
+def set_footprint_cache_dir(directory):
+    """Set where generated footprint maps are cached.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to save maps in. Set to None to turn off the cache. Defaults to the
+        SIMS_FEATURESCHEDULER_CACHE environment variable, and is off if that isn't set.
+    """
+    global _footprint_cache_dir
+    _footprint_cache_dir = directory
+
+
+def footprint_cache_dir():
+    """Return the directory generated footprint maps are cached in (None if caching is off).
+    """
+    if not _footprint_cache_dir:
+        return None
+    return _footprint_cache_dir
+
+
+def _disk_cached(func=None, data_files=None):
+    """Cache the healpix map a footprint function returns on disk, if footprint_cache_dir is set.
+
+    Maps are saved as .npy files named by a hash of the function name and all its arguments
+    (defaults included), and loaded back as regular arrays. Calls that don't return a single
+    array, or that fail to read or write the cache, just compute the map.
+
+    Parameters
+    ----------
+    data_files : callable (None)
+        For functions that read data files. Takes the dict of arguments and returns the paths
+        of the files read. Their paths and modification times are part of the hash, so a
+        changed file isn't hidden by the cache.
+    """
+    if func is None:
+        return functools.partial(_disk_cached, data_files=data_files)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if footprint_cache_dir() is None:
+            return func(*args, **kwargs)
+        directory = os.path.join(footprint_cache_dir(), 'footprints')
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if ('nside' in bound.arguments) and (bound.arguments['nside'] is None):
+            bound.arguments['nside'] = set_default_nside()
+        key = [_FOOTPRINT_CACHE_VERSION, func.__name__, sorted(bound.arguments.items())]
+        if data_files is not None:
+            try:
+                key.append([(path, os.path.getmtime(path)) for path in data_files(bound.arguments)])
+            except (IOError, OSError):
+                # Let the function report the missing file
+                return func(*bound.args, **bound.kwargs)
+        key = repr(key)
+        filename = os.path.join(directory, '%s_%s.npy' % (func.__name__,
+                                                          hashlib.sha1(key.encode()).hexdigest()))
+        try:
+            return np.load(filename)
+        except (IOError, OSError, ValueError):
+            pass
+
+        result = func(*bound.args, **bound.kwargs)
+        if isinstance(result, np.ndarray):
+            try:
+                os.makedirs(directory, exist_ok=True)
+                # Write then rename, so other processes never load a partial file
+                handle, temp_name = tempfile.mkstemp(dir=directory, suffix='.npy')
+                try:
+                    with os.fdopen(handle, 'wb') as outfile:
+                        np.save(outfile, result)
+                    os.replace(temp_name, filename)
+                finally:
+                    if os.path.exists(temp_name):
+                        os.remove(temp_name)
+            except (IOError, OSError):
+                pass
+        return result
+    return wrapper
 
 
 def ra_dec_hp_map(nside=None):
@@ -37,12 +126,14 @@ def ra_dec_hp_map(nside=None):
     return ra, dec
 
 
+def _dustmap_file(nside):
+    return os.path.join(getPackageDir('sims_maps'), 'DustMaps/dust_nside_%i.npz' % nside)
+
+
 def get_dustmap(nside=None):
     if nside is None:
         nside = set_default_nside()
-    ebvDataDir = getPackageDir('sims_maps')
-    filename = 'DustMaps/dust_nside_%i.npz' % nside
-    dustmap = np.load(os.path.join(ebvDataDir, filename))['ebvMap']
+    dustmap = np.load(_dustmap_file(nside))['ebvMap']
     return dustmap
 
 
@@ -75,6 +166,9 @@ def generate_all_sky(nside=None, elevation_limit=20, mask=hp.UNSEEN):
     if nside is None:
         nside = set_default_nside()
 
+    from astropy.coordinates import SkyCoord
+    from astropy import units as u
+
     # Calculate coordinates of everything.
     skymap = np.zeros(hp.nside2npix(nside), float)
     ra, dec = ra_dec_hp_map(nside=nside)
@@ -125,6 +219,7 @@ def WFD_healpixels(nside=None, dec_min=-62.5, dec_max=3.6):
     return result
 
 
+@_disk_cached
 def WFD_no_gp_healpixels(nside, dec_min=-62.5, dec_max=3.6,
                          center_width=10., end_width=4., gal_long1=290., gal_long2=70.):
     """
@@ -166,6 +261,7 @@ def WFD_bigsky_healpixels(nside):
     return sky
 
 
+@_disk_cached(data_files=lambda arguments: [_dustmap_file(arguments['nside'])])
 def WFD_no_dust_healpixels(nside, dec_min=-72.25, dec_max=12.4, dust_limit=0.19):
     """Define a WFD region with a dust extinction limit.
 
@@ -217,6 +313,7 @@ def SCP_healpixels(nside=None, dec_max=-60.):
     return result
 
 
+@_disk_cached
 def NES_healpixels(nside=None, min_EB=-30.0, max_EB = 10.0, dec_min=2.8):
     """
     Define the North Ecliptic Spur region. Return a healpix map with NES pixels as 1.
@@ -239,6 +336,9 @@ def NES_healpixels(nside=None, min_EB=-30.0, max_EB = 10.0, dec_min=2.8):
     if nside is None:
         nside = set_default_nside()
 
+    from astropy.coordinates import SkyCoord
+    from astropy import units as u
+
     ra, dec = ra_dec_hp_map(nside=nside)
     result = np.zeros(ra.size, float)
     coord = SkyCoord(ra=ra*u.rad, dec=dec*u.rad)
@@ -253,6 +353,7 @@ def NES_healpixels(nside=None, min_EB=-30.0, max_EB = 10.0, dec_min=2.8):
     return result
 
 
+@_disk_cached
 def galactic_plane_healpixels(nside=None, center_width=10., end_width=4.,
                               gal_long1=290., gal_long2=70.):
     """
@@ -280,6 +381,9 @@ def galactic_plane_healpixels(nside=None, center_width=10., end_width=4.,
     """
     if nside is None:
         nside = set_default_nside()
+    from astropy.coordinates import SkyCoord
+    from astropy import units as u
+
     ra, dec = ra_dec_hp_map(nside=nside)
 
     coord = SkyCoord(ra=ra*u.rad, dec=dec*u.rad)
@@ -306,6 +410,7 @@ def galactic_plane_healpixels(nside=None, center_width=10., end_width=4.,
     return sky
 
 
+@_disk_cached
 def magellanic_clouds_healpixels(nside=None, lmc_radius=10, smc_radius=5):
     """
     Define the Galactic Plane region. Return a healpix map with GP pixels as 1.
@@ -333,6 +438,7 @@ def magellanic_clouds_healpixels(nside=None, lmc_radius=10, smc_radius=5):
     return result
 
 
+@_disk_cached
 def generate_goal_map(nside=None, NES_fraction = .3, WFD_fraction = 1.,
                       SCP_fraction=0.4, GP_fraction = 0.2,
                       NES_min_EB = -30., NES_max_EB = 10, NES_dec_min = 3.6,
@@ -1,15 +1,12 @@
 import os
-import sqlite3 as db
 import datetime
 import socket
 import numpy as np
 import healpy as hp
-import pandas as pd
-import matplotlib.path as mplPath
 import logging
-from lsst.sims.utils import _hpid2RaDec, xyz_angular_radius, _buildTree, _xyz_from_ra_dec
+from lsst.sims.utils import (_hpid2RaDec, xyz_angular_radius, _buildTree, _xyz_from_ra_dec,
+                             _angularSeparation)
 from lsst.sims.featureScheduler import version
-from lsst.sims.survey.fields import FieldsDatabase
 
 log = logging.getLogger(__name__)
 
@@ -256,6 +253,9 @@ class schema_converter(object):
     def obs2opsim(self, obs_array, filename=None, info=None, delete_past=False):
         """convert an array of observations into a pandas dataframe with Opsim schema
         """
+        import sqlite3 as db
+        import pandas as pd
+
         if delete_past:
             try:
                 os.remove(filename)
@@ -279,6 +279,8 @@ class schema_converter(object):
     def opsim2obs(self, filename):
         """convert an opsim schema dataframe into an observation array.
         """
+        import sqlite3 as db
+        import pandas as pd
 
         con = db.connect(filename)
         df = pd.read_sql('select * from SummaryAllProps;', con)
@@ -299,7 +301,27 @@ class schema_converter(object):
         return final_result
 
 
-def empty_observation():
+_observation_names = ['ID', 'RA', 'dec', 'mjd', 'flush_by_mjd', 'exptime', 'filter', 'rotSkyPos', 'nexp',
+                      'airmass', 'FWHM_500', 'FWHMeff', 'FWHM_geometric', 'skybrightness', 'night',
+                      'slewtime', 'visittime', 'slewdist', 'fivesigmadepth',
+                      'alt', 'az', 'pa', 'clouds', 'moonAlt', 'sunAlt', 'note',
+                      'field_id', 'survey_id', 'block_id',
+                      'lmst', 'rotTelPos', 'moonAz', 'sunAz', 'sunRA', 'sunDec', 'moonRA', 'moonDec',
+                      'moonDist', 'solarElong', 'moonPhase']
+
+_observation_types = [int, float, float, float, float, float, 'U1', float, int,
+                      float, float, float, float, float, int,
+                      float, float, float, float,
+                      float, float, float, float, float, float, 'U40',
+                      int, int, int,
+                      float, float, float, float, float, float, float, float,
+                      float, float, float]
+
+# Build the dtype once, rather than on every call to empty_observation
+_observation_dtype = np.dtype(list(zip(_observation_names, _observation_types)))
+
+
+def empty_observation(n=1):
     """
     Return a numpy array that could be a handy observation record
 
@@ -313,6 +335,12 @@ def empty_observation():
     XXX--might be nice to add a generic "sched_note" str field, to record any metadata that
     would be useful to the scheduler once it's observed. and/or observationID.
 
+    Parameters
+    ----------
+    n : int (1)
+        The number of observation records to allocate. Use n > 1 to fill a whole
+        block of observations with column assignments rather than one record at a time.
+
     Returns
     -------
     numpy array
@@ -346,26 +374,100 @@ def empty_observation():
     flush_by_mjd : float
         If we hit this MJD, we should flush the queue and refill it.
     """
-
-    names = ['ID', 'RA', 'dec', 'mjd', 'flush_by_mjd', 'exptime', 'filter', 'rotSkyPos', 'nexp',
-             'airmass', 'FWHM_500', 'FWHMeff', 'FWHM_geometric', 'skybrightness', 'night',
-             'slewtime', 'visittime', 'slewdist', 'fivesigmadepth',
-             'alt', 'az', 'pa', 'clouds', 'moonAlt', 'sunAlt', 'note',
-             'field_id', 'survey_id', 'block_id',
-             'lmst', 'rotTelPos', 'moonAz', 'sunAz', 'sunRA', 'sunDec', 'moonRA', 'moonDec',
-             'moonDist', 'solarElong', 'moonPhase']
-
-    types = [int, float, float, float, float, float, 'U1', float, int,
-             float, float, float, float, float, int,
-             float, float, float, float,
-             float, float, float, float, float, float, 'U40',
-             int, int, int,
-             float, float, float, float, float, float, float, float,
-             float, float, float]
-    result = np.zeros(1, dtype=list(zip(names, types)))
+    result = np.zeros(n, dtype=_observation_dtype)
     return result
 
 
+class ObservationBatch(object):
+    """A block of observations stored as a single structured array.
+
+    Surveys return blocks of observations, detailers modify them, and the
+    Core_scheduler queue hands them out one at a time. Keeping the block as one
+    array (rather than a list of 1-element arrays) lets detailers work on whole
+    columns at once, and a cursor makes popping from the front O(1).
+
+    Indexing with an int returns a 1-element view of that observation, so code
+    written for lists of observations (``obs['RA']``, ``batch[0]['flush_by_mjd']``)
+    keeps working and writes go through to the batch.
+
+    Parameters
+    ----------
+    observations : np.array (None)
+        Structured array of observations (e.g., from empty_observation(n)).
+        An empty batch is made if None.
+    """
+    def __init__(self, observations=None):
+        if observations is None:
+            observations = empty_observation(n=0)
+        self.observations = observations
+        self.cursor = 0
+
+    @classmethod
+    def from_list(cls, observation_list):
+        """Make a batch from a list of observation arrays (or return the batch if already one).
+        Entries that are None are dropped.
+        """
+        if isinstance(observation_list, cls):
+            return observation_list
+        if observation_list is None:
+            return cls()
+        if isinstance(observation_list, np.ndarray):
+            return cls(observation_list.reshape(-1))
+        observation_list = [obs for obs in observation_list if obs is not None]
+        if len(observation_list) == 0:
+            return cls()
+        return cls(np.concatenate(observation_list))
+
+    @property
+    def array(self):
+        """The observations that have not been popped yet (a view, not a copy)
+        """
+        return self.observations[self.cursor:]
+
+    def __len__(self):
+        return self.observations.size - self.cursor
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return ObservationBatch(self.array[key])
+        if key < 0:
+            key += len(self)
+        if (key < 0) | (key >= len(self)):
+            raise IndexError('ObservationBatch index out of range')
+        indx = self.cursor + key
+        return self.observations[indx:indx+1]
+
+    def __iter__(self):
+        for indx in range(self.cursor, self.observations.size):
+            yield self.observations[indx:indx+1]
+
+    def __add__(self, other):
+        return ObservationBatch(np.concatenate([self.array, ObservationBatch.from_list(other).array]))
+
+    def __radd__(self, other):
+        return ObservationBatch(np.concatenate([ObservationBatch.from_list(other).array, self.array]))
+
+    def pop(self, index=0):
+        """Remove and return an observation. Popping from the front only moves the cursor.
+        """
+        observation = self[index]
+        if index == 0:
+            self.cursor += 1
+        else:
+            observation = observation.copy()
+            self.observations = np.delete(self.array, index)
+            self.cursor = 0
+        return observation
+
+    def copy(self):
+        return ObservationBatch(self.array.copy())
+
+    def to_list(self):
+        """Return a list of 1-element observation arrays
+        """
+        return list(self)
+
+
 def obs_to_fbsobs(obs):
     """
     converts an Observation from the Driver (which is a normal python class)
@@ -414,14 +516,28 @@ def empty_scheduled_observation():
     return result
 
 
+# The field tessellation, read from the database the first time read_fields is called
+_fields_cache = {}
+
+
 def read_fields():
     """
-    Read in the Field coordinates
+    Read in the Field coordinates. The database is only queried the first time, later calls
+    return a copy.
+
     Returns
     -------
     numpy.array
         With RA and dec in radians.
     """
+    if 'fields' not in _fields_cache:
+        _fields_cache['fields'] = _read_fields()
+    return _fields_cache['fields'].copy()
+
+
+def _read_fields():
+    from lsst.sims.survey.fields import FieldsDatabase
+
     query = 'select fieldId, fieldRA, fieldDEC from Field;'
     fd = FieldsDatabase()
     fields = np.array(list(fd.get_field_set(query)))
@@ -437,10 +553,17 @@ def read_fields():
     return result
 
 
+# KD-trees already built, keyed by (nside, leafsize, scale)
+_kd_tree_cache = {}
+
+
 def hp_kd_tree(nside=None, leafsize=100, scale=1e5):
     """
     Generate a KD-tree of healpixel locations
 
+    Trees are built once per set of parameters and shared, so treat the result as read-only.
+    Trees built before forking worker processes are shared with the workers.
+
     Parameters
     ----------
     nside : int
@@ -455,9 +578,88 @@ def hp_kd_tree(nside=None, leafsize=100, scale=1e5):
     if nside is None:
         nside = set_default_nside()
 
-    hpid = np.arange(hp.nside2npix(nside))
-    ra, dec = _hpid2RaDec(nside, hpid)
-    return _buildTree(ra, dec, leafsize, scale=scale)
+    key = (nside, leafsize, float(scale))
+    if key not in _kd_tree_cache:
+        hpid = np.arange(hp.nside2npix(nside))
+        ra, dec = _hpid2RaDec(nside, hpid)
+        _kd_tree_cache[key] = _buildTree(ra, dec, leafsize, scale=scale)
+    return _kd_tree_cache[key]
+
+
+# Neighbor disks already built, keyed by (nside, radius)
+_neighbor_disk_cache = {}
+
+
+def neighbor_disks(nside=None, radius=np.radians(30.)):
+    """Return the hp_neighbor_disks for nside and radius, building them only the first time.
+
+    Parameters
+    ----------
+    nside : int (None)
+        A valid healpix nside
+    radius : float (0.524)
+        Radius of the disks (radians)
+    """
+    if nside is None:
+        nside = set_default_nside()
+    key = (nside, float(radius))
+    if key not in _neighbor_disk_cache:
+        _neighbor_disk_cache[key] = hp_neighbor_disks(nside=nside, radius=radius)
+    return _neighbor_disk_cache[key]
+
+
+class hp_neighbor_disks(object):
+    """The healpixels within a radius of every healpixel, stored in compressed sparse row (CSR) form.
+
+    The pixels near hpid are indices[indptr[hpid]:indptr[hpid+1]]. A pixel is included if
+    int_rounded of its angular separation is <= int_rounded(radius), the same cut a search
+    against the full map would make. Use `neighbor_disks` to share one copy per nside and radius.
+    Copies of this object share the arrays, since they are never modified.
+
+    Parameters
+    ----------
+    nside : int (None)
+        A valid healpix nside
+    radius : float (0.524)
+        Radius of the disks (radians)
+    """
+    def __init__(self, nside=None, radius=np.radians(30.)):
+        if nside is None:
+            nside = set_default_nside()
+        self.nside = nside
+        self.radius = radius
+
+        npix = hp.nside2npix(nside)
+        ra, dec = _hpid2RaDec(nside, np.arange(npix))
+        vecs = hp.ang2vec(np.pi/2. - dec, ra)
+        # Pad the healpy search so no pixel that passes the rounded cut is missed
+        search_radius = radius + hp.max_pixrad(nside)
+        radius_rounded = int_rounded(radius)
+        if npix <= np.iinfo(np.uint16).max + 1:
+            dtype = np.uint16
+        else:
+            dtype = np.int32
+
+        disks = []
+        for hpid in range(npix):
+            candidates = hp.query_disc(nside, vecs[hpid], search_radius)
+            dists = _angularSeparation(ra[hpid], dec[hpid], ra[candidates], dec[candidates])
+            disks.append(np.sort(candidates[int_rounded(dists) <= radius_rounded]).astype(dtype))
+        self.indptr = np.zeros(npix + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([disk.size for disk in disks])
+        self.indices = np.concatenate(disks)
+
+    def __getitem__(self, hpid):
+        """The healpixels within radius of hpid
+        """
+        return self.indices[self.indptr[hpid]:self.indptr[hpid+1]]
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # Pickle as a lookup, so unpickling uses (or fills) the cache instead of storing the arrays
+        return (neighbor_disks, (self.nside, self.radius))
 
 
 class hp_in_lsst_fov(object):
@@ -502,6 +704,10 @@ class hp_in_lsst_fov(object):
         indices = self.tree.query_ball_point((x, y, z), self.radius)
         return np.array(indices)
 
+    def __deepcopy__(self, memo):
+        # Read-only, so copies can share the kd-tree
+        return self
+
 
 class hp_in_comcam_fov(object):
     """
@@ -556,6 +762,7 @@ class hp_in_comcam_fov(object):
         y_rotated = self.corners_x*sin_rot + self.corners_y*cos_rot
 
         # Draw the square that we want to check if points are in.
+        import matplotlib.path as mplPath
         bbPath = mplPath.Path(np.array([[x_rotated[0], y_rotated[0]],
                                        [x_rotated[1], y_rotated[1]],
                                        [x_rotated[2], y_rotated[2]],
@@ -573,6 +780,10 @@ class hp_in_comcam_fov(object):
 
         return np.array(indices)
 
+    def __deepcopy__(self, memo):
+        # Read-only, so copies can share the kd-tree
+        return self
+
 
 def run_info_table(observatory, extra_info=None):
     """
@@ -642,6 +853,36 @@ def warm_start(scheduler, observations, mjd_key='mjd'):
     return scheduler
 
 
+def intersect_intervals(intervals1, intervals2):
+    """Intersect two sets of intervals.
+
+    Parameters
+    ----------
+    intervals1 : np.array
+        (N, 2) array of [start, end] intervals.
+    intervals2 : np.array
+        (M, 2) array of [start, end] intervals.
+
+    Returns
+    -------
+    (K, 2) np.array of the intervals covered by both, sorted by start
+    """
+    intervals1 = np.asarray(intervals1, dtype=float).reshape(-1, 2)
+    intervals2 = np.asarray(intervals2, dtype=float).reshape(-1, 2)
+    starts = np.maximum.outer(intervals1[:, 0], intervals2[:, 0]).ravel()
+    ends = np.minimum.outer(intervals1[:, 1], intervals2[:, 1]).ravel()
+    good = np.where(starts <= ends)[0]
+    result = np.array([starts[good], ends[good]]).T.reshape(-1, 2)
+    return result[np.argsort(result[:, 0], kind='stable')]
+
+
+def in_intervals(value, intervals):
+    """Check if value is inside any of the (N, 2) [start, end] intervals (inclusive)
+    """
+    intervals = np.asarray(intervals).reshape(-1, 2)
+    return bool(np.any((intervals[:, 0] <= value) & (value <= intervals[:, 1])))
+
+
 def season_calc(night, offset=0, modulo=None, max_season=None, season_length=365.25, floor=True):
     """
     Compute what season a night is in with possible offset and modulo
@@ -684,6 +925,84 @@ def season_calc(night, offset=0, modulo=None, max_season=None, season_length=365
     return result
 
 
+class Season_map(object):
+    """The season of every healpixel on one night, see `season_map`.
+
+    Treat the arrays as read-only, they are shared by everything that asked for the same map.
+
+    Parameters
+    ----------
+    night : float
+        The night the seasons are for.
+    seasons : np.array
+        The result of season_calc for the night.
+    """
+    def __init__(self, night, seasons):
+        self.night = night
+        self.seasons = seasons
+        self._groups = {}
+
+    def groups(self, indx=None):
+        """Group pixels by season.
+
+        Parameters
+        ----------
+        indx : np.array (None)
+            Only group these pixels. The grouping is kept for as long as this Season_map is used,
+            so pass the same array each time.
+
+        Returns
+        -------
+        list of (season, positions) pairs, one per season present, in increasing season order.
+        positions index into indx (or the full map if indx is None).
+        """
+        key = None if indx is None else id(indx)
+        if key not in self._groups:
+            seasons = self.seasons if indx is None else self.seasons[indx]
+            unique_seasons, inverse = np.unique(seasons, return_inverse=True)
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.cumsum(np.bincount(inverse, minlength=unique_seasons.size))[:-1]
+            self._groups[key] = (indx, list(zip(unique_seasons, np.split(order, bounds))))
+        return self._groups[key][1]
+
+
+# The current Season_map for each set of season_calc arguments. Entries hold a reference to
+# their offset, so the cache is cleared if it grows past _season_map_cache_size.
+_season_map_cache = {}
+_season_map_cache_size = 128
+
+
+def season_map(night, offset=0, modulo=None, max_season=None, season_length=365.25):
+    """Return the season of every healpixel on a night, computing it once per night.
+
+    Many basis functions and features need the same season map (usually with the offset from
+    create_season_offset). Season assignments only change from one night to the next, so the
+    map is computed once when the night changes and shared.
+
+    Parameters are the same as season_calc (with floor=True). Maps are kept per offset object,
+    so pass the same offset array each time.
+
+    Returns
+    -------
+    Season_map
+    """
+    night_value = float(np.ravel(night)[0])
+    if np.size(offset) == 1:
+        offset_key = ('scalar', float(np.ravel(offset)[0]))
+    else:
+        offset_key = id(offset)
+    key = (offset_key, modulo, max_season, season_length)
+    entry = _season_map_cache.get(key)
+    if (entry is None) or (entry[0] is not offset) or (entry[1].night != night_value):
+        seasons = season_calc(night, offset=offset, modulo=modulo, max_season=max_season,
+                              season_length=season_length)
+        entry = (offset, Season_map(night_value, seasons))
+        if len(_season_map_cache) >= _season_map_cache_size:
+            _season_map_cache.clear()
+        _season_map_cache[key] = entry
+    return entry[1]
+
+
 def create_season_offset(nside, sun_RA_rad):
     """
     Make an offset map so seasons roll properly
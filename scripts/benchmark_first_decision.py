@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import argparse
+import runpy
+import time
+
+from lsst.sims.featureScheduler.modelObservatory import Model_observatory
+
+
+def time_first_decision(config, background_load=True):
+    """Time how long it takes to go from nothing loaded to the scheduler's first decision.
+
+    Parameters
+    ----------
+    config : str
+        Python file that makes a Core_scheduler named `scheduler`.
+    background_load : bool (True)
+        Passed to Model_observatory.
+
+    Returns
+    -------
+    dict of elapsed times (seconds) at each stage of startup
+    """
+    t0 = time.time()
+    observatory = Model_observatory(background_load=background_load)
+    t_observatory = time.time()
+    scheduler = runpy.run_path(config)['scheduler']
+    t_scheduler = time.time()
+    scheduler.update_conditions(observatory.return_conditions())
+    t_conditions = time.time()
+    scheduler.request_observation()
+    t_decision = time.time()
+
+    return {'observatory init': t_observatory - t0, 'scheduler config': t_scheduler - t_observatory,
+            'first conditions': t_conditions - t_scheduler, 'first request': t_decision - t_conditions,
+            'time to first decision': t_decision - t0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the startup of a simulation up to its first decision")
+    parser.add_argument("config", type=str, help="python file that defines a Core_scheduler called scheduler")
+    parser.add_argument("--serial", dest='serial', action='store_true',
+                        help="load all the observatory models before making the scheduler")
+    parser.set_defaults(serial=False)
+    args = parser.parse_args()
+
+    times = time_first_decision(args.config, background_load=not args.serial)
+    for key in times:
+        print('%25s: %.2f s' % (key, times[key]))
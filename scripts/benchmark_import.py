@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import argparse
+import subprocess
+import sys
+import numpy as np
+
+# Run in a fresh interpreter so nothing is already imported
+timing_code = """
+import time
+t0 = time.perf_counter()
+import %s
+print(time.perf_counter() - t0)
+"""
+
+
+def time_import(module, n_runs=5):
+    """Time importing module in fresh python processes.
+
+    Returns
+    -------
+    np.array of import times (seconds), one per run
+    """
+    times = []
+    for i in range(n_runs):
+        output = subprocess.check_output([sys.executable, '-c', timing_code % module])
+        times.append(float(output.decode().split()[-1]))
+    return np.array(times)
+
+
+def slowest_imports(module, n_top=15):
+    """Use python -X importtime to find the modules that take longest to import.
+
+    Returns
+    -------
+    list of (cumulative seconds, module name), slowest first
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True)
+    rows = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us)/1e6, name.rstrip()))
+    rows.sort(reverse=True)
+    return rows[0:n_top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time how long importing the scheduler takes")
+    parser.add_argument("--module", type=str, default='lsst.sims.featureScheduler',
+                        help="module to import (default lsst.sims.featureScheduler)")
+    parser.add_argument("--n_runs", type=int, default=5)
+    parser.add_argument("--profile", dest='profile', action='store_true',
+                        help="also list the slowest imports")
+    parser.set_defaults(profile=False)
+    args = parser.parse_args()
+
+    times = time_import(args.module, n_runs=args.n_runs)
+    print('import %s: median %.3f s, min %.3f s, max %.3f s (%i runs)' % (args.module, np.median(times),
+                                                                        times.min(), times.max(), times.size))
+    if args.profile:
+        for cumulative, name in slowest_imports(args.module):
+            print('%8.3f s  %s' % (cumulative, name))
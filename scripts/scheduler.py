@@ -1,30 +1,34 @@
 #!/usr/bin/env python
 
+import argparse
 import logging
-import sys
+import runpy
 
-from lsst.ts.scheduler import Main
-from lsst.ts.scheduler.setup import configure_logging, create_parser, generate_logfile
-from lsst.sims.featureScheduler.driver import FeatureSchedulerDriver
+from lsst.sims.featureScheduler.schedulers import Scheduler_service
 
-def main(args):
-    logfilename = generate_logfile()
-    configure_logging(args, logfilename, args.log_port)
 
+def main(args):
+    logging.basicConfig(level=args.log_level)
     logger = logging.getLogger("scheduler")
-    logger.info("logfile=%s" % logfilename)
 
-    scheduler = Main(args, FeatureSchedulerDriver())
-    scheduler.sal_init()
-    with open('.scheduler_{}'.format(args.log_port), 'w'):
-        pass
-    scheduler.run()
+    # The config file is a python script that makes a Core_scheduler named `scheduler`
+    config = runpy.run_path(args.config)
+    if 'scheduler' not in config:
+        raise ValueError('config file %s does not define a scheduler' % args.config)
+    logger.info("Serving scheduler from %s" % args.config)
 
-    sys.exit(0)
+    service = Scheduler_service(config['scheduler'])
+    service.run(path=args.socket, host=args.host, port=args.port)
 
 
 if __name__ == '__main__':
-    parser = create_parser()
+    parser = argparse.ArgumentParser(description="Serve a feature based scheduler over a local socket")
+    parser.add_argument("config", type=str, help="python file that defines a Core_scheduler called scheduler")
+    parser.add_argument("--socket", type=str, default=None, help="unix socket path (default is TCP)")
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=5599)
+    parser.add_argument("--log_level", type=str, default='INFO')
+    parser.add_argument("--profile", action='store_true', help="run with cProfile")
     args = parser.parse_args()
 
     if args.profile:
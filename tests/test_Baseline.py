@@ -10,6 +10,12 @@ import healpy as hp
 from lsst.sims.featureScheduler import sim_runner
 from lsst.sims.featureScheduler.modelObservatory import Model_observatory
 import lsst.sims.featureScheduler.detailers as detailers
+from lsst.sims.featureScheduler import ensemble_runner, load_shared_data
+from lsst.sims.featureScheduler.Training import Sim_snapshot
+import os
+import sqlite3
+import shutil
+import tempfile
 
 
 def gen_greedy_surveys(nside):
@@ -98,6 +104,13 @@ def gen_blob_surveys(nside):
     return pair_surveys
 
 
+def ensemble_scheduler(shared):
+    """
+    Scheduler for the ensemble test. Module level, so workers can unpickle it
+    """
+    return Core_scheduler(gen_greedy_surveys(shared['nside']), nside=shared['nside'])
+
+
 class TestFeatures(unittest.TestCase):
 
     def testGreedy(self):
@@ -131,6 +144,8 @@ class TestFeatures(unittest.TestCase):
         assert(observations.size > 1000)
         # Make sure nothing tried to look through the earth
         assert(np.min(observations['alt']) > 0)
+        # The observatory start time is only used for the first run
+        assert(observatory.t_start is None)
 
     def testBlobs(self):
         """
@@ -169,6 +184,94 @@ class TestFeatures(unittest.TestCase):
         # Make sure nothing tried to look through the earth
         assert(np.min(observations['alt']) > 0)
 
+    def testSpeculate(self):
+        """
+        Run the same short simulation serially and pipelined, they should take the same visits
+        """
+        nside = 32
+        survey_length = 0.2  # days
+
+        results = []
+        for speculate in [False, True]:
+            scheduler = Core_scheduler(gen_greedy_surveys(nside), nside=nside)
+            observatory = Model_observatory(nside=nside)
+            observatory, scheduler, observations = sim_runner(observatory, scheduler,
+                                                              survey_length=survey_length,
+                                                              filename=None, speculate=speculate)
+            results.append(observations)
+        assert(scheduler.speculation_hits > 0)
+        assert(results[0].size == results[1].size)
+        assert(np.all(results[0]['RA'] == results[1]['RA']))
+        assert(np.all(results[0]['filter'] == results[1]['filter']))
+
+    def testSnapshot(self):
+        """
+        Evaluating from a snapshot gives the same score in a forked child and on a copy,
+        and leaves the snapshot as it was
+        """
+        nside = 32
+        scheduler = Core_scheduler(gen_greedy_surveys(nside), nside=nside)
+        observatory = Model_observatory(nside=nside)
+        observatory, scheduler, observations = sim_runner(observatory, scheduler, survey_length=0.1,
+                                                          filename=None, verbose=False)
+        snapshot = Sim_snapshot(observatory, scheduler)
+        mjd = snapshot.observatory.mjd
+        n_obs_added = [survey.n_obs_added for survey in snapshot.scheduler.survey_lists[0]]
+
+        def score(observatory, scheduler):
+            observatory, scheduler, observations = sim_runner(observatory, scheduler, survey_length=0.1,
+                                                              filename=None, verbose=False)
+            return observations['mjd']
+
+        forked = snapshot.evaluate(score, fork=True)
+        copied = snapshot.evaluate(score, fork=False)
+        assert(np.size(forked) > 0)
+        assert(np.array_equal(forked, copied))
+        # The sky model and almanac are shared, not copied
+        restored_observatory, restored_scheduler = snapshot.restore()
+        assert(restored_observatory.sky_model is snapshot.observatory.sky_model)
+        assert(snapshot.observatory.mjd == mjd)
+        assert([survey.n_obs_added for survey in snapshot.scheduler.survey_lists[0]] == n_obs_added)
+
+    def testDetailerChain(self):
+        """
+        Setting a survey's detailers rebuilds the chain it runs them with
+        """
+        survey = gen_greedy_surveys(32)[0]
+        chain = survey._detailer_chain
+        new_detailers = [detailers.Zero_rot_detailer(nside=32), detailers.Zero_rot_detailer(nside=32)]
+        survey.detailers = new_detailers
+        assert(survey.detailers is new_detailers)
+        assert(survey._detailer_chain is not chain)
+        assert(survey._detailer_chain.detailers == new_detailers)
+
+    def testEnsemble(self):
+        """
+        Run two short simulations in parallel from the same shared data
+        """
+        nside = 32
+        out_dir = tempfile.mkdtemp()
+        try:
+            shared = load_shared_data(nside=nside)
+            configs = []
+            for i in range(2):
+                configs.append({'make_scheduler': ensemble_scheduler, 'survey_length': 0.2,
+                                'filename': os.path.join(out_dir, 'run%i.db' % i),
+                                'observatory_kwargs': {'seed': 42 + i}})
+            results = ensemble_runner(configs, shared=shared, n_workers=2, verbose=False)
+            assert(len(results) == 2)
+            for i, result in enumerate(results):
+                assert(result['error'] is None)
+                assert(result['index'] == i)
+                assert(result['filename'] == configs[i]['filename'])
+                assert(result['n_visits'] > 0)
+                con = sqlite3.connect(result['filename'])
+                n_rows = con.execute('select count(*) from SummaryAllProps').fetchone()[0]
+                con.close()
+                assert(n_rows == result['n_visits'])
+        finally:
+            shutil.rmtree(out_dir)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
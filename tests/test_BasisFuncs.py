@@ -2,7 +2,7 @@ import numpy as np
 import unittest
 import lsst.utils.tests
 import lsst.sims.featureScheduler.basis_functions as basis_functions
-from lsst.sims.featureScheduler.utils import empty_observation
+from lsst.sims.featureScheduler.utils import empty_observation, in_intervals
 from lsst.sims.featureScheduler.features import Conditions
 
 
@@ -35,6 +35,71 @@ class TestBasis(unittest.TestCase):
         conditions.mjd += delta
         self.assertEqual(np.max(bf(conditions)), 0.)
 
+    def testFeasibleIntervals(self):
+        # A night with twilight times an hour apart
+        conditions = Conditions()
+        conditions.night = 3
+        conditions.sunset = 59000.0
+        conditions.sun_n12_setting = 59000.04
+        conditions.sun_n18_setting = 59000.08
+        conditions.sun_n18_rising = 59000.40
+        conditions.sun_n12_rising = 59000.44
+        conditions.sunrise = 59000.48
+        conditions.sunAlt = np.radians(-30.)
+
+        bfs = [basis_functions.Not_twilight_basis_function(),
+               basis_functions.Time_to_twilight_basis_function(time_needed=60.),
+               basis_functions.End_of_evening_basis_function(time_remaining=60.),
+               basis_functions.Night_modulo_basis_function(pattern=[True, False])]
+        for bf in bfs:
+            intervals = None
+            for mjd in np.linspace(59000., 59000.48, 50):
+                conditions.mjd = mjd
+                if intervals is None:
+                    intervals = bf.feasible_intervals(conditions)
+                # Every time the check passes has to be in an interval
+                if bf.check_feasibility(conditions):
+                    assert(in_intervals(mjd, intervals))
+
+        # Night 3 is off for the modulo pattern
+        assert(bfs[-1].feasible_intervals(conditions).size == 0)
+
+        # Moon rise and set times are only known once the almanac has set them
+        moon_down = basis_functions.Moon_down_basis_function()
+        assert(Conditions().moonrise is None)
+        assert(moon_down.feasible_intervals(Conditions()) is None)
+        # Moon rises then sets during the night, and sets then rises
+        for moonrise, moonset in [(59000.2, 59000.35), (59000.35, 59000.2)]:
+            conditions.moonrise = moonrise
+            conditions.moonset = moonset
+            intervals = None
+            for mjd in np.linspace(59000., 59000.48, 50):
+                conditions.mjd = mjd
+                if moonrise < moonset:
+                    moon_up = moonrise < mjd < moonset
+                else:
+                    moon_up = (mjd < moonset) | (mjd > moonrise)
+                conditions.moonAlt = 0.2 if moon_up else -0.2
+                if intervals is None:
+                    intervals = moon_down.feasible_intervals(conditions)
+                assert(moon_down.check_feasibility(conditions) == (not moon_up))
+                if moon_down.check_feasibility(conditions):
+                    assert(in_intervals(mjd, intervals))
+
+        # The hour angle advances at the sidereal rate
+        ha_limit = basis_functions.Hour_Angle_limit_basis_function(RA=30., ha_limits=[[22., 24.], [0., 2.]])
+        intervals = None
+        n_feasible = 0
+        for mjd in np.linspace(59000., 59001., 200):
+            conditions.mjd = mjd
+            conditions.lmst = (5. + (mjd - 59000.)*24.*1.0027379093) % 24
+            if intervals is None:
+                intervals = ha_limit.feasible_intervals(conditions)
+            if ha_limit.check_feasibility(conditions):
+                n_feasible += 1
+                assert(in_intervals(mjd, intervals))
+        assert(n_feasible > 0)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -1,6 +1,8 @@
 import numpy as np
 import unittest
-from lsst.sims.featureScheduler.schedulers import Core_scheduler
+import asyncio
+from lsst.sims.featureScheduler.schedulers import (Core_scheduler, Scheduler_service, In_process_client,
+                                                   Scheduler_client)
 import lsst.sims.featureScheduler.basis_functions as basis_functions
 import lsst.sims.featureScheduler.surveys as surveys
 import lsst.utils.tests
@@ -36,6 +38,218 @@ class TestCoreSched(unittest.TestCase):
         # Check that we can add an observation
         scheduler.add_observation(obs)
 
+        # Feasibility checks were counted for each basis function
+        stats = scheduler.feasibility_stats()
+        assert(len(stats) == 2)
+        assert(np.all([row['calls'] > 0 for row in stats]))
+
+    def testSpeculation(self):
+        target_map = standard_goals()['r']
+
+        scheds = []
+        for i in range(2):
+            bfs = []
+            bfs.append(basis_functions.M5_diff_basis_function())
+            bfs.append(basis_functions.Target_map_basis_function(target_map=target_map))
+            weights = np.array([1., 1])
+            survey = surveys.Greedy_survey(bfs, weights)
+            scheds.append(Core_scheduler([survey]))
+
+        observatory = Model_observatory()
+        conditions = observatory.return_conditions()
+        obs = []
+        for scheduler in scheds:
+            scheduler.update_conditions(conditions)
+            obs.append(scheduler.request_observation())
+
+        # Predict correctly for one scheduler, the next request should match the serial one
+        scheds[1].speculate(obs[1], conditions)
+        for scheduler, ob in zip(scheds, obs):
+            scheduler.add_observation(ob)
+            scheduler.update_conditions(conditions)
+        next_obs = [scheduler.request_observation() for scheduler in scheds]
+        assert(scheds[1].speculation_hits == 1)
+        assert(next_obs[0]['RA'] == next_obs[1]['RA'])
+        assert(next_obs[0]['filter'] == next_obs[1]['filter'])
+
+        # A wrong prediction gets thrown away
+        scheds[1].speculate(obs[0], conditions)
+        scheds[1].flush_queue()
+        assert(scheds[1].speculation_misses == 1)
+
+        # The real observation differs from the predicted one, the queue gets recomputed
+        # from the real one and matches the serial scheduler
+        for scheduler in scheds:
+            scheduler.flush_queue()
+        predicted = next_obs[1].copy()
+        actual = next_obs[1].copy()
+        actual['RA'] = (actual['RA'] + 0.5) % (2.*np.pi)
+        scheds[1].speculate(predicted, conditions)
+        for scheduler in scheds:
+            scheduler.add_observation(actual)
+            scheduler.update_conditions(conditions)
+        replay_obs = [scheduler.request_observation() for scheduler in scheds]
+        assert(scheds[1].speculation_misses == 2)
+        assert(replay_obs[0]['RA'] == replay_obs[1]['RA'])
+        assert(replay_obs[0]['filter'] == replay_obs[1]['filter'])
+
+    def testPruning(self):
+        target_maps = standard_goals()
+
+        # Count the basis function evaluations of each scheduler
+        n_evals = [0, 0]
+
+        def count_evals(bf, j):
+            calc_value = bf._calc_value
+
+            def counted(conditions, **kwargs):
+                n_evals[j] += 1
+                return calc_value(conditions, **kwargs)
+            bf._calc_value = counted
+
+        scheds = []
+        for j, prune in enumerate([False, True]):
+            survey_list = []
+            for filtername, weight in zip(['r', 'g', 'i'], [1., 0.5, 0.2]):
+                bfs = []
+                bfs.append(basis_functions.M5_diff_basis_function(filtername=filtername))
+                bfs.append(basis_functions.Target_map_basis_function(filtername=filtername,
+                                                                     target_map=target_maps[filtername]))
+                weights = np.array([1., weight])
+                survey_list.append(surveys.Greedy_survey(bfs, weights, filtername=filtername))
+            # A survey that can never win, its bound comes from the constant alone
+            bfs = [basis_functions.M5_diff_basis_function(filtername='z'),
+                   basis_functions.Constant_basis_function()]
+            survey_list.append(surveys.Greedy_survey(bfs, np.array([0., -1000.]), filtername='z'))
+            for survey in survey_list:
+                for bf in survey.basis_functions:
+                    count_evals(bf, j)
+            scheds.append(Core_scheduler(survey_list, prune_surveys=prune))
+
+        observatory = Model_observatory()
+        conditions = observatory.return_conditions()
+        for i in range(3):
+            obs = []
+            for j, scheduler in enumerate(scheds):
+                scheduler.update_conditions(conditions)
+                obs.append(scheduler.request_observation())
+            # Pruning never changes which survey is picked
+            assert(scheds[0].survey_index == scheds[1].survey_index)
+            assert(obs[0]['RA'] == obs[1]['RA'])
+            assert(obs[0]['filter'] == obs[1]['filter'])
+            for scheduler, ob in zip(scheds, obs):
+                scheduler.add_observation(ob)
+            scheds[0].flush_queue()
+            scheds[1].flush_queue()
+        # Bounding shares its basis function values with the reward, so pruning never
+        # evaluates more basis functions, and the hopeless survey is never evaluated
+        assert(scheds[0].n_pruned == 0)
+        assert(scheds[1].n_pruned >= 3)
+        assert(n_evals[1] < n_evals[0])
+
+    def testMemoReset(self):
+        """
+        New conditions at the same mjd don't reuse the results surveys memoized for the old ones
+        """
+        target_map = standard_goals()['r']
+        bfs = [basis_functions.M5_diff_basis_function(filtername='r'),
+               basis_functions.Target_map_basis_function(filtername='r', target_map=target_map)]
+        survey = surveys.Blob_survey(bfs, np.array([1., 1.]), filtername1='r', filtername2=None)
+        scheduler = Core_scheduler([survey])
+        observatory = Model_observatory()
+        conditions = observatory.return_conditions()
+
+        scheduler.update_conditions(conditions)
+        memo = survey._decision_memo(conditions)
+        survey._calc_raw_reward(conditions)
+        raw_key = survey._raw_reward_key
+        # Within one decision, the results are reused
+        assert(survey._decision_memo(conditions) is memo)
+        survey._calc_raw_reward(conditions)
+        assert(survey._raw_reward_key == raw_key)
+
+        # Same object and mjd, but updated (e.g., a new cloud map)
+        scheduler.update_conditions(conditions)
+        assert(survey._decision_memo(conditions) is not memo)
+        survey._calc_raw_reward(conditions)
+        assert(survey._raw_reward_key != raw_key)
+
+    def testService(self):
+        target_map = standard_goals()['r']
+
+        bfs = []
+        bfs.append(basis_functions.M5_diff_basis_function())
+        bfs.append(basis_functions.Target_map_basis_function(target_map=target_map))
+        weights = np.array([1., 1])
+        survey = surveys.Greedy_survey(bfs, weights)
+        scheduler = Core_scheduler([survey])
+        service = Scheduler_service(scheduler)
+        client = In_process_client(service)
+
+        observatory = Model_observatory()
+
+        async def run():
+            await client.update_conditions(observatory.return_conditions())
+            obs = await client.request_observation()
+            await client.add_observation(obs)
+            status = await client.status()
+            return obs, status
+
+        obs, status = asyncio.run(run())
+        assert(obs is not None)
+        assert(obs.dtype == scheduler.queue.array.dtype)
+        assert(status['queue_length'] == 0)
+
+    def testServiceSocket(self):
+        """
+        Several clients connected to a service over TCP at once
+        """
+        target_map = standard_goals()['r']
+
+        bfs = []
+        bfs.append(basis_functions.M5_diff_basis_function())
+        bfs.append(basis_functions.Target_map_basis_function(target_map=target_map))
+        weights = np.array([1., 1])
+        survey = surveys.Greedy_survey(bfs, weights)
+        scheduler = Core_scheduler([survey])
+        service = Scheduler_service(scheduler)
+
+        observatory = Model_observatory()
+
+        async def run():
+            server = await service.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            clients = [Scheduler_client(port=port), Scheduler_client(port=port)]
+            try:
+                await clients[0].update_conditions(observatory.return_conditions())
+                # Interleaved calls from both clients, the scheduler handles them one at a time
+                observations = await asyncio.gather(clients[0].request_observation(),
+                                                    clients[1].request_observation(),
+                                                    clients[1].status())
+                await asyncio.gather(clients[1].add_observation(observations[1]),
+                                     clients[0].add_observation(observations[0]))
+                # An error is sent back, and the connection still works after it
+                error = None
+                try:
+                    await clients[0]._call({'type': 'not_a_message'})
+                except RuntimeError as err:
+                    error = err
+                status = await clients[0].status()
+            finally:
+                for client in clients:
+                    await client.close()
+                server.close()
+                await server.wait_closed()
+            return observations[:2], error, status
+
+        observations, error, status = asyncio.run(run())
+        for obs in observations:
+            assert(obs is not None)
+            assert(obs.dtype == scheduler.queue.array.dtype)
+        assert(error is not None)
+        assert(status['n_clients'] == 2)
+        assert(status['n_messages'] == 8)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
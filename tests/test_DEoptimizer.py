@@ -0,0 +1,133 @@
+import numpy as np
+import unittest
+import os
+import tempfile
+import shutil
+from lsst.sims.featureScheduler.Training import DE_optimizer
+import lsst.utils.tests
+
+
+class Noisy_sphere(object):
+    """Sum of squares plus noise, with the interface DE_optimizer expects of an evaluator
+    """
+    def __init__(self, D=3):
+        self.D = D
+        self.domain = np.array([[-5., 5.]] * D)
+        self.n_calls = 0
+
+    def target(self, x):
+        self.n_calls += 1
+        return np.sum(x**2) + 0.1*np.random.rand()
+
+    def refined_individual(self):
+        return np.zeros(self.D)
+
+
+class TestDEoptimizer(unittest.TestCase):
+
+    def setUp(self):
+        # The optimizer writes its last generation and Output/Output.txt to the working directory
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.mkdir('Output')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir)
+
+    def run_optimizer(self, **kwargs):
+        evaluator = Noisy_sphere()
+        optimizer = DE_optimizer(evaluator, 8, 0.8, 0.8, 3, show_progress=0, **kwargs)
+        return evaluator, optimizer
+
+    def testSeed(self):
+        """
+        Runs with the same seed match, with or without worker processes
+        """
+        evaluator, serial = self.run_optimizer(seed=7)
+        evaluator, again = self.run_optimizer(seed=7)
+        evaluator, parallel = self.run_optimizer(seed=7, n_workers=2)
+        evaluator, other = self.run_optimizer(seed=8)
+        assert(np.array_equal(serial.population, again.population))
+        assert(np.array_equal(serial.scores, again.scores))
+        assert(np.array_equal(serial.population, parallel.population))
+        assert(np.array_equal(serial.scores, parallel.scores))
+        assert(not np.array_equal(serial.population, other.population))
+
+    def testScoreLog(self):
+        """
+        A run with a score log does not score the logged candidates again
+        """
+        score_log = os.path.join(self.work_dir, 'scores.txt')
+        evaluator, first = self.run_optimizer(seed=7, score_log=score_log)
+        assert(evaluator.n_calls > 0)
+        n_logged = len(np.loadtxt(score_log, ndmin=2))
+        assert(n_logged == evaluator.n_calls)
+
+        evaluator, resumed = self.run_optimizer(seed=7, score_log=score_log)
+        assert(evaluator.n_calls == 0)
+        assert(np.array_equal(first.population, resumed.population))
+        assert(np.array_equal(first.scores, resumed.scores))
+
+        # A longer run only scores the new candidates
+        evaluator = Noisy_sphere()
+        longer = DE_optimizer(evaluator, 8, 0.8, 0.8, 5, show_progress=0, seed=7, score_log=score_log)
+        assert(0 < evaluator.n_calls < n_logged)
+
+    def testAsync(self):
+        """
+        Asynchronous generations run, with fewer or more workers than individuals
+        """
+        for n_workers in [2, 6]:
+            evaluator = Noisy_sphere()
+            optimizer = DE_optimizer(evaluator, 4, 0.8, 0.8, 3, show_progress=0, seed=7,
+                                     n_workers=n_workers, async_generations=True)
+            assert(optimizer.count == 3)
+            # Trials that repeat a scored candidate come from the cache
+            assert(0 < optimizer.nfeval <= 4*3)
+            assert(np.all(optimizer.scores < 1e99))
+
+    def testAsyncScoreLog(self):
+        """
+        Asynchronous generations don't score the candidates in the score log again
+        """
+        score_log = os.path.join(self.work_dir, 'scores.txt')
+        # Every candidate in this domain is the same
+        evaluator = Noisy_sphere()
+        evaluator.domain = np.array([[1., 1.]] * evaluator.D)
+        DE_optimizer(evaluator, 4, 0.8, 0.8, 2, show_progress=0, n_workers=2,
+                     async_generations=True, score_log=score_log)
+
+        def target(x):
+            raise ValueError('candidate scored again')
+        evaluator.target = target
+        optimizer = DE_optimizer(evaluator, 4, 0.8, 0.8, 2, show_progress=0, n_workers=2,
+                                 async_generations=True, score_log=score_log)
+        assert(optimizer.nfeval == 0)
+        assert(np.all(optimizer.scores < 1e99))
+
+    def testAsyncError(self):
+        """
+        An exception in a worker is raised by the optimizer
+        """
+        evaluator = Noisy_sphere()
+
+        def target(x):
+            raise ValueError('bad candidate')
+        evaluator.target = target
+        with self.assertRaises(ValueError):
+            DE_optimizer(evaluator, 8, 0.8, 0.8, 3, show_progress=0, n_workers=2, async_generations=True)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
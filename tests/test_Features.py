@@ -1,7 +1,8 @@
 import numpy as np
 import unittest
 import lsst.sims.featureScheduler.features as features
-from lsst.sims.featureScheduler.utils import empty_observation
+from lsst.sims.featureScheduler.utils import empty_observation, approx_altaz2pa
+from lsst.sims.utils import _approx_RaDec2AltAz, _angularSeparation
 import lsst.utils.tests
 
 
@@ -31,6 +32,59 @@ class TestFeatures(unittest.TestCase):
         pin.add_observation(obs, indx=indx)
         self.assertEqual(np.max(pin.feature), 2.)
 
+    def testConditionsAltAz(self):
+        conditions = features.Conditions(nside=32)
+        for mjd in [59853.1, 59853.3, 60200.7]:
+            conditions.mjd = mjd
+            alt, az = _approx_RaDec2AltAz(conditions.ra, conditions.dec, conditions.site.latitude_rad,
+                                          conditions.site.longitude_rad, mjd)
+            pa = approx_altaz2pa(alt, az, conditions.site.latitude_rad)
+            assert(np.allclose(conditions.alt, alt, atol=1e-8))
+            # Compare angles, so 0 and 2pi agree
+            assert(np.allclose(np.cos(conditions.az), np.cos(az), atol=1e-6))
+            assert(np.allclose(np.sin(conditions.az), np.sin(az), atol=1e-6))
+            assert(np.allclose(np.cos(conditions.pa), np.cos(pa), atol=1e-6))
+            assert(np.allclose(np.sin(conditions.pa), np.sin(pa), atol=1e-6))
+
+    def testConditionsDerivedMaps(self):
+        conditions = features.Conditions(nside=32)
+        conditions.mjd = 59853.3
+        conditions.moonAz = 1.
+        conditions.moonAlt = 0.5
+        conditions.planet_positions = {'venus_RA': 1., 'venus_dec': 0., 'mars_RA': 4., 'mars_dec': -0.5,
+                                       'jupiter_RA': 5., 'jupiter_dec': 0.2}
+        moon_distance = conditions.moon_distance
+        assert(np.allclose(moon_distance, _angularSeparation(conditions.az, conditions.alt, 1., 0.5)))
+        # Cached until the mjd changes
+        assert(conditions.moon_distance is moon_distance)
+        mask = conditions.planet_mask(3.5)
+        assert(mask.sum() > 0)
+        assert(conditions.planet_mask(3.5) is mask)
+        conditions.mjd += 0.1
+        assert(conditions.moon_distance is not moon_distance)
+        assert(conditions.planet_mask(3.5) is not mask)
+
+        # Or until a position they are computed from is set, at the same mjd
+        moon_distance = conditions.moon_distance
+        conditions.moonAlt = -0.5
+        assert(np.allclose(conditions.moon_distance,
+                           _angularSeparation(conditions.az, conditions.alt, 1., -0.5)))
+        conditions.sunRA = 2.
+        conditions.sunDec = 0.1
+        sun_distance = conditions.sun_distance
+        assert(np.allclose(sun_distance, _angularSeparation(conditions.ra, conditions.dec, 2., 0.1)))
+        conditions.sunRA = 3.
+        assert(np.allclose(conditions.sun_distance, _angularSeparation(conditions.ra, conditions.dec, 3., 0.1)))
+        mask = conditions.planet_mask(3.5)
+        conditions.planet_positions = {'venus_RA': 2., 'venus_dec': 0.5, 'mars_RA': 3., 'mars_dec': -0.2,
+                                       'jupiter_RA': 6., 'jupiter_dec': 0.}
+        assert(not np.array_equal(conditions.planet_mask(3.5), mask))
+        moon_distance = conditions.moon_distance
+        conditions.lmst = conditions.lmst + 1.
+        assert(conditions.moon_distance is not moon_distance)
+        assert(np.allclose(conditions.moon_distance,
+                           _angularSeparation(conditions.az, conditions.alt, 1., -0.5)))
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -1,7 +1,14 @@
 import numpy as np
 import unittest
-from lsst.sims.featureScheduler.utils import season_calc, create_season_offset
+import os
+import tempfile
+import shutil
+from lsst.sims.featureScheduler.utils import (season_calc, create_season_offset, empty_observation,
+                                              ObservationBatch, neighbor_disks, int_rounded, season_map,
+                                              generate_goal_map, set_footprint_cache_dir,
+                                              footprint_cache_dir, hp_kd_tree, comcamTessellate)
 import lsst.utils.tests
+from lsst.sims.utils import _hpid2RaDec, _angularSeparation
 import healpy as hp
 
 
@@ -33,6 +40,105 @@ class TestFeatures(unittest.TestCase):
         mod3 = season_calc(night, modulo=3, offset=-365.25*10)
         assert(mod3 == -1)
 
+    def testObservationBatch(self):
+        """
+        Test that an ObservationBatch pops from the front and writes through views
+        """
+        observations = empty_observation(n=5)
+        observations['RA'] = np.arange(5)
+        batch = ObservationBatch(observations)
+        assert(len(batch) == 5)
+
+        obs = batch.pop(0)
+        assert(obs['RA'] == 0)
+        assert(len(batch) == 4)
+        assert(batch[0]['RA'] == 1)
+
+        # Writing to an observation updates the batch
+        for obs in batch:
+            obs['dec'] = 1.
+        assert(np.all(batch.array['dec'] == 1.))
+
+        # Slicing and adding works like a list
+        rolled = batch[2:] + batch[:2]
+        np.testing.assert_array_equal(rolled.array['RA'], [3, 4, 1, 2])
+
+        # Lists (with None entries) can be converted
+        batch = ObservationBatch.from_list([empty_observation(), None, empty_observation()])
+        assert(len(batch) == 2)
+        assert(len(ObservationBatch()) == 0)
+
+    def testNeighborDisks(self):
+        """
+        Test the precomputed neighbor disks match a search of the full map
+        """
+        nside = 8
+        radius = np.radians(30.)
+        disks = neighbor_disks(nside=nside, radius=radius)
+        # Built once per nside and radius
+        assert(neighbor_disks(nside=nside, radius=radius) is disks)
+
+        ra, dec = _hpid2RaDec(nside, np.arange(hp.nside2npix(nside)))
+        for hpid in [0, 100, 300, hp.nside2npix(nside)-1]:
+            dists = _angularSeparation(ra[hpid], dec[hpid], ra, dec)
+            expected = np.where(int_rounded(dists) <= int_rounded(radius))[0]
+            np.testing.assert_array_equal(disks[hpid], expected)
+
+    def testSeasonMap(self):
+        """
+        Test the shared season map matches season_calc and is computed once per night
+        """
+        nside = 8
+        offset = create_season_offset(nside, 0.)
+        kwargs = {'offset': offset, 'modulo': 2, 'max_season': 4}
+        night = 400
+        seasons = season_map(night, **kwargs)
+        np.testing.assert_array_equal(seasons.seasons, season_calc(night, **kwargs))
+        assert(season_map(night, **kwargs) is seasons)
+        assert(season_map(night + 1, **kwargs) is not seasons)
+
+        indx = np.arange(0, hp.nside2npix(nside), 3)
+        for groups, pix in [(seasons.groups(), np.arange(hp.nside2npix(nside))), (seasons.groups(indx), indx)]:
+            found = np.concatenate([positions for season, positions in groups])
+            assert(found.size == pix.size)
+            for season, positions in groups:
+                np.testing.assert_array_equal(positions, np.where(seasons.seasons[pix] == season)[0])
+
+    def testFootprintCache(self):
+        """
+        Test generated footprints are cached on disk and reloaded unchanged
+        """
+        previous_dir = footprint_cache_dir()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            set_footprint_cache_dir(None)
+            expected = generate_goal_map(nside=8, NES_fraction=0.2)
+            set_footprint_cache_dir(cache_dir)
+            first = generate_goal_map(nside=8, NES_fraction=0.2)
+            assert(len(os.listdir(os.path.join(cache_dir, 'footprints'))) > 0)
+            second = generate_goal_map(nside=8, NES_fraction=0.2)
+            np.testing.assert_array_equal(first, expected)
+            np.testing.assert_array_equal(second, expected)
+            # Cached maps come back as regular arrays
+            assert(type(second) is np.ndarray)
+            # Different arguments get their own map
+            assert(not np.array_equal(generate_goal_map(nside=8, NES_fraction=0.4), expected))
+        finally:
+            set_footprint_cache_dir(previous_dir)
+            shutil.rmtree(cache_dir)
+
+    def testSharedTrees(self):
+        """
+        Test kd-trees and tessellations are only built once
+        """
+        tree = hp_kd_tree(nside=8)
+        assert(hp_kd_tree(nside=8) is tree)
+        assert(hp_kd_tree(nside=8, leafsize=300) is not tree)
+        fields = comcamTessellate()
+        fields['RA'] = 0.
+        # Modifying a returned tessellation doesn't change the cached one
+        assert(np.max(comcamTessellate()['RA']) > 0)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass